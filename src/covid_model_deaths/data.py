@@ -1,3 +1,5 @@
+from typing import Dict, List, Tuple
+
 import numpy as np
 import pandas as pd
 
@@ -8,34 +10,83 @@ from covid_model_deaths.preprocessing import expanding_moving_average_by_locatio
 def compute_backcast_log_age_specific_death_rates(df: pd.DataFrame, age_pop_df: pd.DataFrame,
                                                   age_death_df: pd.DataFrame, standardize_location_id: int,
                                                   subnat: bool, rate_threshold: int) -> pd.DataFrame:
+    backcast = compute_backcast_log_age_specific_death_rates_by_location(df, age_pop_df, age_death_df,
+                                                                         [standardize_location_id],
+                                                                         subnat, rate_threshold)
+    return backcast[standardize_location_id]
+
+
+def compute_backcast_log_age_specific_death_rates_by_location(df: pd.DataFrame, age_pop_df: pd.DataFrame,
+                                                              age_death_df: pd.DataFrame,
+                                                              standardize_location_ids: List[int],
+                                                              subnat: bool, rate_threshold: int) -> Dict[int, pd.DataFrame]:
+    """Age-standardizes and backcasts the death data for many standard locations at once.
+
+    The age-standardized death rate is the ratio of the true to the implied
+    death rate scaled by the implied death rate of the standard location, so
+    the location independent processing is done once and the remaining steps
+    run a single time over copies of the data stacked by standard location.
+
+    Parameters
+    ----------
+    df
+        The death data.
+    age_pop_df
+        The population and age group weights by location.
+    age_death_df
+        The death rates by age and location.
+    standardize_location_ids
+        The locations whose age structure we are standardizing to.
+    subnat
+        Whether to drop national level data.
+    rate_threshold
+        The minimum log age-standardized death rate to model.
+
+    Returns
+    -------
+        A mapping between each standard location id and the backcast
+        log age-standardized death rates standardized to it.
+
+    """
     df = process_death_df(df, subnat)
     # get implied death rate based on "standard" population (using average
     # of all possible locations atm)
     standard_age_death_df = get_standard_age_death_df(age_death_df)
-    location_to_standardize = age_pop_df[COLUMNS.location_id] == standardize_location_id
-    age_pattern_df = age_pop_df.loc[location_to_standardize].merge(standard_age_death_df)
+    implied_death_rate = get_implied_death_rate(standard_age_death_df, age_pop_df)
+    return standardize_and_backcast(df, implied_death_rate, standardize_location_ids, rate_threshold)
 
-    implied_df = standard_age_death_df.merge(age_pop_df)
-    implied_df[COLUMNS.implied_death_rate] = implied_df[COLUMNS.death_rate_bad] * implied_df[COLUMNS.age_group_weight]
-    implied_df = implied_df.groupby(COLUMNS.location_id, as_index=False)[COLUMNS.implied_death_rate].sum()
-    df = df.merge(implied_df)
+
+def standardize_and_backcast(df: pd.DataFrame, implied_death_rate: pd.Series,
+                             standardize_location_ids: List[int], rate_threshold: int) -> Dict[int, pd.DataFrame]:
+    """Runs the standardization and backcast on processed death data.
+
+    Every step here works location by location, so it can be run on any
+    subset of the locations or on a trailing window of a location's data.
+
+    """
+    df = df.merge(implied_death_rate.reset_index())
+
+    # stack a copy of the data for each standard location, keyed by a
+    # surrogate location id so the by-location steps stay separate
+    standardize_location_ids = list(dict.fromkeys(standardize_location_ids))
+    location_ids, location_codes = np.unique(df[COLUMNS.location_id].values, return_inverse=True)
+    n_rows, n_locations = len(df), len(location_ids)
+    df = df.iloc[np.tile(np.arange(n_rows), len(standardize_location_ids))].reset_index(drop=True)
+    standard_index = np.repeat(np.arange(len(standardize_location_ids)), n_rows)
+    df[COLUMNS.location_id] = standard_index * n_locations + np.tile(location_codes, len(standardize_location_ids))
 
     # age-standardize
-    df[COLUMNS.age_standardized_death_rate] = df.apply(
-        lambda x: get_asdr(
-            x[COLUMNS.death_rate],
-            x[COLUMNS.implied_death_rate],
-            age_pattern_df),
-        axis=1)
+    standard_rate = implied_death_rate.reindex(standardize_location_ids).values[standard_index]
+    df[COLUMNS.age_standardized_death_rate] = get_asdr(df[COLUMNS.death_rate].values,
+                                                       df[COLUMNS.implied_death_rate].values,
+                                                       standard_rate)
     df[COLUMNS.ln_age_death_rate] = np.log(df[COLUMNS.age_standardized_death_rate])
 
     # keep above our threshold death rate, start counting days from there
     df = df.loc[df[COLUMNS.ln_age_death_rate] >= rate_threshold]
 
-    df[COLUMNS.day1] = df.groupby([COLUMNS.country, COLUMNS.location], as_index=False)[COLUMNS.date].transform('min')
-    df[COLUMNS.days] = df[COLUMNS.date] - df[COLUMNS.day1]
-    df[COLUMNS.days] = df[COLUMNS.days].apply(lambda x: x.days)
-    del df[COLUMNS.day1]
+    day1 = df.groupby(COLUMNS.location_id)[COLUMNS.date].transform('min')
+    df[COLUMNS.days] = (df[COLUMNS.date] - day1).dt.days
 
     # for Hubei, move it a few days out
     # TODO: document this better.
@@ -51,8 +102,209 @@ def compute_backcast_log_age_specific_death_rates(df: pd.DataFrame, age_pop_df:
     df = add_days_since_last_day_of_two_deaths(df)
 
     # interpolate back to threshold
-    df = backcast_all_locations(df, rate_threshold)
-    return df.reset_index(drop=True)
+    no_backcast_codes = np.flatnonzero(np.isin(location_ids, [LOCATIONS.life_care.id]))
+    no_backcast_ids = (np.arange(len(standardize_location_ids))[:, np.newaxis] * n_locations
+                       + no_backcast_codes).ravel().tolist()
+    df = backcast_all_locations(df, rate_threshold, no_backcast_location_ids=no_backcast_ids)
+
+    # unstack back to the original location ids
+    surrogate_ids = df[COLUMNS.location_id].to_numpy(copy=True)
+    df[COLUMNS.location_id] = location_ids[surrogate_ids % n_locations]
+    standard_index = surrogate_ids // n_locations
+    return {location_id: df.loc[standard_index == i].reset_index(drop=True)
+            for i, location_id in enumerate(standardize_location_ids)}
+
+
+class IncrementalBackcast:
+    """Age-standardizes and backcasts death data, reusing the previous run's results.
+
+    Each daily update appends a day of deaths, and every step of the
+    backcast only looks a few days forward or back, so for locations whose
+    history is unchanged only a trailing window of their data is recomputed
+    and spliced onto the previous results.  Locations that are new, whose
+    history was revised, whose new data could move their start date, or
+    whose trailing window does not reproduce the previous results where the
+    two overlap are recomputed in full.
+
+    Results are kept by standard location, so the locations can be computed
+    a few at a time, and the death data they came from is shared between
+    them when it's the same.  Instances hold no open resources, so they can
+    be written to a :class:`covid_model_deaths.deaths_io.Checkpoint` and
+    loaded on the next run.
+
+    Parameters
+    ----------
+    margin_days
+        The number of days at the end of the previous data that may change
+        when new data arrives.  Must cover the moving average window and
+        its endpoint correction.
+    average_window
+        The window at the start of the data used to compute the backcast
+        daily change, which must never be recomputed incrementally.
+
+    """
+
+    def __init__(self, margin_days: int = 4, average_window: int = 5):
+        self.margin_days = margin_days
+        self.average_window = average_window
+        self._states = {}
+
+    def compute(self, df: pd.DataFrame, age_pop_df: pd.DataFrame, age_death_df: pd.DataFrame,
+                standardize_location_ids: List[int], subnat: bool, rate_threshold: int) -> Dict[int, pd.DataFrame]:
+        """Same as :func:`compute_backcast_log_age_specific_death_rates_by_location`."""
+        df = process_death_df(df, subnat)
+        standard_age_death_df = get_standard_age_death_df(age_death_df)
+        implied_death_rate = get_implied_death_rate(standard_age_death_df, age_pop_df)
+        standardize_location_ids = list(dict.fromkeys(standardize_location_ids))
+
+        key = (subnat, rate_threshold, int(pd.util.hash_pandas_object(implied_death_rate).sum()))
+        # the death data and backcast each standard location was last computed from and to
+        state = self._states.setdefault(key, {'death_df': {}, 'backcast': {}})
+        for previous_df in {id(d): d for d in state['death_df'].values()}.values():
+            if previous_df.equals(df):
+                # keep one copy of the data, however many calls it takes to compute every location
+                df = previous_df
+                break
+        cached_ids = [i for i in standardize_location_ids if i in state['backcast']]
+        new_ids = [i for i in standardize_location_ids if i not in state['backcast']]
+
+        backcast = {}
+        if new_ids:
+            backcast.update(standardize_and_backcast(df, implied_death_rate, new_ids, rate_threshold))
+        # locations last computed from the same data are updated together
+        cached_by_data = {}
+        for location_id in cached_ids:
+            cached_by_data.setdefault(id(state['death_df'][location_id]), []).append(location_id)
+        for location_ids in cached_by_data.values():
+            cached = {location_id: state['backcast'][location_id] for location_id in location_ids}
+            backcast.update(self._update(state['death_df'][location_ids[0]], cached, df, implied_death_rate,
+                                         location_ids, rate_threshold))
+
+        backcast = {i: backcast[i] for i in standardize_location_ids}
+        for location_id in standardize_location_ids:
+            state['death_df'][location_id] = df
+            state['backcast'][location_id] = backcast[location_id]
+        return backcast
+
+    def _update(self, previous_df: pd.DataFrame, cached: Dict[int, pd.DataFrame], df: pd.DataFrame,
+                implied_death_rate: pd.Series, standardize_location_ids: List[int],
+                rate_threshold: int) -> Dict[int, pd.DataFrame]:
+        previous_last_date = self._get_append_only_last_dates(previous_df, df)
+        last_date = df.groupby(COLUMNS.location_id)[COLUMNS.date].max().reindex(previous_last_date.index)
+        unchanged = previous_last_date.index[last_date == previous_last_date]
+        splice_date = previous_last_date.drop(unchanged) - pd.Timedelta(days=self.margin_days)
+        slice_start = splice_date - pd.Timedelta(days=2 * self.margin_days)
+
+        # the start date and backcast must come entirely from the previous results
+        can_splice = pd.Series(True, index=splice_date.index)
+        for location_id in standardize_location_ids:
+            two_date = cached[location_id].groupby(COLUMNS.location_id)[COLUMNS.two_date].min().reindex(
+                splice_date.index)
+            can_splice &= slice_start > two_date + pd.Timedelta(days=self.average_window + 1)
+        splice_date = splice_date.loc[can_splice]
+        slice_start = slice_start.loc[can_splice]
+
+        # recompute everything else in full and the spliced locations from
+        # the last row before their slice start
+        location_slice_start = df[COLUMNS.location_id].map(slice_start)
+        in_slice = df[COLUMNS.date] >= location_slice_start
+        in_slice |= in_slice.groupby(df[COLUMNS.location_id]).shift(-1, fill_value=False)
+        incremental = df[COLUMNS.location_id].isin(splice_date.index)
+        full = ~incremental & ~df[COLUMNS.location_id].isin(unchanged)
+        recomputed = self._recompute(df.loc[full | (incremental & in_slice)], implied_death_rate,
+                                     standardize_location_ids, rate_threshold, cached)
+
+        backcast, failed = {}, set()
+        for location_id in standardize_location_ids:
+            backcast[location_id], spliced_failed = self._splice(cached[location_id],
+                                                                 recomputed[location_id], splice_date, unchanged)
+            failed |= spliced_failed
+        if failed:
+            failed = sorted(failed)
+            recomputed = self._recompute(df.loc[df[COLUMNS.location_id].isin(failed)], implied_death_rate,
+                                         standardize_location_ids, rate_threshold, cached)
+            for location_id in standardize_location_ids:
+                spliced = backcast[location_id]
+                spliced = spliced.loc[~spliced[COLUMNS.location_id].isin(failed)]
+                backcast[location_id] = self._sort(pd.concat([spliced, recomputed[location_id]], sort=False))
+        return backcast
+
+    @staticmethod
+    def _recompute(df: pd.DataFrame, implied_death_rate: pd.Series, standardize_location_ids: List[int],
+                   rate_threshold: int, cached: Dict[int, pd.DataFrame]) -> Dict[int, pd.DataFrame]:
+        if df.empty:
+            return {location_id: cached[location_id].iloc[:0] for location_id in standardize_location_ids}
+        return standardize_and_backcast(df, implied_death_rate, standardize_location_ids, rate_threshold)
+
+    @staticmethod
+    def _get_append_only_last_dates(previous_df: pd.DataFrame, df: pd.DataFrame) -> pd.Series:
+        """Finds the locations whose new data only adds days, and their previous last date."""
+        index_columns = [COLUMNS.location_id, COLUMNS.date]
+        previous_last_date = previous_df.groupby(COLUMNS.location_id)[COLUMNS.date].max()
+        compare = previous_df.merge(df, on=index_columns, how='outer', suffixes=('_previous', ''), indicator=True)
+        compare['previous_last_date'] = compare[COLUMNS.location_id].map(previous_last_date)
+
+        revised = compare['_merge'] == 'left_only'
+        revised |= (compare['_merge'] == 'right_only') & (compare[COLUMNS.date] <= compare['previous_last_date'])
+        for column in previous_df.columns.difference(index_columns + [COLUMNS.days]):
+            values, previous_values = compare[column], compare[f'{column}_previous']
+            revised |= (compare['_merge'] == 'both') & (values != previous_values) & values.notnull()
+            revised |= (compare['_merge'] == 'both') & (values.isnull() != previous_values.isnull())
+        # a new day with two deaths can move the date we start counting from
+        new_day = compare[COLUMNS.date] > compare['previous_last_date']
+        revised |= new_day & (compare[COLUMNS.deaths] == 2)
+
+        append_only = ~compare[COLUMNS.location_id].isin(compare.loc[revised, COLUMNS.location_id])
+        append_only &= compare['previous_last_date'].notnull()
+        return previous_last_date.loc[compare.loc[append_only, COLUMNS.location_id].unique()]
+
+    def _splice(self, cached: pd.DataFrame, recomputed: pd.DataFrame,
+                splice_date: pd.Series, unchanged: pd.Index) -> Tuple[pd.DataFrame, set]:
+        """Splices the recomputed trailing windows onto the cached results."""
+        cached = cached.loc[cached[COLUMNS.location_id].isin(unchanged.union(splice_date.index))]
+        location_splice_date = cached[COLUMNS.location_id].map(splice_date)
+        keep = cached[COLUMNS.date].isnull() | ~(cached[COLUMNS.date] >= location_splice_date)
+        dated = cached.loc[cached[COLUMNS.date].notnull()]
+        two_date = dated.groupby(COLUMNS.location_id)[COLUMNS.two_date].min()
+        day_shift = (dated[COLUMNS.days] - (dated[COLUMNS.date] - dated[COLUMNS.two_date]).dt.days).groupby(
+            dated[COLUMNS.location_id]).first()
+
+        location_splice_date = recomputed[COLUMNS.location_id].map(splice_date)
+        spliced = recomputed[COLUMNS.date] >= location_splice_date
+        overlap = ~spliced & (recomputed[COLUMNS.date] >= location_splice_date - pd.Timedelta(days=self.margin_days))
+        new_rows = recomputed.loc[spliced].copy()
+        new_rows[COLUMNS.two_date] = new_rows[COLUMNS.location_id].map(two_date)
+        new_rows[COLUMNS.last_day_two] = pd.NaT
+        new_rows[COLUMNS.days] = ((new_rows[COLUMNS.date] - new_rows[COLUMNS.two_date]).dt.days
+                                  + new_rows[COLUMNS.location_id].map(day_shift))
+
+        # the trailing window must reproduce the cached results where they overlap
+        compare_columns = [COLUMNS.deaths, COLUMNS.ln_age_death_rate, COLUMNS.obs_ln_age_death_rate]
+        index_columns = [COLUMNS.location_id, COLUMNS.date]
+        compare = recomputed.loc[overlap, index_columns + compare_columns].merge(
+            cached.loc[cached[COLUMNS.date].notnull(), index_columns + compare_columns],
+            on=index_columns, how='left', suffixes=('', '_cached')
+        )
+        matches = pd.Series(True, index=compare.index)
+        for column in compare_columns:
+            matches &= np.isclose(compare[column], compare[f'{column}_cached'], rtol=1e-10, atol=0, equal_nan=True)
+        expected_overlap = splice_date.index[splice_date.index.isin(cached[COLUMNS.location_id])]
+        failed = set(compare.loc[~matches, COLUMNS.location_id])
+        failed |= set(expected_overlap.difference(compare[COLUMNS.location_id]))
+
+        full = ~recomputed[COLUMNS.location_id].isin(splice_date.index)
+        df = pd.concat([cached.loc[keep], new_rows, recomputed.loc[full]], sort=False)
+        return self._sort(df), failed
+
+    @staticmethod
+    def _sort(df: pd.DataFrame) -> pd.DataFrame:
+        df = df.sort_values([COLUMNS.location_id, COLUMNS.days]).reset_index(drop=True)
+        # changes in rate run across the splice
+        dated = df[COLUMNS.date].notnull()
+        by_location = df.loc[dated].groupby(COLUMNS.location_id)
+        df.loc[dated, COLUMNS.delta_ln_asdr] = by_location[COLUMNS.ln_age_death_rate].diff()
+        df.loc[dated, COLUMNS.observed_delta_ln_asdr] = by_location[COLUMNS.obs_ln_age_death_rate].diff()
+        return df
 
 
 ####################
@@ -98,9 +350,23 @@ def get_standard_age_death_df(age_death_df: pd.DataFrame) -> pd.DataFrame:
     return age_death_df.loc[global_loc, keep_columns].reset_index(drop=True)
 
 
-def get_asdr(true_rate, implied_rate, age_pattern_df: pd.DataFrame):
-    scaled_rate = age_pattern_df['death_rate'] * (true_rate / implied_rate)
-    return (scaled_rate * age_pattern_df['age_group_weight_value']).sum()
+def get_implied_death_rate(standard_age_death_df: pd.DataFrame, age_pop_df: pd.DataFrame) -> pd.Series:
+    """Compute the death rate implied by the standard age pattern by location."""
+    implied_df = standard_age_death_df.merge(age_pop_df)
+    implied_df[COLUMNS.implied_death_rate] = implied_df[COLUMNS.death_rate_bad] * implied_df[COLUMNS.age_group_weight]
+    return implied_df.groupby(COLUMNS.location_id)[COLUMNS.implied_death_rate].sum()
+
+
+def get_asdr(true_rate: np.ndarray, implied_rate: np.ndarray, standard_rate: np.ndarray) -> np.ndarray:
+    """Age-standardize the true death rate.
+
+    Scaling the standard age pattern by the ratio of the true to implied
+    death rate and summing over the standard location's age weights is the
+    same as scaling that location's implied death rate, so this works
+    element-wise over whole columns.
+
+    """
+    return true_rate / implied_rate * standard_rate
 
 
 def drop_lagged_deaths_by_location(data: pd.DataFrame) -> pd.DataFrame:
@@ -117,13 +383,11 @@ def drop_lagged_deaths_by_location(data: pd.DataFrame) -> pd.DataFrame:
 
     """
     required_columns = [COLUMNS.location_id, COLUMNS.date, COLUMNS.deaths]
-    lagged_deaths = (
-        data.loc[:, required_columns]
-            .groupby(COLUMNS.location_id, as_index=False)
-            .apply(lambda x: ((x[COLUMNS.date] == x[COLUMNS.date].max())
-                              & (x[COLUMNS.deaths] == x[COLUMNS.deaths].shift(1))))
-            .droplevel(0)
-    )
+    assert set(required_columns).issubset(data.columns)
+    by_location = data.groupby(COLUMNS.location_id)
+    last_date = by_location[COLUMNS.date].transform('max')
+    previous_deaths = by_location[COLUMNS.deaths].shift(1)
+    lagged_deaths = (data[COLUMNS.date] == last_date) & (data[COLUMNS.deaths] == previous_deaths)
     return data.loc[~lagged_deaths]
 
 
@@ -166,17 +430,16 @@ def add_days_since_last_day_of_two_deaths(data: pd.DataFrame) -> pd.DataFrame:
     # make sure we still start at last day of two deaths
     required_columns = [COLUMNS.location_id, COLUMNS.date, COLUMNS.deaths]
     assert set(required_columns).issubset(data.columns)
-    data['last_day_two'] = (data
-                            .loc[data[COLUMNS.deaths] == 2]
-                            .groupby(COLUMNS.location_id, as_index=False)[COLUMNS.date]
-                            .transform('max'))
-    data = data.loc[(data['last_day_two'].isnull()) | (data[COLUMNS.date] == data['last_day_two'])]
-    data['two_date'] = data.groupby(COLUMNS.location_id, as_index=False)[COLUMNS.date].transform('min')
+    two_deaths = data[COLUMNS.deaths] == 2
+    two_death_dates = data[COLUMNS.date].where(two_deaths)
+    last_day_two = two_death_dates.groupby(data[COLUMNS.location_id]).transform('max').where(two_deaths)
+    data = data.loc[last_day_two.isnull() | (data[COLUMNS.date] == last_day_two)].copy()
+    data[COLUMNS.last_day_two] = last_day_two
+    data[COLUMNS.two_date] = data.groupby(COLUMNS.location_id)[COLUMNS.date].transform('min')
 
     # just want second death on, and only where total deaths
-    data = data.loc[data[COLUMNS.date] >= data['two_date']]
-    data[COLUMNS.days] = data[COLUMNS.date] - data['two_date']
-    data[COLUMNS.days] = data[COLUMNS.days].dt.days
+    data = data.loc[data[COLUMNS.date] >= data[COLUMNS.two_date]]
+    data[COLUMNS.days] = (data[COLUMNS.date] - data[COLUMNS.two_date]).dt.days
     data = data.sort_values([COLUMNS.location_id, COLUMNS.date]).reset_index(drop=True)
     # FIXME: I'm like 90% sure these columns aren't used anywhere else.
     #  But they get written to outputs.
@@ -0,0 +1,73 @@
+"""Batched post-processing of model draws.
+
+Groups whose draws have the same shape are stacked into one
+(groups x draws x days) array and sorted, combined and cumulated
+together, instead of one group at a time.
+"""
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+Draws = Tuple[np.ndarray, np.ndarray]
+
+
+def group_batches(draws: Mapping[str, Draws]) -> List[List[str]]:
+    """Groups whose draws have the same shape, which can be processed together."""
+    batches = {}
+    for group, (_, group_draws) in draws.items():
+        batches.setdefault(group_draws.shape, []).append(group)
+    return list(batches.values())
+
+
+def sort_draws(draws: np.ndarray) -> np.ndarray:
+    """Orders the draws (second to last axis) by their value on the last day."""
+    order = np.argsort(draws[..., -1], axis=-1)
+    return np.take_along_axis(draws, order[..., np.newaxis], axis=-2)
+
+
+def cumulative_draws(daily_draws: np.ndarray, last_obs) -> np.ndarray:
+    """ln(exp(last_obs) + cumulative sum of exp(daily_draws)) along the last axis.
+
+    Computed in log space, so large values don't overflow.  ``last_obs`` is
+    a scalar, or one value per group for stacked (groups x draws x days)
+    draws.
+    """
+    last_obs = np.reshape(last_obs, np.shape(last_obs) + (1, 1))
+    cumulative = np.logaddexp.accumulate(daily_draws, axis=-1)
+    return np.logaddexp(cumulative, last_obs, out=cumulative)
+
+
+def batch_process_draws(draws: Mapping[str, Draws], last_obs: Mapping[str, float],
+                        other_draws: Optional[Mapping[str, Draws]] = None,
+                        combine: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None
+                        ) -> Dict[str, Draws]:
+    """Sorted, cumulative draws for each group, optionally combined with a second set of draws.
+
+    Parameters
+    ----------
+    draws
+        Days and an (n_draws x days) array of daily draws in log space, by group.
+    last_obs
+        Log of the last observation for each group, where its cumulative draws start.
+    other_draws
+        Draws to combine with ``draws``, with the same groups and shapes.
+    combine
+        Combines two sorted (n x days) arrays of draws, row by row.
+
+    Returns
+    -------
+        Days and cumulative draws by group, in the order of ``draws``.
+
+    """
+    processed = {}
+    for batch in group_batches(draws):
+        stacked = sort_draws(np.stack([draws[group][1] for group in batch]))
+        if other_draws is not None:
+            other_stacked = sort_draws(np.stack([other_draws[group][1] for group in batch]))
+            n_groups, n_draws, n_days = stacked.shape
+            stacked = combine(stacked.reshape(-1, n_days),
+                              other_stacked.reshape(-1, n_days)).reshape(n_groups, n_draws, n_days)
+        cumulative = cumulative_draws(stacked, [last_obs[group] for group in batch])
+        for group, group_draws in zip(batch, cumulative):
+            processed[group] = (draws[group][0], group_draws)
+    return {group: processed[group] for group in draws}
@@ -5,12 +5,19 @@ import dill as pickle
 import numpy as np
 import pandas as pd
 
+from covid_model_deaths.globals import FINAL_DATE
+from covid_model_deaths.job_outputs import has_job_outputs, JobOutputs
+
 
 class Drawer:
-    """Aggregates draws and stuff."""
+    """Aggregates draws and stuff.
+
+    Draws, and the draw columns of its frames, are of type ``dtype``;
+    np.float32 halves their memory.
+    """
 
     def __init__(self, ensemble_dirs, n_draws_list, location_name, location_id, peak_duration,
-                 obs_df, date_draws, population, final_date='2020-07-15', tag='location_id'):
+                 obs_df, date_draws, population, final_date=FINAL_DATE, tag='location_id', dtype=np.float64):
         # get our tagging of location_ids
         if tag == 'location_id':
             if not isinstance(location_id, str) or not location_id.startswith('_'):
@@ -28,35 +35,37 @@ class Drawer:
         self.date_draws = date_draws
         self.population = population
         self.final_date = final_date
+        self.dtype = dtype
 
     def _collect_draws(self, ensemble_dir, n_draws, peak_days=3):
-        # read model outputs
-        if not os.path.exists(f'{ensemble_dir}/{self.location_id}/draws.pkl'):
-            raise ValueError
-        if os.path.exists(f'{ensemble_dir}/{self.location_id}/loose_models.pkl'):
-            with open(f'{ensemble_dir}/{self.location_id}/loose_models.pkl', 'rb') as fread:
-                models = pickle.load(fread)
+        # read model outputs, only the draws we need if the job wrote compact outputs
+        output_dir = f'{ensemble_dir}/{self.location_id}'
+        if has_job_outputs(output_dir):
+            model_draws = JobOutputs(output_dir)
+        elif os.path.exists(f'{output_dir}/draws.pkl'):
+            with open(f'{output_dir}/draws.pkl', 'rb') as fread:
+                model_draws = pickle.load(fread)
         else:
-            with open(f'{ensemble_dir}/{self.location_id}/tight_models.pkl', 'rb') as fread:
-                models = pickle.load(fread)
-        with open(f'{ensemble_dir}/{self.location_id}/draws.pkl', 'rb') as fread:
-            model_draws = pickle.load(fread)
+            raise ValueError
 
         # get predictions for given location, or use average if not present OR < 5 data points OR < 5 deaths
-        if self.location_tag in list(model_draws.keys()):
+        if self.location_tag in model_draws:
             model_used = 'location'
-            days = model_draws[self.location_tag][0]
-            draws = model_draws[self.location_tag][1]
-            past_pred = models[self.location_tag].predict(np.arange(days[0]), group_name=self.location_tag)
+            days, draws = self._group_draws(model_draws, self.location_tag)
+            past_pred = self._past_prediction(model_draws, output_dir, days)
         else:
+            if 'overall' not in model_draws:
+                raise ValueError(f'{output_dir} has no overall draws; if its job was run with --lazy_overall, '
+                                 f'make them with model.py --overall_dir first.')
+            days, draws = self._group_draws(model_draws, 'overall')
             # use overall
             model_used = 'overall'
-            days = model_draws['overall'][0]
-            draws = model_draws['overall'][1]
             past_pred = np.array([])
 
         if n_draws != draws.shape[0]:
             raise ValueError('Specified nubmer of draws different from actual number of draws.')
+        draws = np.asarray(draws, dtype=self.dtype)
+        past_pred = np.asarray(past_pred, dtype=self.dtype)
 
         # expand out by peak duration of peak days
         if self.peak_duration > 1:
@@ -64,6 +73,26 @@ class Drawer:
 
         return model_used, days, draws, past_pred
 
+    @staticmethod
+    def _group_draws(model_draws, group):
+        if isinstance(model_draws, JobOutputs):
+            return model_draws.draws(group)
+        return model_draws[group]
+
+    def _past_prediction(self, model_draws, output_dir, days):
+        # written by the job, or else predicted from its models
+        if isinstance(model_draws, JobOutputs):
+            past_pred = model_draws.past_prediction(self.location_tag)
+            if past_pred is not None:
+                return past_pred
+        if os.path.exists(f'{output_dir}/loose_models.pkl'):
+            with open(f'{output_dir}/loose_models.pkl', 'rb') as fread:
+                models = pickle.load(fread)
+        else:
+            with open(f'{output_dir}/tight_models.pkl', 'rb') as fread:
+                models = pickle.load(fread)
+        return models[self.location_tag].predict(np.arange(days[0]), group_name=self.location_tag)
+
     def _expand_peak(self, draws):
         # daily death rate space
         delta_draws = np.exp(draws[:, 1:]) - np.exp(draws[:, :-1])
@@ -96,7 +125,7 @@ class Drawer:
             pd.DataFrame({
                 'date': date,
                 'draw': f'draw_{draw_n}',
-                'deaths': np.exp(draw) * self.population
+                'deaths': (np.exp(draw) * self.population).astype(self.dtype, copy=False)
             })
             for draw_n, (date, draw)
             in enumerate(zip(np.vstack([self.date_draws + np.timedelta64(i, 'D') for i in days]).T, draws))
@@ -112,7 +141,7 @@ class Drawer:
                     pd.DataFrame({
                         'date': date,
                         'draw': f'draw_{draw_n}',
-                        'deaths': np.exp(past_pred) * self.population
+                        'deaths': (np.exp(past_pred) * self.population).astype(self.dtype, copy=False)
                     }) for draw_n, date in enumerate(
                         np.vstack([self.date_draws + np.timedelta64(i, 'D') for i in range(days[0])]).T
                     )
@@ -154,7 +183,7 @@ class Drawer:
             [
                 filled_df[['location_id', 'date']].reset_index(drop=True),
                 pd.DataFrame(
-                    np.repeat(np.expand_dims(filled_df['Deaths'].values, 0), n_draws, axis=0).T,
+                    np.repeat(np.expand_dims(filled_df['Deaths'].values.astype(self.dtype), 0), n_draws, axis=0).T,
                     columns=draw_cols
                 ).reset_index(drop=True)
             ],
@@ -186,7 +215,7 @@ class Drawer:
         if not ensemble_draws:
             raise ValueError
         draws = np.vstack(ensemble_draws)
-        past_pred = np.mean(ensemble_past, axis=0)
+        past_pred = np.mean(ensemble_past, axis=0, dtype=self.dtype)
         ensemble_draws = dict(zip(self.ensemble_dirs, ensemble_draws))
         draw_df, past_df, n_draws, draw_cols = self._get_dated_df(days, draws, past_pred)
         if len(self.obs_df) > 0:
@@ -0,0 +1,107 @@
+"""Runs curve fit model jobs as function calls in a local process pool."""
+import functools
+import multiprocessing
+import os
+import time
+import traceback
+from typing import List, NamedTuple, Optional
+
+from loguru import logger
+import pandas as pd
+import tqdm
+
+
+class ModelJob(NamedTuple):
+    """Inputs for one fit of :func:`covid_model_deaths.model.run_location_model`."""
+    job_name: str
+    model_location_id: int
+    data: pd.DataFrame
+    cov: pd.DataFrame
+    last_day_file: str
+    peaked_file: str
+    output_dir: str
+    covariate_effect: str
+    n_draws: int
+    warm_start_dir: Optional[str] = None
+    pred_days: Optional[int] = None
+    draw_dtype: Optional[str] = None
+
+
+class JobStatus(NamedTuple):
+    """Outcome of one model job."""
+    job_name: str
+    succeeded: bool
+    run_time: float
+    error: Optional[str] = None
+
+
+class LocalExecutor:
+    """Runs model jobs in a bounded pool of local worker processes.
+
+    A drop-in for submitting ``model.py`` through the cluster scheduler:
+    jobs carry their data in memory, each worker imports the model code
+    once, and outputs are written to the same layout as the script.
+    Failed jobs are reported rather than raised, so one bad location
+    doesn't stop the run.
+
+    Parameters
+    ----------
+    processes
+        Maximum number of concurrent fits.  Defaults to the number of CPUs.
+
+    """
+
+    def __init__(self, processes: int = None):
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.jobs = []
+        self.statuses = []
+
+    def submit(self, job: ModelJob):
+        self.jobs.append(job)
+
+    def run(self) -> List[JobStatus]:
+        """Runs all submitted jobs and returns their statuses in submission order."""
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return []
+        logger.info(f'Running {len(jobs)} model jobs in {self.processes} processes.')
+        with multiprocessing.Pool(self.processes) as p:
+            statuses = list(tqdm.tqdm(p.imap(run_model_job, jobs), total=len(jobs)))
+
+        failed = [status for status in statuses if not status.succeeded]
+        for status in failed:
+            logger.error(f'{status.job_name} failed after {status.run_time:.1f}s:\n{status.error}')
+        logger.info(f'{len(statuses) - len(failed)} of {len(statuses)} model jobs succeeded.')
+        self.statuses += statuses
+        return statuses
+
+
+def run_model_job(job: ModelJob) -> JobStatus:
+    start = time.time()
+    try:
+        # curvefit is only needed where models are fit
+        from covid_model_deaths import model
+        model.run_location_model(model_location_id=job.model_location_id,
+                                 df=job.data,
+                                 cov_df=job.cov,
+                                 peaked_df=read_shared_csv(job.peaked_file),
+                                 last_day_df=read_shared_csv(job.last_day_file),
+                                 output_dir=job.output_dir,
+                                 covariate_effect=job.covariate_effect,
+                                 n_draws=job.n_draws,
+                                 warm_start_dir=job.warm_start_dir,
+                                 pred_days=job.pred_days,
+                                 draw_dtype=job.draw_dtype)
+    except Exception:
+        return JobStatus(job.job_name, False, time.time() - start, traceback.format_exc())
+    return JobStatus(job.job_name, True, time.time() - start)
+
+
+def read_shared_csv(path: str) -> pd.DataFrame:
+    """Reads a file shared by many jobs once per process, or again if it has changed."""
+    return _read_csv(path, os.stat(path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=16)
+def _read_csv(path: str, modified: int) -> pd.DataFrame:
+    return pd.read_csv(path)
@@ -13,6 +13,10 @@ COV_SETTINGS = [('equal', [1, 1, 1]),
                 ('ascmax', [0, 0, 1])]
 # TODO: Don't know what this is at all. Something about days.
 KS = [21]
+# Last date of reported predictions.
+FINAL_DATE = '2020-07-15'
+# Fewest days the models predict, whatever the reporting horizon.
+MIN_PRED_DAYS = 30
 
 
 class Location:
@@ -1,10 +1,12 @@
 import functools
-import multiprocessing
+import hashlib
 
 import numpy as np
 import pandas as pd
 import tqdm
 
+from covid_model_deaths.shared_inputs import chunk_size, shared_input_pool, worker_input
+
 
 def clean_data(df):
     
@@ -63,63 +65,257 @@ def days_from_X_cases_to_Y_deaths(df,
     return wait_times.dropna().sort_values()
 
 
-def random_delta_days(waits):
-    """Get a random time delta"""
+class DeathThresholdIndex:
+    """Per-location lookups for the days from X cases to the death rate threshold.
+
+    Holds each location's running maximum case count and the date it first
+    crossed the death rate threshold, so the wait times for any case count
+    threshold are found with a binary search in each location's case series
+    rather than a scan of the full dataset.
+
+    Parameters
+    ----------
+    df : pd.DataFrame of outbreak data, as returned by clean_data
+    ln_death_rate_threshold : float
+    """
+
+    def __init__(self, df, ln_death_rate_threshold):
+        df = df.sort_values(['location_id', 'date'], kind='mergesort')
+        location_ids = df['location_id'].values
+        starts = np.flatnonzero(np.r_[True, location_ids[1:] != location_ids[:-1]])
+        ends = np.r_[starts[1:], len(df)]
+        self.location_ids = location_ids[starts]
+        self.ln_death_rate_threshold = ln_death_rate_threshold
+
+        # most recent data for each location
+        latest = df.iloc[ends - 1]
+        self.case_date = pd.Series(latest['date'].values, index=self.location_ids)
+        self.case_count = pd.Series(latest['case_count'].values, index=self.location_ids)
+        self.population = pd.Series(latest['population'].values, index=self.location_ids)
+
+        death_rate_threshold = np.exp(ln_death_rate_threshold)
+        self.death_date = (df[df['death_rate'] >= death_rate_threshold]
+                           .groupby('location_id').date.min()
+                           .reindex(self.location_ids))
+
+        # running maximum case counts, keyed so that every location's series
+        # sorts after the previous location's in one flat array
+        case_max = df['case_count'].fillna(-np.inf).groupby(df['location_id']).cummax().values
+        self._case_values = np.unique(case_max)
+        segment = np.repeat(np.arange(len(starts)), ends - starts)
+        self._keys = segment * (len(self._case_values) + 1) + np.searchsorted(self._case_values, case_max)
+        self._dates = df['date'].values
+        crossed = self.death_date.notnull().values
+        self._crossed_segments = np.flatnonzero(crossed)
+        self._crossed_ends = ends[crossed]
+
+    def threshold_reached(self, location_id):
+        return pd.notnull(self.death_date.at[location_id])
+
+    def wait_times(self, case_count_threshold):
+        """Days from the case count threshold to the death rate threshold.
+
+        Equivalent to ``days_from_X_cases_to_Y_deaths(df, case_count_threshold=X,
+        ln_death_rate_threshold=Y)`` on the indexed data.
+        """
+        rank = np.searchsorted(self._case_values, case_count_threshold, side='left')
+        targets = self._crossed_segments * (len(self._case_values) + 1) + rank
+        first_row = np.searchsorted(self._keys, targets, side='left')
+        found = first_row < self._crossed_ends
+        day_X_cases = self._dates[first_row[found]]
+        day_Y_deaths = self.death_date.values[self._crossed_segments[found]]
+        wait_times = pd.Series((day_Y_deaths - day_X_cases) / np.timedelta64(1, 'D'),
+                               index=pd.Index(self.location_ids[self._crossed_segments[found]], name='location_id'))
+        return wait_times.sort_values()
+
+
+def location_rng(seed, location_id):
+    """Random generator for one location, derived from a root seed and the location_id.
+
+    Each location gets its own stream, so the draws for a location do not depend on
+    which other locations are run, in what order, or on how many processes.
+    """
+    # location_ids can be negative, and seed sequence keys must not be
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(location_id) % 2**32,)))
+
+
+def random_wait_days(waits, n_draws, rng=np.random):
+    """Sample whole-day waits from a normal distribution fit to observed waits.
+
+    Draws below one day are reflected to 1 - w.
+
+    Parameters
+    ----------
+    waits : pd.Series of observed wait times in days
+    n_draws : int
+    rng : np.random.Generator, optional
+        Defaults to the global numpy random state.
+
+    Results
+    -------
+    Returns np.ndarray of int64 days, of length n_draws
+    """
     mu = waits.mean()
     std = waits.std()
-    random_wait = np.random.normal(mu, std)
-    if random_wait < 1:
-        random_wait = 1-random_wait
-    return pd.Timedelta(days=np.round(random_wait))
+    random_wait = rng.normal(mu, std, n_draws)
+    if not np.all(np.isfinite(random_wait)):
+        raise ValueError('Not enough observed wait times to sample from.')
+    random_wait = np.where(random_wait < 1, 1 - random_wait, random_wait)
+    return np.round(random_wait).astype(np.int64)
 
 
-def location_specific_death_threshold_date(df, location_id, ln_death_rate_threshold):
-    results = pd.Series({'location_id':location_id})
+def random_delta_days(waits):
+    """Get a random time delta"""
+    return pd.Timedelta(days=random_wait_days(waits, 1)[0])
 
-    # find most recent case date for this location_id
-    df_loc = df[df.location_id == location_id].sort_values('date', ascending=False)
-    results['case_date'] = df_loc.iloc[0]['date']
-    results['case_count'] = df_loc.iloc[0]['case_count']
-    results['population'] = df_loc.iloc[0]['population']
 
-    # now find the date when this location will/did cross the death rate threshold
-    results['ln_death_rate_threshold'] = ln_death_rate_threshold
-    death_rate_threshold = np.exp(ln_death_rate_threshold)
-    
-    # if this location has already crossed death_rate_threshold, add date on which it did
-    if df_loc['death_rate'].max() >= death_rate_threshold:
-        results['threshold_reached'] = True
-        rows = df_loc['death_rate'] >= death_rate_threshold
-        threshold_death_date = df_loc[rows]['date'].min()
-        for i in range(1000):
-            results[f'death_date_draw_{i:03d}'] = threshold_death_date
+class ThresholdDateDraws:
+    """Draws of the date each location reaches the death rate threshold.
+
+    Draws are held as an int64 matrix of day offsets, one row per location,
+    from a base date per location: the threshold date for locations that
+    have crossed it and the most recent case date for the rest.
+
+    Parameters
+    ----------
+    location_data : pd.DataFrame indexed by location_id, with columns case_date,
+                    case_count, population, ln_death_rate_threshold, and threshold_reached
+    base_dates : np.ndarray of datetime64, one per location
+    day_offsets : np.ndarray of int64, shape (locations, draws)
+    """
+    draw_prefix = 'death_date_draw_'
+
+    def __init__(self, location_data, base_dates, day_offsets):
+        self.location_data = location_data
+        self.base_dates = np.asarray(base_dates, dtype='datetime64[ns]')
+        self.day_offsets = np.asarray(day_offsets, dtype=np.int64)
+
+    @classmethod
+    def concat(cls, draws):
+        return cls(pd.concat([d.location_data for d in draws]),
+                   np.concatenate([d.base_dates for d in draws]),
+                   np.vstack([d.day_offsets for d in draws]))
+
+    @property
+    def location_ids(self):
+        return self.location_data.index.values
+
+    @property
+    def draw_columns(self):
+        return [f'{self.draw_prefix}{i:03d}' for i in range(self.day_offsets.shape[1])]
+
+    def dates(self):
+        """Returns the draws as a datetime64 matrix, shape (locations, draws)."""
+        return self.base_dates[:, None] + self.day_offsets.astype('timedelta64[D]')
+
+    def to_frame(self):
+        """Returns one row per location with a date column for each draw."""
+        date_df = pd.DataFrame(self.dates(), index=self.location_data.index, columns=self.draw_columns)
+        return pd.concat([self.location_data, date_df], axis=1).reset_index()
+
+
+def location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, threshold_index,
+                                            seed=12345, n_draws=1000):
+    location_data = pd.DataFrame({
+        # most recent case date for this location_id
+        'case_date': [threshold_index.case_date.at[location_id]],
+        'case_count': [threshold_index.case_count.at[location_id]],
+        'population': [threshold_index.population.at[location_id]],
+        'ln_death_rate_threshold': [ln_death_rate_threshold],
+        'threshold_reached': [threshold_index.threshold_reached(location_id)],
+    }, index=pd.Index([location_id], name='location_id'))
+
+    # if this location has already crossed death_rate_threshold, use the date on which it did
+    if location_data['threshold_reached'].item():
+        base_date = threshold_index.death_date.at[location_id]
+        day_offsets = np.zeros(n_draws, dtype=np.int64)
     else: # otherwise, sample from distribution
-        results['threshold_reached'] = False
-        observed_waits = days_from_X_cases_to_Y_deaths(df, case_count_threshold=results['case_count'],
-                                                       ln_death_rate_threshold=ln_death_rate_threshold)
+        base_date = location_data['case_date'].item()
+        observed_waits = threshold_index.wait_times(location_data['case_count'].item())
         # retain only positive waits, since we believe deaths are being reported accurately
         retained_waits = observed_waits[observed_waits > 0]
-        for i in range(1000):
-            results[f'death_date_draw_{i:03d}'] = (results['case_date']
-                                                    + random_delta_days(retained_waits))
-    return results
+        day_offsets = random_wait_days(retained_waits, n_draws, location_rng(seed, location_id))
+    return ThresholdDateDraws(location_data, [base_date], day_offsets[None, :])
+
+
+def location_specific_death_threshold_date(df, location_id, ln_death_rate_threshold, threshold_index=None,
+                                           seed=12345):
+    if threshold_index is None:
+        threshold_index = DeathThresholdIndex(df, ln_death_rate_threshold)
+    draws = location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, threshold_index, seed)
+    return draws.to_frame().iloc[0].rename(None)
+
+
+class ThresholdImputationCache:
+    """Threshold date draws kept from previous runs for locations that had crossed the threshold.
+
+    Once a location crosses the death rate threshold, every draw is the date it
+    crossed, which depends only on that location's own data.  Those results are
+    reused while the location's input rows are unchanged; all other locations
+    are imputed again, since their draws depend on every location's data.
+
+    Instances hold no open resources, so they can be written to a
+    :class:`covid_model_deaths.deaths_io.Checkpoint` and loaded on the next run.
+    """
+    input_columns = ['date', 'case_count', 'death_rate', 'population']
+
+    def __init__(self):
+        self._draws = {}
+
+    def location_keys(self, df, ln_death_rate_threshold):
+        """Returns a key per location_id identifying its input rows and the threshold."""
+        df = df.sort_values(['location_id', 'date'], kind='mergesort')
+        row_hashes = pd.util.hash_pandas_object(df[self.input_columns], index=False)
+        return row_hashes.groupby(df['location_id'].values).agg(
+            lambda h: hashlib.sha1(h.values.tobytes() + repr(ln_death_rate_threshold).encode()).hexdigest()
+        )
+
+    def get(self, location_id, key):
+        cached_key, draws = self._draws.get(location_id, (None, None))
+        return draws if cached_key == key else None
+
+    def update(self, draws, keys):
+        for location_id, location_draws in zip(draws.location_ids, split_draws(draws)):
+            if location_draws.location_data['threshold_reached'].item():
+                self._draws[location_id] = (keys[location_id], location_draws)
+            else:
+                self._draws.pop(location_id, None)
+
+
+def split_draws(draws):
+    """Splits ThresholdDateDraws into one object per location."""
+    return [ThresholdDateDraws(draws.location_data.iloc[[i]], draws.base_dates[[i]], draws.day_offsets[[i]])
+            for i in range(len(draws.location_ids))]
 
-def try_location_specific_death_threshold_rate(location_id, df, ln_death_rate_threshold):
+
+def try_location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, threshold_index, seed):
     try:
-        return location_specific_death_threshold_date(df, location_id, ln_death_rate_threshold)
+        return location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, threshold_index, seed)
     except Exception as e:
         print(e)
         print(location_id, " failed")
         raise e
 
 
-def impute_death_threshold(df,
-                           location_list,
-                           ln_death_rate_threshold=-15):
+def _death_threshold_draws_worker(location_id, ln_death_rate_threshold, seed):
+    return try_location_specific_death_threshold_draws(location_id, ln_death_rate_threshold,
+                                                       worker_input('threshold_index'), seed)
+
+
+def impute_death_threshold_draws(df,
+                                 location_list,
+                                 ln_death_rate_threshold=-15,
+                                 seed=12345,
+                                 n_processes=20,
+                                 cache=None):
     """
     Run whole function on df for locations specified in location_list
-    Data date added as a column in results df
-    Return draws of date that death threshold will be reached by country
+    Return ThresholdDateDraws of date that death threshold will be reached by location
+
+    Each location draws from its own stream derived from seed and its location_id,
+    so results are the same for any n_processes and any subset of locations.
+    If a ThresholdImputationCache is given, locations that had already crossed the
+    threshold with the same input rows are taken from it, and it is updated.
 
     """
     # step 1 - load in data
@@ -129,13 +325,45 @@ def impute_death_threshold(df,
     assert set(location_list).issubset(set(df['location_id']))
 
     # step 3 - run functions on df
-    np.random.seed(12345)
-    _combiner = functools.partial(try_location_specific_death_threshold_rate,
-                                 df=df, 
-                                 ln_death_rate_threshold=ln_death_rate_threshold)
-    with multiprocessing.Pool(20) as p:
-        results = list(tqdm.tqdm(p.imap(_combiner, location_list), total=len(location_list)))
-    
-    results = pd.DataFrame(results)
+    threshold_index = DeathThresholdIndex(df, ln_death_rate_threshold)
+    cached = {}
+    if cache is not None:
+        keys = cache.location_keys(df, ln_death_rate_threshold)
+        for location_id in location_list:
+            location_draws = cache.get(location_id, keys[location_id])
+            if location_draws is not None:
+                cached[location_id] = location_draws
+        print(f'Reusing threshold dates for {len(cached)} of {len(location_list)} locations.')
+    impute_list = [location_id for location_id in location_list if location_id not in cached]
+
+    _combiner = functools.partial(_death_threshold_draws_worker,
+                                 ln_death_rate_threshold=ln_death_rate_threshold,
+                                 seed=seed)
+    results = {}
+    if impute_list:
+        with shared_input_pool(n_processes, threshold_index=threshold_index) as p:
+            results = list(tqdm.tqdm(p.imap(_combiner, impute_list, chunk_size(len(impute_list), n_processes)),
+                                     total=len(impute_list)))
+        results = dict(zip(impute_list, results))
+    results.update(cached)
 
-    return results
+    draws = ThresholdDateDraws.concat([results[location_id] for location_id in location_list])
+    if cache is not None:
+        cache.update(draws, keys)
+    return draws
+
+
+def impute_death_threshold(df,
+                           location_list,
+                           ln_death_rate_threshold=-15,
+                           seed=12345,
+                           n_processes=20,
+                           cache=None):
+    """
+    Run whole function on df for locations specified in location_list
+    Data date added as a column in results df
+    Return draws of date that death threshold will be reached by country
+
+    """
+    return impute_death_threshold_draws(df, location_list, ln_death_rate_threshold,
+                                        seed, n_processes, cache).to_frame()
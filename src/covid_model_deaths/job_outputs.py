@@ -0,0 +1,187 @@
+"""Compact, versioned outputs of a model job.
+
+A job's outputs are plain numpy arrays in an ``outputs`` directory beside
+its other files: one ``.npy`` file per group's draws and time axis, which
+readers memory-map so they only touch the groups they need, an ``.npz``
+archive per model of each group's fitted parameters, and the fitted curve
+over the days before the draws start for groups with data of their own.
+Jobs that skip the overall draws save what's needed to make them later
+instead: their settings, and the data and fitted parameters of the groups
+they're made from.  A JSON manifest records the format version and which
+files hold which group.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+FORMAT_VERSION = 3
+# versions this module can read; version 1 has no past predictions, and
+# versions before 3 have no overall inputs
+READABLE_VERSIONS = (1, 2, 3)
+OUTPUTS_DIR = 'outputs'
+MANIFEST = 'manifest.json'
+
+Draws = Tuple[np.ndarray, np.ndarray]
+Params = Dict[str, Tuple[np.ndarray, np.ndarray]]
+OverallInputs = Dict[str, Dict]
+
+
+def write_job_outputs(output_dir: Union[str, Path], draws: Mapping[str, Draws],
+                      params: Optional[Mapping[str, Params]] = None,
+                      past_predictions: Optional[Mapping[str, np.ndarray]] = None, compress: bool = False,
+                      dtype=None, overall_inputs: Optional[OverallInputs] = None):
+    """Writes a job's draws and fitted parameters.
+
+    Parameters
+    ----------
+    output_dir
+        The job's output directory.
+    draws
+        Days and an (n_draws x days) array of draws, by group.
+    params
+        Fixed and random effects by group, for each model (e.g. 'tight').
+    past_predictions
+        The fitted curve by group, for the days before its draws start.
+    compress
+        Whether to compress the parameter archives.  Draws are never
+        compressed, so they can be memory-mapped.
+    dtype
+        Type to write the draws and past predictions as (e.g. ``np.float32``
+        to halve their size), or their own type if None.  Fitted parameters
+        are always written at full precision, for warm starts.
+    overall_inputs
+        If the job skipped the overall draws, what's needed to make them:
+        ``'settings'`` that can be written as JSON, ``'data'`` columns as
+        arrays, and ``'params'`` by model as for ``params``.
+
+    """
+    root = Path(output_dir) / OUTPUTS_DIR
+    root.mkdir(exist_ok=True)
+    manifest = {'version': FORMAT_VERSION, 'draws': {}, 'params': {}, 'past': {}}
+    save = np.savez_compressed if compress else np.savez
+    for i, (group, (days, group_draws)) in enumerate(draws.items()):
+        manifest['draws'][group] = {'days': f'days_{i}.npy', 'draws': f'draws_{i}.npy'}
+        np.save(root / f'days_{i}.npy', np.asarray(days), allow_pickle=False)
+        np.save(root / f'draws_{i}.npy', np.asarray(group_draws, dtype=dtype), allow_pickle=False)
+    for label, model_params in (params or {}).items():
+        _save_params(save, root / f'params_{label}.npz', model_params)
+        manifest['params'][label] = f'params_{label}.npz'
+    for i, (group, past_prediction) in enumerate((past_predictions or {}).items()):
+        manifest['past'][group] = f'past_{i}.npy'
+        np.save(root / f'past_{i}.npy', np.asarray(past_prediction, dtype=dtype), allow_pickle=False)
+    if overall_inputs is not None:
+        manifest['overall'] = {'settings': overall_inputs['settings'], 'data': 'overall_data.npz', 'params': {}}
+        save(root / 'overall_data.npz', **overall_inputs['data'])
+        for label, model_params in overall_inputs['params'].items():
+            _save_params(save, root / f'overall_params_{label}.npz', model_params)
+            manifest['overall']['params'][label] = f'overall_params_{label}.npz'
+
+    # the manifest goes last, so outputs without one are incomplete
+    _write_manifest(root, manifest)
+
+
+def add_job_draws(output_dir: Union[str, Path], draws: Mapping[str, Draws], dtype=None):
+    """Adds groups' draws to a job's outputs, e.g. overall draws made after the job.
+
+    The draws are written to new files and the manifest is replaced in one
+    step, so readers see the outputs either before or after the draws
+    are added, and those that already read the manifest can still read
+    the files it names.
+    """
+    root = Path(output_dir) / OUTPUTS_DIR
+    with (root / MANIFEST).open() as manifest_file:
+        manifest = json.load(manifest_file)
+    start = len(manifest['draws'])
+    for i, (group, (days, group_draws)) in enumerate(draws.items(), start):
+        manifest['draws'][group] = {'days': f'days_{i}.npy', 'draws': f'draws_{i}.npy'}
+        np.save(root / f'days_{i}.npy', np.asarray(days), allow_pickle=False)
+        np.save(root / f'draws_{i}.npy', np.asarray(group_draws, dtype=dtype), allow_pickle=False)
+    _write_manifest(root, manifest)
+
+
+def _save_params(save, path: Path, model_params: Params):
+    groups = list(model_params)
+    save(path,
+         groups=np.array(groups, dtype=str),
+         fe=np.array([model_params[group][0] for group in groups]),
+         re=np.array([model_params[group][1] for group in groups]))
+
+
+def _load_params(path: Path) -> Params:
+    with np.load(path) as archive:
+        return {group: (fe, re) for group, fe, re in zip(archive['groups'], archive['fe'], archive['re'])}
+
+
+def _write_manifest(root: Path, manifest: Dict):
+    tmp_path = root / f'.{MANIFEST}.{os.getpid()}.tmp'
+    with tmp_path.open('w') as tmp_file:
+        json.dump(manifest, tmp_file)
+    os.replace(tmp_path, root / MANIFEST)
+
+
+def has_job_outputs(output_dir: Union[str, Path]) -> bool:
+    return (Path(output_dir) / OUTPUTS_DIR / MANIFEST).exists()
+
+
+class JobOutputs:
+    """Reads the outputs written by :func:`write_job_outputs`.
+
+    Parameters
+    ----------
+    output_dir
+        The job's output directory.
+    mmap
+        Whether to memory-map draws rather than read them into memory.
+
+    """
+
+    def __init__(self, output_dir: Union[str, Path], mmap: bool = True):
+        self.root = Path(output_dir) / OUTPUTS_DIR
+        with (self.root / MANIFEST).open() as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['version'] not in READABLE_VERSIONS:
+            raise ValueError(f'Job outputs in {self.root} are version {self.manifest["version"]}, '
+                             f'expected one of versions {READABLE_VERSIONS}.')
+        self.mmap_mode = 'r' if mmap else None
+
+    @property
+    def groups(self):
+        return list(self.manifest['draws'])
+
+    def __contains__(self, group: str) -> bool:
+        return group in self.manifest['draws']
+
+    def draws(self, group: str) -> Draws:
+        """Days and draws for a group."""
+        files = self.manifest['draws'][group]
+        return (np.load(self.root / files['days'], mmap_mode=self.mmap_mode),
+                np.load(self.root / files['draws'], mmap_mode=self.mmap_mode))
+
+    def all_draws(self) -> Dict[str, Draws]:
+        return {group: self.draws(group) for group in self.groups}
+
+    def past_prediction(self, group: str) -> Optional[np.ndarray]:
+        """The fitted curve for a group before its draws start, if it was written."""
+        if group not in self.manifest.get('past', {}):
+            return None
+        return np.load(self.root / self.manifest['past'][group])
+
+    def params(self, label: str) -> Params:
+        """Fixed and random effects by group for a model, or nothing if they weren't written."""
+        if label not in self.manifest['params']:
+            return {}
+        return _load_params(self.root / self.manifest['params'][label])
+
+    def overall_inputs(self) -> Optional[OverallInputs]:
+        """What's needed to make the overall draws, if the job skipped them and saved it."""
+        if 'overall' not in self.manifest:
+            return None
+        overall = self.manifest['overall']
+        with np.load(self.root / overall['data']) as archive:
+            data = {column: archive[column] for column in archive.files}
+        return {'settings': overall['settings'],
+                'data': data,
+                'params': {label: _load_params(self.root / path) for label, path in overall['params'].items()}}
@@ -0,0 +1,126 @@
+"""A job queue kept in a directory on a shared filesystem.
+
+Jobs move between ``pending``, ``running`` and ``done`` subdirectories by
+renaming, which is atomic on a single filesystem, so any number of
+workers on any number of nodes can take jobs from the same queue without
+a central service.  A running job's file records who claimed it and when,
+so jobs whose workers died can be put back with
+:meth:`JobQueue.requeue_stale`.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+class JobQueue:
+    """Directory-backed queue of JSON job specs.
+
+    Parameters
+    ----------
+    root
+        Queue directory.  Created if it doesn't exist.
+
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.pending_dir = self.root / 'pending'
+        self.running_dir = self.root / 'running'
+        self.done_dir = self.root / 'done'
+        for directory in [self.pending_dir, self.running_dir, self.done_dir]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, job_name: str, spec: Dict[str, Any]):
+        """Adds a job to the queue."""
+        _write_json(self.pending_dir / f'{job_name}.json', spec)
+
+    def claim(self, worker: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Takes the next pending job, returning its name and spec, or None if there are none."""
+        for path in sorted(self.pending_dir.glob('*.json')):
+            claimed_path = self.running_dir / path.name
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                # another worker got there first
+                continue
+            with claimed_path.open() as claimed_file:
+                spec = json.load(claimed_file)
+            _write_json(claimed_path, {'spec': spec, 'worker': worker, 'claimed': time.time()})
+            return path.stem, spec
+        return None
+
+    def complete(self, job_name: str, record: Dict[str, Any]):
+        """Writes the completion record for a claimed job and takes it off the running list."""
+        _write_json(self.done_dir / f'{job_name}.json', record)
+        try:
+            (self.running_dir / f'{job_name}.json').unlink()
+        except FileNotFoundError:
+            # the claim was requeued, and the job may be run again
+            pass
+
+    def claim_info(self, job_name: str) -> Dict[str, Any]:
+        """Who claimed a running job (``worker``) and when (``claimed``, in seconds since the epoch)."""
+        path = self.running_dir / f'{job_name}.json'
+        with path.open() as claimed_file:
+            claimed = json.load(claimed_file)
+        if 'claimed' not in claimed:
+            # renamed into running but not yet recorded, which updated its ctime
+            return {'worker': None, 'claimed': path.stat().st_ctime}
+        return {'worker': claimed['worker'], 'claimed': claimed['claimed']}
+
+    def requeue_stale(self, timeout: float) -> List[str]:
+        """Puts jobs claimed more than ``timeout`` seconds ago back on the queue, returning their names.
+
+        The timeout must be longer than any job takes, as a job whose worker
+        is still running it will be run again.
+        """
+        requeued = []
+        now = time.time()
+        for job_name in self.running:
+            try:
+                stale = now - self.claim_info(job_name)['claimed'] > timeout
+            except FileNotFoundError:
+                # completed or requeued since it was listed
+                continue
+            if not stale:
+                continue
+            requeue_path = self.pending_dir / f'.{job_name}.requeue'
+            try:
+                os.rename(self.running_dir / f'{job_name}.json', requeue_path)
+            except FileNotFoundError:
+                continue
+            with requeue_path.open() as requeue_file:
+                claimed = json.load(requeue_file)
+            _write_json(self.pending_dir / f'{job_name}.json', claimed.get('spec', claimed))
+            requeue_path.unlink()
+            requeued.append(job_name)
+        return requeued
+
+    @property
+    def pending(self) -> List[str]:
+        return sorted(p.stem for p in self.pending_dir.glob('*.json'))
+
+    @property
+    def running(self) -> List[str]:
+        return sorted(p.stem for p in self.running_dir.glob('*.json'))
+
+    @property
+    def done(self) -> List[str]:
+        return sorted(p.stem for p in self.done_dir.glob('*.json'))
+
+    def record(self, job_name: str) -> Dict[str, Any]:
+        with (self.done_dir / f'{job_name}.json').open() as record_file:
+            return json.load(record_file)
+
+    def __repr__(self):
+        return f'JobQueue({str(self.root)})'
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    # write beside the target and rename, so readers never see a partial file
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with tmp_path.open('w') as tmp_file:
+        json.dump(data, tmp_file)
+    os.replace(tmp_path, path)
@@ -1,6 +1,13 @@
 import argparse
+from contextlib import contextmanager
 from copy import deepcopy
+import functools
 import hashlib
+import os
+import socket
+import time
+import traceback
+from typing import NamedTuple, Optional
 import warnings
 
 from curvefit.pipelines.flat_asymmetric_model import APFlatAsymmetricModel
@@ -9,11 +16,18 @@ from curvefit.core.functions import ln_gaussian_cdf, ln_gaussian_pdf
 from curvefit.core.utils import truncate_draws, convex_combination, process_input
 import dill as pickle
 from loguru import logger
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 import pandas as pd
 
+from covid_model_deaths.draw_processing import batch_process_draws, cumulative_draws, sort_draws
+from covid_model_deaths.executor import JobStatus, ModelJob, run_model_job
+from covid_model_deaths.job_outputs import add_job_draws, has_job_outputs, JobOutputs, write_job_outputs
+from covid_model_deaths.job_queue import JobQueue
+from covid_model_deaths.pipelines import fork_executor, pipeline_group_processes, run_pipelines
+from covid_model_deaths.plotting.model_fits import draw_summary, plot_location_fit, write_plot_inputs
+from covid_model_deaths.shared_inputs import chunk_size
+
 
 warnings.filterwarnings('ignore')
 
@@ -21,6 +35,7 @@ RATE_THRESHOLD = -15  # should pass this in as argument
 COVARIATE = 'cov_3w'
 DATA_THRESHOLD = 18
 PSEUDO_SE = 5
+PRED_DAYS = 150  # unless the job is told how far it needs to predict
 
 
 def get_hash(key: str) -> int:
@@ -38,13 +53,265 @@ def get_hash(key: str) -> int:
     return int(hashlib.sha1(key.encode('utf8')).hexdigest(), 16) % 4294967295
 
 
-def ap_model(df, model_location, location_cov, n_draws,
-             peaked_groups, exclude_groups, fix_gamma, fix_point, fix_day,
-             pred_days=150):
+def prepare_model_data(df, covariates=(COVARIATE,)):
+    """Processes data for either model, carrying the given covariate columns.
+
+    The result holds the observation standard errors used by both models, so
+    one processed dataset can be shared by every scenario fit to the same data.
+    """
     # our dataset (rename days as model assumes it's lower case)
     df = df.copy()
     df = df.rename(index=str, columns={'Days':'days'})
 
+    # prepare data (must exponentiate smoothed column, non-logged col is not smoothed)
+    df['obs_se_tight'] = 1 / (1 + df['days'])
+    df['obs_se_loose'] = 1 / (1 + df['days']**1.4)
+    df['obs_se'] = 1 / (1 + df['days'])
+    df.loc[df['pseudo'] == 1, ['obs_se_tight', 'obs_se_loose', 'obs_se']] = PSEUDO_SE
+    df['Age-standardized death rate'] = np.exp(df['ln(age-standardized death rate)'])
+    return process_input(df, 'location_id', 'days', 'Age-standardized death rate',
+                         col_covs=list(covariates) + ['intercept', 'obs_se_tight', 'obs_se_loose', 'obs_se'])
+
+
+class _WarmStartMixin:
+    """Starts each group's individual fit from given fixed and random effects.
+
+    ``warm_start`` maps groups to ``(fe_init, re_init)``, clipped to the fit bounds;
+    groups without an entry start from the defaults in ``fit_dict``.  If
+    ``fit_stats`` is a list, ``(group, warm_started, iterations, seconds)`` is
+    appended to it for each group fit.
+    """
+    warm_start = {}
+    fit_stats = None
+
+    def run_model(self, df, group):
+        start = time.time()
+        warm_started = group in self.warm_start and len(self.warm_start[group][0]) == len(self.fit_dict['fe_init'])
+        if warm_started:
+            model = self._run_warm_model(df, group)
+        else:
+            model = super().run_model(df, group)
+        if self.fit_stats is not None and group is not None:
+            self.fit_stats.append((group, warm_started, getattr(model.result, 'nit', np.nan), time.time() - start))
+        return model
+
+    def _run_warm_model(self, df, group):
+        fe_init, re_init = self.warm_start[group]
+        fit_dict = self.fit_dict
+        fe_bounds = np.array(fit_dict['fe_bounds'], dtype=float)
+        re_bounds = np.array(fit_dict['re_bounds'], dtype=float)
+        re_init = np.clip(np.reshape(re_init, (-1, len(fe_init))), re_bounds[:, 0], re_bounds[:, 1])
+        self.fit_dict = {
+            **fit_dict,
+            'fe_init': np.clip(fe_init, fe_bounds[:, 0], fe_bounds[:, 1]),
+            're_init': re_init.flatten(),
+        }
+        try:
+            return super().run_model(df, group)
+        finally:
+            self.fit_dict = fit_dict
+
+
+class _ParallelGroupMixin:
+    """Fits groups' individual models in a pool of ``group_processes`` workers.
+
+    ``run`` fits every group in the pipeline's data, and ``run_filtered_models``
+    the groups of a dataset with enough observations.  The first time either
+    asks for a group's fit, the groups it will ask for are fit at once in
+    forked workers, and the pipeline then takes each group's model from those
+    fits as it would have fit it, so the joint fit and draws are unchanged.
+    Fits left over are dropped as the call returns.  With ``group_processes``
+    below 2, or for fits asked for some other way, groups are fit in turn.
+    """
+    group_processes = 1
+
+    def run(self, *args, **kwargs):
+        with self._prefitting(self.all_data, self.all_data[self.col_group].unique()):
+            return super().run(*args, **kwargs)
+
+    def run_filtered_models(self, df, obs_bounds):
+        # no group has more observations than rows, so these are all the groups that can be in bounds
+        group_sizes = df.groupby(self.col_group).size()
+        with self._prefitting(df, group_sizes.index[group_sizes >= obs_bounds[0]]):
+            return super().run_filtered_models(df, obs_bounds)
+
+    @contextmanager
+    def _prefitting(self, df, groups):
+        # plans the groups to fit at once from df, by its id, while the pipeline is fitting from it
+        plans = self.__dict__.setdefault('_prefit_plans', {})
+        if self.group_processes < 2 or id(df) in plans:
+            yield
+            return
+        plans[id(df)] = (df, list(groups))
+        try:
+            yield
+        finally:
+            del plans[id(df)]
+            prefits = self.__dict__.get('_prefits', {})
+            for key in [key for key in prefits if key[1] == id(df)]:
+                del prefits[key]
+            if not plans:
+                # so the fits aren't pickled with the pipeline
+                self.__dict__.pop('_prefit_plans', None)
+                self.__dict__.pop('_prefits', None)
+
+    def run_model(self, df, group):
+        plan = self.__dict__.get('_prefit_plans', {}).get(id(df))
+        if group is None or plan is None:
+            return super().run_model(df, group)
+        prefits = self.__dict__.setdefault('_prefits', {})
+        key = (group, id(df))
+        _, groups = plan
+        if key not in prefits and group in groups:
+            # each planned group is only prefit once; asked for again, it's fit here
+            self._prefit_groups(df, groups)
+            groups.clear()
+        if key not in prefits:
+            return super().run_model(df, group)
+        model, fit_stats = prefits.pop(key)
+        if self.fit_stats is not None:
+            self.fit_stats += fit_stats
+        return model
+
+    def _prefit_groups(self, df, groups):
+        global _GROUP_FIT_INPUTS
+        # forked workers inherit the pipeline, which can't be pickled to send to them
+        _GROUP_FIT_INPUTS = (self, df)
+        try:
+            with fork_executor(min(self.group_processes, len(groups))) as executor:
+                fits = list(executor.map(_fit_group, groups, chunksize=chunk_size(len(groups), self.group_processes)))
+        finally:
+            _GROUP_FIT_INPUTS = None
+        for group, fit in zip(groups, fits):
+            self._prefits[(group, id(df))] = pickle.loads(fit)
+
+    def _fit_group(self, df, group):
+        self.fit_stats = [] if self.fit_stats is not None else None
+        model = super().run_model(df, group)
+        return model, self.fit_stats or []
+
+
+_GROUP_FIT_INPUTS = None
+
+
+def _fit_group(group):
+    pipeline, df = _GROUP_FIT_INPUTS
+    return pickle.dumps(pipeline._fit_group(df, group))
+
+
+class WarmStartAPModel(_ParallelGroupMixin, _WarmStartMixin, APModel):
+    pass
+
+
+class WarmStartAPFlatAsymmetricModel(_ParallelGroupMixin, _WarmStartMixin, APFlatAsymmetricModel):
+    pass
+
+
+@contextmanager
+def only_draw_groups(model, groups):
+    """Narrows a fit pipeline to the draws of ``groups``, or leaves it be if None.
+
+    Draw processing then only sorts, truncates and returns those groups.
+    """
+    if groups is None:
+        yield model
+        return
+    model_groups, model_draws = model.groups, model.draws
+    model.groups = [group for group in model_groups if group in groups]
+    model.draws = {group: draws for group, draws in model_draws.items() if group in groups}
+    try:
+        yield model
+    finally:
+        model.groups, model.draws = model_groups, model_draws
+
+
+def fitted_params(models):
+    """Fixed and random effects fit for each group, in the form taken by ``warm_start``."""
+    return {group: (np.array(model.result.x[:model.num_fe]), np.array(model.result.x[model.num_fe:]))
+            for group, model in models.items()}
+
+
+def load_warm_start(output_dir):
+    """Fitted parameters from the models a previous run wrote to output_dir.
+
+    Returns the ``warm_start`` for ``ap_model`` and ``ap_flat_asym_model``;
+    fits that are missing or can't be read are left out, so those groups
+    start from the defaults.
+    """
+    if has_job_outputs(output_dir):
+        try:
+            outputs = JobOutputs(output_dir)
+            return {label: outputs.params(label) for label in ['tight', 'loose']}
+        except Exception as e:
+            logger.warning(f'Not warm-starting from the job outputs in {output_dir}: {e!r}')
+    warm_start = {}
+    for label in ['tight', 'loose']:
+        models_file = f'{output_dir}/{label}_models.pkl'
+        if not os.path.exists(models_file):
+            continue
+        try:
+            with open(models_file, 'rb') as fread:
+                warm_start[label] = fitted_params(pickle.load(fread))
+        except Exception as e:
+            logger.warning(f'Not warm-starting from {models_file}: {e!r}')
+    return warm_start
+
+
+def log_fit_stats(label, fit_stats):
+    """Logs optimizer iterations and wall time for warm- and cold-started fits."""
+    for warm_started in [True, False]:
+        stats = [(iterations, seconds) for _, warm, iterations, seconds in fit_stats if warm == warm_started]
+        if stats:
+            iterations, seconds = np.array(stats, dtype=float).T
+            logger.info(f'{label}: {len(stats)} {"warm" if warm_started else "cold"}-started fits, '
+                        f'{np.nanmean(iterations):.1f} iterations and {seconds.mean():.2f}s per fit '
+                        f'({seconds.sum():.1f}s total).')
+
+
+def _prior_pipeline(df, settings, fix_gamma):
+    # an unfit pipeline for one of ap_model's prior configurations
+    model = WarmStartAPModel(
+        all_data=df,
+        **settings['info_dict'],
+        joint_model_fit_dict=settings['joint_model_fit_dict'],
+        basic_model_dict=settings['basic_model_dict'],
+        fit_dict=settings['fit_dict']
+    )
+    if fix_gamma:
+        fe_bounds = model.fit_dict['fe_bounds']
+        model.fit_dict.update({
+            'fe_bounds': [fe_bounds[0], [1, 1], fe_bounds[2]]
+        })
+    return model
+
+
+def _fit_prior_pipeline(prior, df, settings, fix_gamma, warm_start, seed, last_info, overall_spec,
+                        group_processes=1, draw_groups=None, lazy_overall=False):
+    # fits one of ap_model's prior configurations, returning the model, its group draws and overall draws
+    np.random.seed(seed)
+    draw_dict = overall_spec['draw_dict']
+    model = _prior_pipeline(df, settings, fix_gamma)
+    model.warm_start = warm_start
+    model.fit_stats = []
+    model.group_processes = group_processes
+    model.run(last_info=last_info, **draw_dict)
+    log_fit_stats(f'{prior.capitalize()} model', model.fit_stats)
+
+    # get truncated draws
+    with only_draw_groups(model, draw_groups):
+        draws = model.process_draws(draw_dict['prediction_times'], last_info=last_info)
+
+    # get overall draws, unless they're only needed when the location has no draws of its own
+    if lazy_overall and overall_spec['model_location'] in draws:
+        overall_draws = None
+    else:
+        overall_draws = overall_model_draws(model, prior, overall_spec)
+    return model, draws, overall_draws
+
+
+def _ap_model_settings(model_location, location_cov, n_draws, peaked_groups, exclude_groups, fix_point, fix_day,
+                       pred_days=PRED_DAYS):
+    # ap_model's pipeline settings by prior, and everything needed to make its overall draws
     ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ##
     ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ##
     ## SET UP
@@ -151,14 +418,58 @@ def ap_model(df, model_location, location_cov, n_draws,
         'fun_gprior': [lambda params: params[0] * params[1], dummy_gprior]
     }
 
-    # prepare data (must exponentiate smoothed column, non-logged col is not smoothed)
-    df['obs_se_tight'] = 1 / (1 + df['days'])
-    df['obs_se_loose'] = 1 / (1 + df['days']**1.4)
-    df.loc[df['pseudo'] == 1, 'obs_se_tight'] = PSEUDO_SE
-    df.loc[df['pseudo'] == 1, 'obs_se_loose'] = PSEUDO_SE
-    df['Age-standardized death rate'] = np.exp(df['ln(age-standardized death rate)'])
-    df = process_input(df, 'location_id', 'days', 'Age-standardized death rate',
-                       col_covs=[COVARIATE, 'intercept', 'obs_se_tight', 'obs_se_loose'])
+    pipeline_settings = {
+        prior: dict(info_dict=info_dict, fit_dict=fit_dict, joint_model_fit_dict=basic_joint_model_fit_dict,
+                    basic_model_dict=basic_model_dict)
+        for prior, info_dict, fit_dict in [('tight', tight_info_dict, tight_fit_dict),
+                                           ('loose', loose_info_dict, loose_fit_dict)]
+    }
+
+    overall_spec = dict(
+        model_location=model_location,
+        fix_point=fix_point,
+        fix_day=fix_day,
+        pred_days=pred_days,
+        draw_dict=draw_dict,
+        obs_bounds=obs_bounds,
+        predict_cov=predict_cov,
+        alpha_times_beta=alpha_times_beta,
+        start_day=start_day,
+        end_day=end_day,
+        predict_space=basic_info_dict['predict_space'],
+        obs_space={'tight': tight_info_dict['fun'], 'loose': loose_info_dict['fun']},
+    )
+    return pipeline_settings, overall_spec
+
+
+def ap_model(df, model_location, location_cov, n_draws,
+             peaked_groups, exclude_groups, fix_gamma, fix_point, fix_day,
+             pred_days=PRED_DAYS, processed_df=None, warm_start=None, threads=1, draw_groups=None,
+             lazy_overall=False):
+    # processed_df is prepare_model_data(df), if it's already been done;
+    # draw_groups limits the group draws made to those groups (overall is always drawn,
+    # unless lazy_overall and model_location has draws of its own, when the tight
+    # model's overall_inputs are what add_overall_draws needs to make them later)
+    if processed_df is None:
+        processed_df = prepare_model_data(df)
+    df = processed_df
+    if warm_start is None:
+        warm_start = {}
+
+    # plain python values, as they're saved with lazy overall draws
+    settings = dict(
+        model_location=model_location,
+        location_cov=float(location_cov),
+        n_draws=int(n_draws),
+        peaked_groups=[str(group) for group in peaked_groups],
+        exclude_groups=[str(group) for group in exclude_groups],
+        fix_point=_scalar(fix_point),
+        fix_day=_scalar(fix_day),
+        pred_days=int(pred_days),
+    )
+    pipeline_settings, overall_spec = _ap_model_settings(**settings)
+    predict_space = overall_spec['predict_space']
+    start_day, end_day = overall_spec['start_day'], overall_spec['end_day']
 
     #############
     # RUN MODEL #
@@ -169,127 +480,190 @@ def ap_model(df, model_location, location_cov, n_draws,
     else:
         last_info = None
 
-    # The Alpha Prior Model
-    tight_model = APModel(
-        all_data=df,
-        **tight_info_dict,
-        joint_model_fit_dict=basic_joint_model_fit_dict,
-        basic_model_dict=basic_model_dict,
-        fit_dict=tight_fit_dict
-    )
-    if fix_gamma:
-        fe_bounds = tight_model.fit_dict['fe_bounds']
-        tight_model.fit_dict.update({
-            'fe_bounds': [fe_bounds[0], [1, 1], fe_bounds[2]]
-        })
-    tight_model.run(last_info=last_info, **draw_dict)
-    loose_model = APModel(
-        all_data=df,
-        **loose_info_dict,
-        joint_model_fit_dict=basic_joint_model_fit_dict,
-        basic_model_dict=basic_model_dict,
-        fit_dict=loose_fit_dict
+    # The Alpha Prior Model, with tight and loose priors fit independently (and
+    # seeded separately, so the draws don't depend on whether they run in parallel)
+    tight_seed, loose_seed, tight_overall_seed, loose_overall_seed = np.random.randint(2**32, size=4)
+    overall_spec['seeds'] = {'tight': int(tight_overall_seed), 'loose': int(loose_overall_seed)}
+    # split the thread budget between the pipelines, then between each one's group fits
+    group_processes = pipeline_group_processes(threads, 2)
+    pipelines = [
+        functools.partial(_fit_prior_pipeline, prior, df, pipeline_settings[prior], fix_gamma,
+                          warm_start.get(prior, {}), seed, last_info, overall_spec, group_processes, draw_groups,
+                          lazy_overall)
+        for prior, seed in [('tight', tight_seed), ('loose', loose_seed)]
+    ]
+    ((tight_model, tight_draws, overall_tight_draws),
+     (loose_model, loose_draws, overall_loose_draws)) = run_pipelines(pipelines, threads)
+
+    # sort, combine and cumulate the groups' draws, in batches of groups
+    last_obs = {group: fix_point if group == model_location and fix_point is not None
+                else tight_model.models[group].obs[-1]
+                for group in tight_draws}
+    combined_draws = batch_process_draws(
+        tight_draws, last_obs, loose_draws,
+        combine=lambda tight, loose: convex_combination(np.arange(tight.shape[1]), tight, loose,
+                                                        predict_space,
+                                                        start_day=start_day,
+                                                        end_day=end_day)
     )
-    if fix_gamma:
-        fe_bounds = loose_model.fit_dict['fe_bounds']
-        loose_model.fit_dict.update({
-            'fe_bounds': [fe_bounds[0], [1, 1], fe_bounds[2]]
-        })
-    loose_model.run(last_info=last_info, **draw_dict)
 
-    # get truncated draws
-    tight_draws = tight_model.process_draws(draw_dict['prediction_times'],
-                                            last_info=last_info)
-    loose_draws = loose_model.process_draws(draw_dict['prediction_times'],
-                                            last_info=last_info)
-    combined_draws = {}
-    for group in tight_draws.keys():
-        draws = convex_combination(np.arange(tight_draws[group][1].shape[1]),
-                                   tight_draws[group][1][np.argsort(tight_draws[group][1][:, -1]), :],
-                                   loose_draws[group][1][np.argsort(loose_draws[group][1][:, -1]), :],
-                                   basic_info_dict['predict_space'],
-                                   start_day=start_day,
-                                   end_day=end_day)
-        if group == model_location and fix_point is not None:
-            last_obs = fix_point
-        else:
-            last_obs = tight_model.models[group].obs[-1]
-        combined_draws.update({
-            group: (tight_draws[group][0],
-                    np.log(np.exp(last_obs) + np.exp(draws).cumsum(axis=1)))
-        })
+    overall_spec['location_drawn'] = model_location in combined_draws
+    if overall_spec['location_drawn']:
+        location_model = tight_model.models[model_location]
+        overall_spec['last_point'] = [_scalar(location_model.t[-1]), _scalar(location_model.obs[-1])]
+    else:
+        overall_spec['last_point'] = None
+    if overall_tight_draws is not None and overall_loose_draws is not None:
+        combined_draws['overall'] = combine_overall_draws(overall_tight_draws, overall_loose_draws, overall_spec)
+        tight_model.overall_inputs = None
+    else:
+        tight_model.overall_inputs = _overall_inputs(df, {**settings, 'fix_gamma': bool(fix_gamma)}, overall_spec,
+                                                     {'tight': tight_model, 'loose': loose_model})
 
-    # get overall draws
-    filtered_tight_models = tight_model.run_filtered_models(
-        df=tight_model.all_data, obs_bounds=obs_bounds
-    )
-    overall_tight_draws = tight_model.create_overall_draws(
-        draw_dict['prediction_times'], filtered_tight_models, predict_cov, alpha_times_beta=alpha_times_beta,
-        sample_size=draw_dict['n_draws'], slope_at=10, epsilon=draw_dict['cv_lower_threshold']
-    )
-    filtered_loose_models = loose_model.run_filtered_models(
-        df=loose_model.all_data, obs_bounds=obs_bounds
-    )
-    overall_loose_draws = loose_model.create_overall_draws(
-        draw_dict['prediction_times'], filtered_loose_models, predict_cov, alpha_times_beta=alpha_times_beta,
+    return tight_model, loose_model, combined_draws
+
+
+def _scalar(value):
+    # numpy scalars as python ones, so they can be written as JSON
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _overall_inputs(df, settings, overall_spec, models):
+    # what add_overall_draws needs to make ap_model's overall draws later, as saved with the job outputs;
+    # they're drawn from groups with enough observations, and no group has more of those than rows
+    group_sizes = df.groupby('location').size()
+    groups = group_sizes.index[group_sizes >= overall_spec['obs_bounds'][0]]
+    data = df.loc[df['location'].isin(groups)]
+    return {
+        'settings': {**settings,
+                     'seeds': overall_spec['seeds'],
+                     'location_drawn': overall_spec['location_drawn'],
+                     'last_point': overall_spec['last_point']},
+        'data': {column: data[column].values.astype(str) if data[column].dtype == object else data[column].values
+                 for column in data.columns},
+        'params': {prior: fitted_params({group: model.models[group] for group in groups if group in model.models})
+                   for prior, model in models.items()},
+    }
+
+
+def overall_model_draws(model, prior, overall_spec):
+    """Overall draws (before truncation) for one of ap_model's prior configurations."""
+    # seeded on their own, so they're the same whether made with the fit or later
+    np.random.seed(overall_spec['seeds'][prior])
+    draw_dict = overall_spec['draw_dict']
+    filtered_models = model.run_filtered_models(df=model.all_data, obs_bounds=overall_spec['obs_bounds'])
+    return model.create_overall_draws(
+        draw_dict['prediction_times'], filtered_models, overall_spec['predict_cov'],
+        alpha_times_beta=overall_spec['alpha_times_beta'],
         sample_size=draw_dict['n_draws'], slope_at=10, epsilon=draw_dict['cv_lower_threshold']
     )
 
+
+def combine_overall_draws(overall_tight_draws, overall_loose_draws, overall_spec):
+    """Truncates the tight and loose overall draws and combines them into ln(cumulative death rate)."""
+    fix_point = overall_spec['fix_point']
+    fix_day = overall_spec['fix_day']
+    prediction_times = overall_spec['draw_dict']['prediction_times']
+
     # get specs and truncate overall, then combine
-    if model_location in list(combined_draws.keys()):
-        # last_day = tight_model.models[model_location].t[-1]
+    if overall_spec['location_drawn']:
+        # the model location's last day and observation
+        location_t, location_obs = overall_spec['last_point']
         if fix_day is None:
-            last_day = tight_model.models[model_location].t[-1]
+            last_day = location_t
         else:
             last_day = fix_day
         if fix_point is not None:
             last_obs = fix_point
         else:
-            last_obs = tight_model.models[model_location].obs[-1]
-        overall_time = draw_dict['prediction_times'][int(np.round(last_day)):]
+            last_obs = location_obs
+        overall_time = prediction_times[int(np.round(last_day)):]
     else:
         if fix_day is None:
-            last_day = draw_dict['prediction_times'][0]
+            last_day = prediction_times[0]
         else:
             last_day = fix_day
         if fix_point is not None:
             last_obs = fix_point
         else:
             last_obs = RATE_THRESHOLD
-        overall_time = np.arange(last_day, pred_days)
+        overall_time = np.arange(last_day, overall_spec['pred_days'])
     overall_tight_draws = truncate_draws(
-        t=draw_dict['prediction_times'], draws=overall_tight_draws,
-        draw_space=basic_info_dict['predict_space'],
+        t=prediction_times, draws=overall_tight_draws,
+        draw_space=overall_spec['predict_space'],
         last_day=last_day,
         last_obs=last_obs,
-        last_obs_space=tight_info_dict['fun']
+        last_obs_space=overall_spec['obs_space']['tight']
     )
     overall_loose_draws = truncate_draws(
-        t=draw_dict['prediction_times'], draws=overall_loose_draws,
-        draw_space=basic_info_dict['predict_space'],
+        t=prediction_times, draws=overall_loose_draws,
+        draw_space=overall_spec['predict_space'],
         last_day=last_day,
         last_obs=last_obs,
-        last_obs_space=loose_info_dict['fun']
+        last_obs_space=overall_spec['obs_space']['loose']
     )
     draws = convex_combination(np.arange(overall_tight_draws.shape[1]),
-                               overall_tight_draws[np.argsort(overall_tight_draws[:, -1]), :],
-                               overall_loose_draws[np.argsort(overall_loose_draws[:, -1]), :],
-                               basic_info_dict['predict_space'],
-                               start_day=start_day,
-                               end_day=end_day)
-    combined_draws.update({
-        'overall': (overall_time[1:],
-                    np.log(np.exp(last_obs) + np.exp(draws).cumsum(axis=1)))
-    })
+                               sort_draws(overall_tight_draws),
+                               sort_draws(overall_loose_draws),
+                               overall_spec['predict_space'],
+                               start_day=overall_spec['start_day'],
+                               end_day=overall_spec['end_day'])
+    return (overall_time[1:], cumulative_draws(draws, last_obs))
 
-    return tight_model, loose_model, combined_draws
+
+def add_overall_draws(output_dir):
+    """Makes the overall draws skipped by a job run with lazy overall draws.
+
+    The tight and loose pipelines are set up again from the settings the
+    job saved with its outputs, and the groups the overall draws come from
+    are fit to the data it saved, starting from its own fits of them.  The
+    draws are added to the job's outputs and returned.
+    """
+    outputs = JobOutputs(output_dir)
+    if 'overall' in outputs:
+        return outputs.draws('overall')
+    inputs = outputs.overall_inputs()
+    if inputs is None:
+        raise ValueError(f'The job outputs in {output_dir} have no overall draws, nor the inputs to make them.')
+    settings = dict(inputs['settings'])
+    fix_gamma = settings.pop('fix_gamma')
+    drawn_with = {key: settings.pop(key) for key in ['seeds', 'location_drawn', 'last_point']}
+    pipeline_settings, overall_spec = _ap_model_settings(**settings)
+    overall_spec.update(drawn_with)
+    df = pd.DataFrame(inputs['data'])
+    prior_draws = {}
+    for prior in ['tight', 'loose']:
+        model = _prior_pipeline(df, pipeline_settings[prior], fix_gamma)
+        model.warm_start = inputs['params'][prior]
+        prior_draws[prior] = overall_model_draws(model, prior, overall_spec)
+    days, overall_draws = combine_overall_draws(prior_draws['tight'], prior_draws['loose'], overall_spec)
+
+    # written at the precision of the job's other draws
+    dtype = outputs.draws(outputs.groups[0])[1].dtype
+    overall_draws = overall_draws.astype(dtype, copy=False)
+    add_job_draws(output_dir, {'overall': (days, overall_draws)})
+    if os.path.exists(f'{output_dir}/draws.pkl'):
+        with open(f'{output_dir}/draws.pkl', 'rb') as fread:
+            draws = pickle.load(fread)
+        draws['overall'] = (days, overall_draws)
+        # replaced in one step, like the job outputs' manifest
+        tmp_path = f'{output_dir}/.draws.pkl.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fwrite:
+            pickle.dump(draws, fwrite, -1)
+        os.replace(tmp_path, f'{output_dir}/draws.pkl')
+    return days, overall_draws
 
 
 def ap_flat_asym_model(df, model_location, n_draws, peaked_groups, exclude_groups,
-                       fix_point, fix_day, pred_days=150):
-    # our dataset (rename days as model assumes it's lower case)
-    df = df.copy()
-    df = df.rename(index=str, columns={'Days':'days'})
+                       fix_point, fix_day, pred_days=PRED_DAYS, processed_df=None, warm_start=None, threads=1,
+                       draw_groups=None):
+    # processed_df is prepare_model_data(df), if it's already been done;
+    # draw_groups limits the group draws made to those groups
+    if processed_df is None:
+        processed_df = prepare_model_data(df)
+    df = processed_df
+    if warm_start is None:
+        warm_start = {}
 
     ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ##
     ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ##
@@ -361,13 +735,6 @@ def ap_flat_asym_model(df, model_location, n_draws, peaked_groups, exclude_group
         'fun_gprior': [lambda params: params[0] * params[1], [np.exp(0.7), 1e-1]]
     }
 
-    # prepare data (must exponentiate smoothed column, non-logged col is not smoothed)
-    df['obs_se'] = 1 / (1 + df['days'])
-    df.loc[df['pseudo'] == 1, 'obs_se'] = PSEUDO_SE
-    df['Age-standardized death rate'] = np.exp(df['ln(age-standardized death rate)'])
-    df = process_input(df, 'location_id', 'days', 'Age-standardized death rate',
-                       col_covs=[COVARIATE, 'intercept', 'obs_se'])
-
     # # set number of basis functions based on data
     # if len(df.loc[df['location'] == model_location]) < 20:
     #     n_b = 7
@@ -400,7 +767,7 @@ def ap_flat_asym_model(df, model_location, n_draws, peaked_groups, exclude_group
     ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ## ##
     ## RUN MODEL
     # The Alpha Prior Model (flat asymmetric module)
-    model = APFlatAsymmetricModel(
+    model = WarmStartAPFlatAsymmetricModel(
         beta_stride=2,
         mixture_size=n_b,
         daily_col='asddr',
@@ -412,6 +779,9 @@ def ap_flat_asym_model(df, model_location, n_draws, peaked_groups, exclude_group
         basic_model_dict=basic_model_dict,
         fit_dict=fit_dict
     )
+    model.warm_start = warm_start.get('tight', {})
+    model.fit_stats = []
+    model.group_processes = pipeline_group_processes(threads, 1)
     model.run(
         n_draws=n_draws,
         prediction_times=np.arange(pred_days),
@@ -422,33 +792,23 @@ def ap_flat_asym_model(df, model_location, n_draws, peaked_groups, exclude_group
             model_location:[fix_day, fix_point]
         }
     )
-    daily_draws = model.process_draws(np.arange(pred_days),
-                                      last_info={
-                                          model_location:[fix_day, fix_point]
-                                      })
+    log_fit_stats('Tight model', model.fit_stats)
+    with only_draw_groups(model, draw_groups):
+        daily_draws = model.process_draws(np.arange(pred_days),
+                                          last_info={
+                                              model_location:[fix_day, fix_point]
+                                          })
 
-    # turn draws into reporting space - ln(cumulative death rate)
-    cumulative_draws = {}
-    for group in daily_draws.keys():
-        # sort
-        loc_daily_draws = daily_draws[group][1][np.argsort(daily_draws[group][1][:,-1]),:]
+    # turn draws into reporting space - ln(cumulative death rate), sorted, in batches of groups
+    last_obs = {group: fix_point if group == model_location and fix_point is not None
+                else model.models[group].obs[-1]
+                for group in daily_draws}
+    return model, batch_process_draws(daily_draws, last_obs)
 
-        # get start pred
-        if group == model_location and fix_point is not None:
-            last_obs = fix_point
-        else:
-            last_obs = model.models[group].obs[-1]
-
-        # add last turn to cumulative and last
-        cumulative_draws.update({
-            group: (daily_draws[group][0],
-                    np.log(np.exp(last_obs) + np.exp(loc_daily_draws).cumsum(axis=1)))
-        })
 
-    return model, cumulative_draws
-
-
-def plot_location(location, location_name, covariate_val, tm, lm, model_instance, draw, population, pdf=None, pred_days=150):
+def location_plot_inputs(location, location_name, covariate_val, tm, lm, model_instance, draw, population,
+                         pred_days=PRED_DAYS):
+    """What plot_location_fit needs to plot a location, without the models."""
     # get past curve point estimates
     tight_curve_t = np.arange(pred_days)
     tight_curve = tm.predict(tight_curve_t, group_name=location)
@@ -461,74 +821,24 @@ def plot_location(location, location_name, covariate_val, tm, lm, model_instance
         loose_curve_t = np.arange(pred_days)
         loose_curve = model_instance.predict(loose_curve_t, ln_gaussian_cdf, location)
         loose_color = 'darkgrey'
+    return {
+        'location_name': location_name,
+        'covariate_val': covariate_val,
+        't': np.asarray(tm.t),
+        'obs': np.asarray(tm.obs),
+        'tight_curve_t': tight_curve_t,
+        'tight_curve': tight_curve,
+        'loose_curve_t': loose_curve_t,
+        'loose_curve': loose_curve,
+        'loose_color': loose_color,
+        'summary': draw_summary(draw, population),
+    }
 
-    # set up plot space
-    fig, ax = plt.subplots(2, 2, figsize=(16.5, 8.5))
-
-    # ln(asdr)
-    ax[0, 0].scatter(tm.t, tm.obs, c='dodgerblue', edgecolors='navy')
-    ax[0, 0].plot(draw[0], draw[1].mean(axis=0), color='dodgerblue')
-    ax[0, 0].plot(tight_curve_t, tight_curve, color='forestgreen')
-    ax[0, 0].plot(loose_curve_t, loose_curve, color=loose_color)
-    ax[0, 0].fill_between(draw[0],
-                          np.quantile(draw[1], 0.025, axis=0),
-                          np.quantile(draw[1], 0.975, axis=0),
-                          color='dodgerblue', alpha=0.25)
-    ax[0, 0].set_xlim(tm.t.min() * 0.9, tm.t.max() + 28)
-    ax[0, 0].set_ylabel('ln(asdr)')
-
-    # asdr
-    ax[0, 1].scatter(tm.t, np.exp(tm.obs), c='dodgerblue', edgecolors='navy')
-    ax[0, 1].plot(draw[0], np.exp(draw[1]).mean(axis=0), color='dodgerblue')
-    ax[0, 1].plot(tight_curve_t, np.exp(tight_curve), color='forestgreen')
-    ax[0, 1].plot(loose_curve_t, np.exp(loose_curve), color=loose_color)
-    ax[0, 1].fill_between(draw[0],
-                          np.quantile(np.exp(draw[1]), 0.025, axis=0),
-                          np.quantile(np.exp(draw[1]), 0.975, axis=0),
-                          color='dodgerblue', alpha=0.25)
-    ax[0, 1].set_ylabel('asdr')
-    ax[0, 1].set_xlim(0, draw[0].max())
-    ax[0, 1].set_ylim(0, np.quantile(np.exp(draw[1]), 0.975, axis=0).max()*1.1)
-
-    # deaths
-    ax[1, 0].scatter(tm.t, np.exp(tm.obs)*population, c='dodgerblue', edgecolors='navy')
-    ax[1, 0].plot(draw[0], np.exp(draw[1]).mean(axis=0)*population, color='dodgerblue')
-    ax[1, 0].plot(tight_curve_t, np.exp(tight_curve)*population, color='forestgreen')
-    ax[1, 0].plot(loose_curve_t, np.exp(loose_curve)*population, color=loose_color)
-    ax[1, 0].fill_between(draw[0],
-                          np.quantile(np.exp(draw[1])*population, 0.025, axis=0),
-                          np.quantile(np.exp(draw[1])*population, 0.975, axis=0),
-                          color='dodgerblue', alpha=0.25)
-    ax[1, 0].set_ylabel('deaths')
-    ax[1, 0].set_xlim(0, draw[0].max())
-    ax[1, 0].set_ylim(0, np.quantile(np.exp(draw[1])*population, 0.975, axis=0).max() * 1.1)
-    ax[1, 0].set_xlabel('days')
-
-    # daily deaths
-    ax[1, 1].scatter(tm.t[1:], np.exp(tm.obs)[1:]*population - np.exp(tm.obs)[:-1]*population,
-                     c='dodgerblue', edgecolors='navy')
-    ax[1, 1].plot(draw[0][1:], (np.exp(draw[1])[:, 1:]*population - np.exp(draw[1])[:, :-1]*population).mean(axis=0),
-                  color='dodgerblue')
-    ax[1, 1].plot(tight_curve_t[1:], np.exp(tight_curve)[1:]*population - np.exp(tight_curve)[:-1]*population,
-                  color='forestgreen')
-    ax[1, 1].plot(loose_curve_t[1:], np.exp(loose_curve)[1:]*population - np.exp(loose_curve)[:-1]*population,
-                  color=loose_color)
-    ax[1, 1].fill_between(draw[0][1:],
-                          np.quantile(np.exp(draw[1])[:, 1:]*population
-                                      - np.exp(draw[1])[:, :-1]*population, 0.025, axis=0),
-                          np.quantile(np.exp(draw[1])[:, 1:]*population
-                                      - np.exp(draw[1])[:, :-1]*population, 0.975, axis=0),
-                          color='dodgerblue', alpha=0.25)
-    ax[1, 1].set_ylabel('daily deaths')
-    ax[1, 1].set_xlim(0, draw[0].max())
-    ax[1, 1].set_xlabel('days')
-
-    plt.suptitle(f'{location_name} - SD cov: {np.round(covariate_val, 2)}', y=1.00025)
-    plt.tight_layout()
-    if pdf is not None:
-        pdf.savefig(fig)
-    else:
-        plt.show()
+
+def plot_location(location, location_name, covariate_val, tm, lm, model_instance, draw, population, pdf=None, pred_days=PRED_DAYS):
+    plot_location_fit(location_plot_inputs(location, location_name, covariate_val, tm, lm, model_instance,
+                                           draw, population, pred_days),
+                      pdf=pdf)
 
 
 def run_death_models():
@@ -551,7 +861,7 @@ def run_death_models():
         '--data_file', help='Name of location-standardized data file.', type=str
     )
     parser.add_argument(
-        '--cov_file', help='Name of covariate file.', type=str
+        '--cov_file', help='Name of covariate file, one per scenario.', type=str, nargs='+'
     )
     parser.add_argument(
         '--last_day_file', help='Name of last day of deaths file.', type=str
@@ -560,30 +870,167 @@ def run_death_models():
         '--peaked_file', help='Name of peaked locations file.', type=str
     )
     parser.add_argument(
-        '--output_dir', help='Where we are storing results.', type=str
+        '--output_dir', help='Where we are storing results, one per scenario.', type=str, nargs='+'
+    )
+    parser.add_argument(
+        '--covariate_effect', help='Whether covariate is acting on beta or gamma, one per scenario.',
+        type=str, nargs='+'
+    )
+    parser.add_argument(
+        '--n_draws', help='How many samples to take, one per scenario.', type=int, nargs='+'
+    )
+    parser.add_argument(
+        '--warm_start_dir', help='Output directory of a previous run to start fits from, one per scenario.',
+        type=str, nargs='+'
+    )
+    parser.add_argument(
+        '--threads', help='Thread budget for the job, at least 1; with 2 or more, the prior configurations and '
+                           'each group\'s fits run in parallel.  Draws are the same for any budget, but '
+                           'differ from those of versions before 0.9.1, see CHANGELOG.rst.',
+        type=int, default=1
+    )
+    parser.add_argument(
+        '--targeted_draws', action='store_true',
+        help='Only make draws (and plots) for the model location and overall, which are all that is saved.'
+    )
+    parser.add_argument(
+        '--lazy_overall', action='store_true',
+        help='Skip the overall draws when the model location has draws of its own, saving what is needed '
+             'to make them later with --overall_dir.'
+    )
+    parser.add_argument(
+        '--overall_dir', help='Add overall draws to the outputs of jobs run with --lazy_overall, then exit.',
+        type=str, nargs='+'
+    )
+    parser.add_argument(
+        '--pred_days', help='Days from the death threshold to predict.', type=int, default=PRED_DAYS
+    )
+    parser.add_argument(
+        '--output_format', choices=['both', 'compact'], default='both',
+        help='Write compact array outputs only, or with the models, fit dicts and draws also pickled.'
+    )
+    parser.add_argument(
+        '--compress_outputs', action='store_true', help='Compress the fitted parameters in the job outputs.'
+    )
+    parser.add_argument(
+        '--draw_dtype', choices=['float64', 'float32'], default='float64',
+        help='Precision of the draws written; float32 halves their size.'
+    )
+    parser.add_argument(
+        '--no_plots', action='store_true',
+        help='Save model fit plot inputs to render later instead of plotting the fits.'
     )
     parser.add_argument(
-        '--covariate_effect', help='Whether covariate is acting on beta or gamma.', type=str
+        '--queue_dir', help='Run as a worker, fitting jobs from this queue instead.', type=str
     )
     parser.add_argument(
-        '--n_draws', help='How many samples to take.', type=int
+        '--idle_timeout', help='Seconds a worker waits on an empty queue before exiting.', type=float, default=60.
+    )
+    parser.add_argument(
+        '--claim_timeout', type=float,
+        help='Seconds after which a worker finding the queue empty puts back jobs still running, '
+             'as their workers have died.  Must be longer than any job takes.'
     )
     args = parser.parse_args()
 
+    if args.threads < 1:
+        parser.error('--threads must be at least 1.')
+
     logger.info(args)
+    if args.queue_dir is not None:
+        serve_queue(args.queue_dir, idle_timeout=args.idle_timeout, claim_timeout=args.claim_timeout)
+        return
+    if args.overall_dir is not None:
+        for output_dir in args.overall_dir:
+            add_overall_draws(output_dir)
+        return
+    scenario_args = [args.cov_file, args.output_dir, args.covariate_effect, args.n_draws]
+    if len({len(arg) for arg in scenario_args}) != 1:
+        parser.error('--cov_file, --output_dir, --covariate_effect and --n_draws '
+                     'need one value for each scenario.')
+    if args.warm_start_dir is None:
+        warm_start_dirs = [None] * len(args.cov_file)
+    elif len(args.warm_start_dir) == len(args.cov_file):
+        warm_start_dirs = args.warm_start_dir
+    else:
+        parser.error('--warm_start_dir needs one value for each scenario.')
+
     # read data
     df = pd.read_csv(args.data_file)
-    cov_df = pd.read_csv(args.cov_file)
+    peaked_df = pd.read_csv(args.peaked_file)
+    last_day_df = pd.read_csv(args.last_day_file)
+    scenarios = [Scenario(cov_df=pd.read_csv(cov_file),
+                          output_dir=output_dir,
+                          covariate_effect=covariate_effect,
+                          n_draws=n_draws,
+                          warm_start_dir=warm_start_dir)
+                 for cov_file, output_dir, covariate_effect, n_draws, warm_start_dir
+                 in zip(*scenario_args, warm_start_dirs)]
+
+    run_location_models(model_location_id=args.model_location_id,
+                        df=df,
+                        scenarios=scenarios,
+                        peaked_df=peaked_df,
+                        last_day_df=last_day_df,
+                        threads=args.threads,
+                        targeted_draws=args.targeted_draws,
+                        lazy_overall=args.lazy_overall,
+                        pred_days=args.pred_days,
+                        output_format=args.output_format,
+                        compress_outputs=args.compress_outputs,
+                        plots=not args.no_plots,
+                        draw_dtype=args.draw_dtype)
+
+
+class Scenario(NamedTuple):
+    """A covariate scenario to fit for a location, and where to write its outputs."""
+    cov_df: pd.DataFrame
+    output_dir: str
+    covariate_effect: str
+    n_draws: int
+    warm_start_dir: Optional[str] = None
+
+
+def run_location_model(model_location_id, df, cov_df, peaked_df, last_day_df,
+                       output_dir, covariate_effect, n_draws, warm_start_dir=None, pred_days=None,
+                       draw_dtype=None):
+    """Fits the models for one location and writes its outputs to output_dir.
+
+    Takes the contents of the files passed to ``run_death_models`` as DataFrames.
+    """
+    scenario = Scenario(cov_df, output_dir, covariate_effect, n_draws, warm_start_dir)
+    run_location_models(model_location_id, df, [scenario], peaked_df, last_day_df, pred_days=pred_days,
+                        draw_dtype=draw_dtype)
+
 
-    # try setting floor for covariate
-    cov_df.loc[cov_df[COVARIATE] < 0.25, COVARIATE] = 0.25
+def run_location_models(model_location_id, df, scenarios, peaked_df, last_day_df, threads=1,
+                        targeted_draws=False, lazy_overall=False, pred_days=None, output_format='both',
+                        compress_outputs=False, plots=True, draw_dtype=None):
+    """Fits the models for one location under each covariate scenario.
 
-    # attach covs to data file
-    df = pd.merge(df, cov_df[['location_id', COVARIATE]], how='left')
-    if df[COVARIATE].isnull().any():
-        missing_locs = df.loc[df[COVARIATE].isnull(), 'Location'].unique().tolist()
-        print(f'The following locations are missing covariates: {", ".join(missing_locs)}')
-        df = df.loc[~df[COVARIATE].isnull()]
+    The data is read and processed once for all scenarios, and each scenario's
+    fits start from the parameters fit for the scenario before it, or from
+    its fits in ``warm_start_dir`` where it has one.  Each scenario writes to
+    its own output directory, as if it had run alone.  Draws are written
+    as ``draw_dtype`` (e.g. ``'float32'``), or at full precision if None.
+    """
+    df = df.copy()
+    peaked_df = peaked_df.copy()
+    if pred_days is None:
+        pred_days = PRED_DAYS
+
+    scenario_covariates = [f'{COVARIATE}_{i}' for i in range(len(scenarios))]
+    cov_dfs = []
+    for scenario, scenario_covariate in zip(scenarios, scenario_covariates):
+        cov_df = scenario.cov_df.copy()
+        # try setting floor for covariate
+        cov_df.loc[cov_df[COVARIATE] < 0.25, COVARIATE] = 0.25
+        cov_dfs.append(cov_df)
+
+        # attach covs to data file
+        df = pd.merge(df, cov_df[['location_id', COVARIATE]].rename(columns={COVARIATE: scenario_covariate}),
+                      how='left')
+    df = df.loc[df[scenario_covariates].notnull().any(axis=1)]
     df = df.sort_values(['location_id', 'Days']).reset_index(drop=True)  # 'Country/Region',
 
     # encode location_id for more explicit str indexing in model
@@ -592,21 +1039,11 @@ def run_death_models():
     # add intercept
     df['intercept'] = 1.0
 
-    # identify covariate value for our location
-    location_cov = cov_df.loc[cov_df['location_id'] == args.model_location_id,
-                              COVARIATE].item()
-
-    # don't let it be below 10 / 28
-    if location_cov < 0.36:
-        location_cov = 0.36
-
     # get list of peaked locations
-    peaked_df = pd.read_csv(args.peaked_file)
     peaked_df['location_id'] = '_' + peaked_df['location_id'].astype(str)
 
     # get true ln(dr) on last day
-    last_day_df = pd.read_csv(args.last_day_file)
-    last_day_df = last_day_df.loc[last_day_df['location_id'] == args.model_location_id]
+    last_day_df = last_day_df.loc[last_day_df['location_id'] == model_location_id]
     if last_day_df.empty:
         fix_point = None
         fix_day = None
@@ -614,43 +1051,102 @@ def run_death_models():
         fix_point = last_day_df['ln(death rate)'].item()
         fix_day = last_day_df['Days'].item()
 
+    model_columns = ['location_id', 'intercept', 'Days', 'pseudo', 'ln(age-standardized death rate)']
+    processed_df = prepare_model_data(df[model_columns + scenario_covariates], scenario_covariates)
+
+    warm_start = None
+    for scenario, scenario_covariate, cov_df in zip(scenarios, scenario_covariates, cov_dfs):
+        scenario_df = df.copy()
+        scenario_df[COVARIATE] = scenario_df[scenario_covariate]
+        if scenario_df[COVARIATE].isnull().any():
+            missing_locs = scenario_df.loc[scenario_df[COVARIATE].isnull(), 'Location'].unique().tolist()
+            print(f'The following locations are missing covariates: {", ".join(missing_locs)}')
+            scenario_df = scenario_df.loc[~scenario_df[COVARIATE].isnull()].reset_index(drop=True)
+        scenario_processed_df = processed_df.loc[
+            processed_df['location'].isin(scenario_df['location_id'].unique())
+        ].reset_index(drop=True)
+        scenario_processed_df[COVARIATE] = scenario_processed_df[scenario_covariate]
+
+        if scenario.warm_start_dir is not None:
+            stored_warm_start = load_warm_start(scenario.warm_start_dir)
+            warm_start = warm_start or {}
+            warm_start = {label: {**warm_start.get(label, {}), **stored_warm_start.get(label, {})}
+                          for label in ['tight', 'loose']}
+        warm_start = _run_scenario(model_location_id, scenario_df, scenario_processed_df, cov_df,
+                                   peaked_df, fix_point, fix_day,
+                                   scenario.output_dir, scenario.covariate_effect, scenario.n_draws,
+                                   warm_start, threads, targeted_draws, lazy_overall, pred_days,
+                                   output_format, compress_outputs, plots, draw_dtype)
+
+
+def _run_scenario(model_location_id, df, processed_df, cov_df, peaked_df, fix_point, fix_day,
+                  output_dir, covariate_effect, n_draws, warm_start, threads, targeted_draws, lazy_overall,
+                  pred_days, output_format, compress_outputs, plots, draw_dtype=None):
+    """Fits and writes out one scenario, returning its fitted parameters by group."""
+    # identify covariate value for our location
+    location_cov = cov_df.loc[cov_df['location_id'] == model_location_id,
+                              COVARIATE].item()
+
+    # don't let it be below 10 / 28
+    if location_cov < 0.36:
+        location_cov = 0.36
+
+    # groups whose draws are kept (other groups' draws are only plotted)
+    draw_groups = [f'_{model_location_id}'] if targeted_draws else None
+
+    # predict at least a little past the location's own data
+    location_days = df.loc[df['location_id'] == f'_{model_location_id}', 'Days']
+    if not location_days.empty:
+        pred_days = max(pred_days, int(np.ceil(location_days.max())) + 2)
+
     ## run models
-    model_seed = get_hash(f'_{args.model_location_id}')
+    model_seed = get_hash(f'_{model_location_id}')
     np.random.seed(model_seed)
     # AP model for data poor
-    if len(df.loc[df['location_id'] == f'_{args.model_location_id}']) < DATA_THRESHOLD:
+    if len(df.loc[df['location_id'] == f'_{model_location_id}']) < DATA_THRESHOLD:
         logger.info('Running data poor model')
-        # or df.loc[df['location_id'] == f'_{args.model_location_id}', 'Deaths'].max() < 5:
+        # or df.loc[df['location_id'] == f'_{model_location_id}', 'Deaths'].max() < 5:
         #
         # are we using a beta or gamma covariate
-        if args.covariate_effect == 'beta':
+        if covariate_effect == 'beta':
             fix_gamma = True
-        elif args.covariate_effect == 'gamma':
+        elif covariate_effect == 'gamma':
             fix_gamma = False
 
         # alpha prior model (no flat top)
         tight_model, loose_model, draws = ap_model(
             df=df[['location_id', 'intercept', 'Days', 'pseudo', 'ln(age-standardized death rate)', COVARIATE]],
-            model_location=f'_{args.model_location_id}',
+            model_location=f'_{model_location_id}',
             location_cov=location_cov,
-            n_draws=args.n_draws,
+            n_draws=n_draws,
             peaked_groups=peaked_df.loc[peaked_df['location_id'].isin(df['location_id'].unique().tolist()), 'location_id'].to_list(),
             exclude_groups=peaked_df.loc[peaked_df['Location'] == 'Wuhan City, Hubei', 'location_id'].unique().tolist(),
             fix_gamma=fix_gamma,
             fix_point=fix_point,
-            fix_day=fix_day
+            fix_day=fix_day,
+            processed_df=processed_df,
+            warm_start=warm_start,
+            threads=threads,
+            draw_groups=draw_groups,
+            lazy_overall=lazy_overall,
+            pred_days=pred_days
         )
         model = 'AP'
     else: # AP model for data rich
         logger.info('Running data rich model.')
         tight_model, draws = ap_flat_asym_model(
             df=df[['location_id', 'intercept', 'Days', 'pseudo', 'ln(age-standardized death rate)', COVARIATE]],
-            model_location=f'_{args.model_location_id}',
-            n_draws=args.n_draws,
+            model_location=f'_{model_location_id}',
+            n_draws=n_draws,
             peaked_groups=peaked_df.loc[peaked_df['location_id'].isin(df['location_id'].unique().tolist()), 'location_id'].to_list(),
             exclude_groups=peaked_df.loc[peaked_df['Location'] == 'Wuhan City, Hubei', 'location_id'].unique().tolist(),
             fix_point=fix_point,
-            fix_day=fix_day
+            fix_day=fix_day,
+            processed_df=processed_df,
+            warm_start=warm_start,
+            threads=threads,
+            draw_groups=draw_groups,
+            pred_days=pred_days
         )
         loose_model = tight_model  # just to plug into plot
         model = 'AP flat asymmetrical'
@@ -658,51 +1154,136 @@ def run_death_models():
 
     # only save this location and overall draws
     subset_draws = dict()
-    for model_label in [f'_{args.model_location_id}', 'overall']:
+    for model_label in [f'_{model_location_id}', 'overall']:
         if model_label in list(draws.keys()):
             subset_draws.update({
                 model_label: draws[model_label]
             })
+    if draw_dtype is not None:
+        subset_draws = {group: (days, group_draws.astype(draw_dtype, copy=False))
+                        for group, (days, group_draws) in subset_draws.items()}
 
     # store outputs
     # data
-    df[['location_id', 'intercept', 'Days', 'pseudo', 'ln(age-standardized death rate)', COVARIATE]].to_csv(f'{args.output_dir}/data.csv', index=False)
-    # loose
+    df[['location_id', 'intercept', 'Days', 'pseudo', 'ln(age-standardized death rate)', COVARIATE]].to_csv(f'{output_dir}/data.csv', index=False)
+    # compact draws and fitted parameters
+    params = {'tight': fitted_params(tight_model.models)}
     if model == 'AP':
-        logger.info('Writing loose models.')
-        with open(f'{args.output_dir}/loose_models.pkl', 'wb') as fwrite:
-            pickle.dump(loose_model.models, fwrite, -1)
-        with open(f'{args.output_dir}/loose_model_fit_dict.pkl', 'wb') as fwrite:
-            pickle.dump(loose_model.fit_dict, fwrite, -1)
-    # tight
-    logger.info('Writing tight models')
-    with open(f'{args.output_dir}/tight_models.pkl', 'wb') as fwrite:
-        pickle.dump(tight_model.models, fwrite, -1)
-    with open(f'{args.output_dir}/tight_model_fit_dict.pkl', 'wb') as fwrite:
-        pickle.dump(tight_model.fit_dict, fwrite, -1)
-    # subset draws
-    logger.info('Writing draws')
-    with open(f'{args.output_dir}/draws.pkl', 'wb') as fwrite:
-        pickle.dump(subset_draws, fwrite, -1)
+        params['loose'] = fitted_params(loose_model.models)
+    # the fitted curve before the location's draws start (from the loose model, which is
+    # the tight model for data rich locations), so readers needn't load the models
+    past_predictions = {
+        location: loose_model.models[location].predict(np.arange(subset_draws[location][0][0]),
+                                                       group_name=location)
+        for location in subset_draws if location != 'overall'
+    }
+    logger.info('Writing job outputs.')
+    overall_inputs = tight_model.overall_inputs if model == 'AP' else None
+    write_job_outputs(output_dir, subset_draws, params, past_predictions, compress=compress_outputs,
+                      dtype=draw_dtype, overall_inputs=overall_inputs)
+    if output_format == 'both':
+        # loose
+        if model == 'AP':
+            logger.info('Writing loose models.')
+            with open(f'{output_dir}/loose_models.pkl', 'wb') as fwrite:
+                pickle.dump(loose_model.models, fwrite, -1)
+            with open(f'{output_dir}/loose_model_fit_dict.pkl', 'wb') as fwrite:
+                pickle.dump(loose_model.fit_dict, fwrite, -1)
+        # tight
+        logger.info('Writing tight models')
+        with open(f'{output_dir}/tight_models.pkl', 'wb') as fwrite:
+            pickle.dump(tight_model.models, fwrite, -1)
+        with open(f'{output_dir}/tight_model_fit_dict.pkl', 'wb') as fwrite:
+            pickle.dump(tight_model.fit_dict, fwrite, -1)
+        # subset draws
+        logger.info('Writing draws')
+        with open(f'{output_dir}/draws.pkl', 'wb') as fwrite:
+            pickle.dump(subset_draws, fwrite, -1)
 
     # plot (special condition if using multiple Gaussian)
     if model == 'AP':
         model_instance = None
     else:
         model_instance = tight_model
-    logger.info('Writing model fit plots.')
-    with PdfPages(f'{args.output_dir}/model_fits.pdf') as pdf:
-        for location in tight_model.models.keys():
-            location_name = df.loc[df['location_id'] == location, 'Location'].values[0]
-            plot_location(location=location,
-                          location_name=location_name,
-                          covariate_val=cov_df.loc[cov_df['Location'] == location_name, COVARIATE].item(),
-                          tm=tight_model.models[location],
-                          lm=loose_model.models[location],
-                          model_instance=model_instance,
-                          draw=draws[location],
-                          population=df.loc[df['location_id'] == location, 'population'].values[0],
-                          pdf=pdf)
+    plot_inputs = {}
+    for location in tight_model.models.keys():
+        if location not in draws:
+            continue
+        location_name = df.loc[df['location_id'] == location, 'Location'].values[0]
+        plot_inputs[location] = location_plot_inputs(
+            location=location,
+            location_name=location_name,
+            covariate_val=cov_df.loc[cov_df['Location'] == location_name, COVARIATE].item(),
+            tm=tight_model.models[location],
+            lm=loose_model.models[location],
+            model_instance=model_instance,
+            draw=draws[location],
+            population=df.loc[df['location_id'] == location, 'population'].values[0],
+            pred_days=pred_days
+        )
+    if plots:
+        logger.info('Writing model fit plots.')
+        with PdfPages(f'{output_dir}/model_fits.pdf') as pdf:
+            for inputs in plot_inputs.values():
+                plot_location_fit(inputs, pdf=pdf)
+    else:
+        # rendered later, see covid_model_deaths.plotting.model_fits
+        logger.info('Writing model fit plot inputs.')
+        write_plot_inputs(output_dir, plot_inputs)
+
+    return {'tight': params['tight'],
+            'loose': params.get('loose', params['tight'])}
+
+
+def serve_queue(queue_dir, idle_timeout=60., poll_interval=5., claim_timeout=None):
+    """Fits jobs from a JobQueue until it has been empty for idle_timeout seconds.
+
+    Job specs hold the same fields as the command line arguments.  Imports and the
+    peaked and last day files are loaded once for all of a worker's jobs.  With a
+    claim_timeout, jobs claimed longer ago than that are put back on the queue
+    when it's empty, so jobs of workers that died are run again.
+    """
+    queue = JobQueue(queue_dir)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    logger.info(f'Worker {worker} serving {queue}.')
+    idle_since = time.time()
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            if claim_timeout is not None:
+                requeued = queue.requeue_stale(claim_timeout)
+                if requeued:
+                    logger.warning(f'Requeued {len(requeued)} jobs claimed over {claim_timeout}s ago: {requeued}')
+                    continue
+            if time.time() - idle_since > idle_timeout:
+                logger.info(f'Queue empty for {idle_timeout}s, worker {worker} exiting.')
+                return
+            time.sleep(poll_interval)
+            continue
+
+        job_name, spec = claimed
+        logger.info(f'Running {job_name}.')
+        try:
+            job = ModelJob(job_name=job_name,
+                           model_location_id=spec['model_location_id'],
+                           data=pd.read_csv(spec['data_file']),
+                           cov=pd.read_csv(spec['cov_file']),
+                           last_day_file=spec['last_day_file'],
+                           peaked_file=spec['peaked_file'],
+                           output_dir=spec['output_dir'],
+                           covariate_effect=spec['covariate_effect'],
+                           n_draws=spec['n_draws'],
+                           warm_start_dir=spec.get('warm_start_dir'),
+                           pred_days=spec.get('pred_days'),
+                           draw_dtype=spec.get('draw_dtype'))
+        except Exception:
+            status = JobStatus(job_name, False, 0., traceback.format_exc())
+        else:
+            status = run_model_job(job)
+        if not status.succeeded:
+            logger.error(f'{job_name} failed:\n{status.error}')
+        queue.complete(job_name, {**status._asdict(), 'worker': worker, 'finished': time.time()})
+        idle_since = time.time()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from covid_model_deaths.globals import COLUMNS
@@ -6,9 +7,12 @@ INDEX_COLUMNS = ['location_id', 'location', 'date', 'observed']
 DRAW_COLUMNS = [f'draw_{i}' for i in range(1000)]
 
 
-def load_data(data_path: str) -> pd.DataFrame:
-    """Load data and convert time to pandas time stamp."""
-    data = pd.read_csv(data_path)
+def load_data(data_path: str, dtype=None) -> pd.DataFrame:
+    """Load data and convert time to pandas time stamp.
+
+    Draws are read as ``dtype`` if given (e.g. np.float32, to halve their memory).
+    """
+    data = pd.read_csv(data_path, dtype=None if dtype is None else {draw: dtype for draw in DRAW_COLUMNS})
     data['date'] = pd.to_datetime(data['date'])
     return data
 
@@ -88,12 +92,17 @@ def get_daily_predictions(today_data: pd.DataFrame, yesterday_data: pd.DataFrame
 
 
 def moving_average_predictions(today_data_path: str, yesterday_data_path: str,
-                               day_before_yesterday_path: str) -> pd.DataFrame:
-    """Average the predictions for recent 3 runs."""
+                               day_before_yesterday_path: str, dtype=None) -> pd.DataFrame:
+    """Average the predictions for recent 3 runs.
+
+    Draws are read and averaged as ``dtype`` if given (e.g. np.float32, which
+    halves the memory used and, written out, the size of the averaged draws).
+    See :func:`draw_tolerance_report` for the difference it makes.
+    """
     print("Averaging over the following files: ", [today_data_path, yesterday_data_path, day_before_yesterday_path])
-    today_data = load_data(today_data_path)
-    yesterday_data = load_data(yesterday_data_path)
-    day_before_yesterday_data = load_data(day_before_yesterday_path)
+    today_data = load_data(today_data_path, dtype)
+    yesterday_data = load_data(yesterday_data_path, dtype)
+    day_before_yesterday_data = load_data(day_before_yesterday_path, dtype)
 
     observed_data = get_daily_observed(today_data)
     all_predicted = get_daily_predictions(today_data, yesterday_data, day_before_yesterday_data)
@@ -104,3 +113,44 @@ def moving_average_predictions(today_data_path: str, yesterday_data_path: str,
                   .reset_index()
                   .drop(columns='level_0'))
     return cumulative
+
+
+def draw_tolerance_report(reference: pd.DataFrame, candidate: pd.DataFrame) -> pd.DataFrame:
+    """Compare draws made at two precisions from the same inputs.
+
+    Parameters
+    ----------
+    reference
+        Draws at full precision, e.g. from :func:`moving_average_predictions`.
+    candidate
+        The same draws at reduced precision (e.g. with ``dtype=np.float32``).
+
+    Returns
+    -------
+        The largest absolute and relative differences between the draws and
+        between the summaries reported from them (the mean and 95% interval
+        across draws), one row each.  Relative differences are over values
+        that aren't zero in the reference.
+
+    """
+    if len(reference) != len(candidate):
+        raise ValueError(f'Reference has {len(reference)} rows and candidate {len(candidate)}.')
+    draw_columns = [column for column in reference.columns if column.startswith('draw_')]
+    index_columns = [column for column in INDEX_COLUMNS if column in reference.columns]
+    reference = reference.sort_values(index_columns)[draw_columns].values.astype(np.float64)
+    candidate = candidate.sort_values(index_columns)[draw_columns].values.astype(np.float64)
+
+    comparisons = {'draws': (reference, candidate)}
+    for name, summarize in [('mean', lambda x: x.mean(axis=1)),
+                            ('lower', lambda x: np.quantile(x, 0.025, axis=1)),
+                            ('upper', lambda x: np.quantile(x, 0.975, axis=1))]:
+        comparisons[name] = (summarize(reference), summarize(candidate))
+
+    report = {}
+    for name, (expected, actual) in comparisons.items():
+        abs_error = np.abs(actual - expected)
+        nonzero = expected != 0
+        rel_error = abs_error[nonzero] / np.abs(expected[nonzero])
+        report[name] = {'max_abs_error': abs_error.max(initial=0.),
+                        'max_rel_error': rel_error.max(initial=0.)}
+    return pd.DataFrame.from_dict(report, orient='index')
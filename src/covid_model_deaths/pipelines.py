@@ -0,0 +1,58 @@
+"""Running a job's model pipelines side by side within its thread budget."""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sys
+from typing import Any, Callable, List, Sequence
+
+import dill as pickle
+
+_PIPELINES = []
+
+
+def fork_executor(processes: int) -> ProcessPoolExecutor:
+    """A process pool whose workers are forked, so they inherit module globals.
+
+    Fork is the default on Linux, and ``mp_context`` only exists from
+    Python 3.7.  The workers aren't daemons, so they can run pools of their own.
+    """
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(processes)
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'))
+
+
+def _check_threads(threads: int):
+    if threads < 1:
+        raise ValueError(f'A thread budget of at least 1 is needed, not {threads}.')
+
+
+def pipeline_group_processes(threads: int, n_pipelines: int) -> int:
+    """The processes each of ``n_pipelines`` pipelines run side by side can fit groups in."""
+    _check_threads(threads)
+    return threads // min(threads, n_pipelines)
+
+
+def run_pipelines(pipelines: Sequence[Callable[[], Any]], threads: int = 1) -> List[Any]:
+    """Calls each of the pipelines, in parallel if the thread budget allows.
+
+    Pipelines run in forked processes, one per thread up to one per
+    pipeline, and their results come back pickled with dill.  With a
+    budget of one thread they run one after another in this process.
+    Pipelines that seed their own random draws give the same results
+    either way.
+    """
+    _check_threads(threads)
+    processes = min(threads, len(pipelines))
+    if processes < 2:
+        return [pipeline() for pipeline in pipelines]
+    # forked workers inherit the pipelines, which can't be pickled to send to them
+    _PIPELINES[:] = pipelines
+    try:
+        with fork_executor(processes) as executor:
+            results = list(executor.map(_run_pipeline, range(len(pipelines))))
+    finally:
+        _PIPELINES.clear()
+    return [pickle.loads(result) for result in results]
+
+
+def _run_pipeline(i):
+    return pickle.dumps(_PIPELINES[i]())
@@ -0,0 +1,180 @@
+"""Model fit plots, rendered from plot inputs saved by model jobs.
+
+Jobs run with ``--no_plots`` save each location's plot inputs (observed
+data, fitted curves and draw summaries) instead of rendering
+``model_fits.pdf``, so plots can be made later, for just the locations
+wanted, and for many jobs at once with :func:`plot_all_model_fits`.
+Rendering them needs neither the models nor the draws.
+"""
+import functools
+import multiprocessing
+import os
+from typing import Dict, Iterable, List, Optional
+
+import dill as pickle
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+import numpy as np
+import tqdm
+
+PLOT_INPUTS_FILE = 'plot_inputs.pkl'
+PLOT_FILE = 'model_fits.pdf'
+
+
+def draw_summary(draw, population: float) -> Dict[str, np.ndarray]:
+    """Means and 95% intervals of the draws in each space that's plotted.
+
+    Parameters
+    ----------
+    draw
+        Days and an (n_draws x days) array of ln(asdr) draws.
+    population
+        Location population, to put rates in deaths.
+
+    Returns
+    -------
+        Days, and a mean, lower and upper bound for ln(asdr), asdr and daily
+        asdr.  Deaths are these scaled by population.
+
+    """
+    days, ln_asdr = draw
+    asdr = np.exp(ln_asdr)
+    daily_asdr = asdr[:, 1:] - asdr[:, :-1]
+    summary = {'days': np.asarray(days), 'population': population}
+    for name, values in [('ln_asdr', ln_asdr), ('asdr', asdr), ('daily_asdr', daily_asdr)]:
+        summary[f'{name}_mean'] = values.mean(axis=0)
+        summary[f'{name}_lower'], summary[f'{name}_upper'] = np.quantile(values, [0.025, 0.975], axis=0)
+    return summary
+
+
+def plot_location_fit(inputs: Dict, pdf: Optional[PdfPages] = None):
+    """Plots a location's fits and draws in ln(asdr), asdr, deaths and daily deaths."""
+    t, obs = inputs['t'], inputs['obs']
+    tight_curve_t, tight_curve = inputs['tight_curve_t'], inputs['tight_curve']
+    loose_curve_t, loose_curve = inputs['loose_curve_t'], inputs['loose_curve']
+    loose_color = inputs['loose_color']
+    summary = inputs['summary']
+    days = summary['days']
+    population = summary['population']
+
+    # set up plot space
+    fig, ax = plt.subplots(2, 2, figsize=(16.5, 8.5))
+
+    # ln(asdr)
+    ax[0, 0].scatter(t, obs, c='dodgerblue', edgecolors='navy')
+    ax[0, 0].plot(days, summary['ln_asdr_mean'], color='dodgerblue')
+    ax[0, 0].plot(tight_curve_t, tight_curve, color='forestgreen')
+    ax[0, 0].plot(loose_curve_t, loose_curve, color=loose_color)
+    ax[0, 0].fill_between(days, summary['ln_asdr_lower'], summary['ln_asdr_upper'],
+                          color='dodgerblue', alpha=0.25)
+    ax[0, 0].set_xlim(t.min() * 0.9, t.max() + 28)
+    ax[0, 0].set_ylabel('ln(asdr)')
+
+    # asdr
+    ax[0, 1].scatter(t, np.exp(obs), c='dodgerblue', edgecolors='navy')
+    ax[0, 1].plot(days, summary['asdr_mean'], color='dodgerblue')
+    ax[0, 1].plot(tight_curve_t, np.exp(tight_curve), color='forestgreen')
+    ax[0, 1].plot(loose_curve_t, np.exp(loose_curve), color=loose_color)
+    ax[0, 1].fill_between(days, summary['asdr_lower'], summary['asdr_upper'],
+                          color='dodgerblue', alpha=0.25)
+    ax[0, 1].set_ylabel('asdr')
+    ax[0, 1].set_xlim(0, days.max())
+    ax[0, 1].set_ylim(0, summary['asdr_upper'].max()*1.1)
+
+    # deaths
+    ax[1, 0].scatter(t, np.exp(obs)*population, c='dodgerblue', edgecolors='navy')
+    ax[1, 0].plot(days, summary['asdr_mean']*population, color='dodgerblue')
+    ax[1, 0].plot(tight_curve_t, np.exp(tight_curve)*population, color='forestgreen')
+    ax[1, 0].plot(loose_curve_t, np.exp(loose_curve)*population, color=loose_color)
+    ax[1, 0].fill_between(days, summary['asdr_lower']*population, summary['asdr_upper']*population,
+                          color='dodgerblue', alpha=0.25)
+    ax[1, 0].set_ylabel('deaths')
+    ax[1, 0].set_xlim(0, days.max())
+    ax[1, 0].set_ylim(0, summary['asdr_upper'].max()*population * 1.1)
+    ax[1, 0].set_xlabel('days')
+
+    # daily deaths
+    ax[1, 1].scatter(t[1:], np.exp(obs)[1:]*population - np.exp(obs)[:-1]*population,
+                     c='dodgerblue', edgecolors='navy')
+    ax[1, 1].plot(days[1:], summary['daily_asdr_mean']*population, color='dodgerblue')
+    ax[1, 1].plot(tight_curve_t[1:], np.exp(tight_curve)[1:]*population - np.exp(tight_curve)[:-1]*population,
+                  color='forestgreen')
+    ax[1, 1].plot(loose_curve_t[1:], np.exp(loose_curve)[1:]*population - np.exp(loose_curve)[:-1]*population,
+                  color=loose_color)
+    ax[1, 1].fill_between(days[1:], summary['daily_asdr_lower']*population, summary['daily_asdr_upper']*population,
+                          color='dodgerblue', alpha=0.25)
+    ax[1, 1].set_ylabel('daily deaths')
+    ax[1, 1].set_xlim(0, days.max())
+    ax[1, 1].set_xlabel('days')
+
+    plt.suptitle(f'{inputs["location_name"]} - SD cov: {np.round(inputs["covariate_val"], 2)}', y=1.00025)
+    plt.tight_layout()
+    if pdf is not None:
+        pdf.savefig(fig)
+        # close the figure, the process may go on to plot other locations
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def write_plot_inputs(output_dir: str, plot_inputs: Dict[str, Dict]):
+    """Saves each location's plot inputs, with their arrays as float32 as that's plenty to plot."""
+    plot_inputs = {location: _float32_arrays(inputs) for location, inputs in plot_inputs.items()}
+    with open(f'{output_dir}/{PLOT_INPUTS_FILE}', 'wb') as fwrite:
+        pickle.dump(plot_inputs, fwrite, -1)
+
+
+def _float32_arrays(inputs: Dict) -> Dict:
+    compact = {}
+    for key, value in inputs.items():
+        if isinstance(value, dict):
+            compact[key] = _float32_arrays(value)
+        elif isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+            compact[key] = value.astype(np.float32)
+        else:
+            compact[key] = value
+    return compact
+
+
+def plot_model_fits(output_dir: str, locations: Optional[Iterable[str]] = None) -> Optional[str]:
+    """Renders a job's model fit plots from its saved plot inputs.
+
+    Parameters
+    ----------
+    output_dir
+        The job's output directory.
+    locations
+        Location ids (as used in the model, e.g. ``'_123'``) to plot, or
+        all of those the job saved if None.
+
+    Returns
+    -------
+        The path of the plots, or None if the job saved no plot inputs for
+        the locations.
+
+    """
+    if not os.path.exists(f'{output_dir}/{PLOT_INPUTS_FILE}'):
+        return None
+    with open(f'{output_dir}/{PLOT_INPUTS_FILE}', 'rb') as fread:
+        plot_inputs = pickle.load(fread)
+    if locations is not None:
+        locations = set(locations)
+        plot_inputs = {location: inputs for location, inputs in plot_inputs.items() if location in locations}
+    if not plot_inputs:
+        return None
+    plot_path = f'{output_dir}/{PLOT_FILE}'
+    with PdfPages(plot_path) as pdf:
+        for inputs in plot_inputs.values():
+            plot_location_fit(inputs, pdf=pdf)
+    return plot_path
+
+
+def plot_all_model_fits(output_dirs: List[str], locations: Optional[Iterable[str]] = None,
+                        processes: int = None) -> List[Optional[str]]:
+    """Renders the model fit plots for many jobs in a process pool."""
+    if locations is not None:
+        locations = list(locations)
+    with multiprocessing.Pool(processes) as p:
+        plot_paths = list(tqdm.tqdm(p.imap(functools.partial(plot_model_fits, locations=locations), output_dirs),
+                                    total=len(output_dirs)))
+    return plot_paths
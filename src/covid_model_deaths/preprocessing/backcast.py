@@ -1,29 +1,26 @@
+from typing import Sequence
+
 import numpy as np
 import pandas as pd
 
 from covid_model_deaths.globals import COLUMNS, LOCATIONS
 
 
-def backcast_all_locations(df: pd.DataFrame, rate_threshold: float) -> pd.DataFrame:
+def backcast_all_locations(df: pd.DataFrame, rate_threshold: float,
+                           no_backcast_location_ids: Sequence[int] = (LOCATIONS.life_care.id,)) -> pd.DataFrame:
     df = add_change_in_rate(df, COLUMNS.ln_age_death_rate, COLUMNS.delta_ln_asdr)
     df = add_change_in_rate(df, COLUMNS.obs_ln_age_death_rate, COLUMNS.observed_delta_ln_asdr)
-    daily_change = get_backcast_daily_change_by_location(df, COLUMNS.delta_ln_asdr)
-
-    bc_df = pd.concat([
-        backcast_log_age_standardized_death_ratio(
-            df.loc[df[COLUMNS.location_id] == bc_location_id],
-            bc_location_id,
-            daily_change.at[bc_location_id],
-            rate_threshold,
-        ) for bc_location_id in daily_change.index
-    ])
-    df = df.append(bc_df)
+    daily_change = get_backcast_daily_change_by_location(df, COLUMNS.delta_ln_asdr,
+                                                         no_backcast_location_ids=no_backcast_location_ids)
+
+    bc_df = backcast_log_age_standardized_death_ratio(df, daily_change, rate_threshold)
+    df = pd.concat([df, bc_df], sort=False)
     df = df.sort_values([COLUMNS.location_id, COLUMNS.days]).reset_index(drop=True)
     # TODO: Document this assumption about back-filling.
     fill_cols = [COLUMNS.location, COLUMNS.country, COLUMNS.population]
     df[fill_cols] = df[fill_cols].fillna(method='backfill')
     df[COLUMNS.location_id] = df[COLUMNS.location_id].astype(int)
-    df[COLUMNS.first_point] = df.groupby([COLUMNS.country, COLUMNS.location], as_index=False)[COLUMNS.days].transform('min')
+    df[COLUMNS.first_point] = df.groupby(COLUMNS.location_id)[COLUMNS.days].transform('min')
     df.loc[df[COLUMNS.first_point] < 0, COLUMNS.days] = df[COLUMNS.days] - df[COLUMNS.first_point]
     del df[COLUMNS.first_point]
     return df
@@ -33,17 +30,14 @@ def add_change_in_rate(data: pd.DataFrame, measure: str, delta_measure: str) ->
     """Compute and assign the daily difference in the measure."""
     required_columns = [COLUMNS.location_id, measure]
     assert set(required_columns).issubset(data.columns)
-    data[delta_measure] = (
-        data
-        .groupby(COLUMNS.location_id)
-        .apply(lambda x: x.set_index(COLUMNS.date)[measure] - x.set_index(COLUMNS.date)[measure].shift(1))
-        .reset_index()[measure]
-    )
+    data[delta_measure] = data.groupby(COLUMNS.location_id)[measure].diff()
     return data
 
 
 def get_backcast_daily_change_by_location(data: pd.DataFrame, measure: str,
-                                          average_window: int = 5, cutoff: float = 1e-4) -> pd.Series:
+                                          average_window: int = 5, cutoff: float = 1e-4,
+                                          no_backcast_location_ids: Sequence[int] = (LOCATIONS.life_care.id,)
+                                          ) -> pd.Series:
     """Compute the incremental change in the measure for the backcast.
 
     Parameters
@@ -58,6 +52,8 @@ def get_backcast_daily_change_by_location(data: pd.DataFrame, measure: str,
     cutoff
         The value below which we will not compute a daily change for back
         cast.
+    no_backcast_location_ids
+        Locations that should never be back cast.
 
     Returns
     -------
@@ -67,45 +63,72 @@ def get_backcast_daily_change_by_location(data: pd.DataFrame, measure: str,
     required_columns = [COLUMNS.location_id, COLUMNS.days, measure]
     assert set(required_columns).issubset(data.columns)
     # FIXME: Backcast should not care about this piece
-    non_nursing_home = ~data[COLUMNS.location_id].isin([LOCATIONS.life_care.id])
+    to_backcast = ~data[COLUMNS.location_id].isin(no_backcast_location_ids)
     in_window = (0 < data[COLUMNS.days]) & (data[COLUMNS.days] <= average_window)
     daily_change = (data
-                    .loc[in_window & non_nursing_home, [COLUMNS.location_id, measure]]
+                    .loc[in_window & to_backcast, [COLUMNS.location_id, measure]]
                     .groupby(COLUMNS.location_id)[measure]
                     .mean())
     daily_change = daily_change.loc[daily_change > cutoff]
     return daily_change
 
 
-def backcast_log_age_standardized_death_ratio(df: pd.DataFrame, location_id: int,
-                                              bc_step: int, rate_threshold: float) -> pd.DataFrame:
-    """Backcast the log age standardized death rate back to the rate threshold."""
+def backcast_log_age_standardized_death_ratio(data: pd.DataFrame, daily_change: pd.Series, rate_threshold: float,
+                                              max_backcast_days: int = 10) -> pd.DataFrame:
+    """Backcast the log age standardized death rate back to the rate threshold.
+
+    Parameters
+    ----------
+    data
+        The data to back cast.
+    daily_change
+        The daily change in the measure by location to back cast with.
+    rate_threshold
+        The log age standardized death rate to back cast to.
+    max_backcast_days
+        The most days we will project back.
+
+    Returns
+    -------
+        The back cast rows for every location in the daily change.
+
+    """
     out_columns = [COLUMNS.location_id, COLUMNS.days, COLUMNS.ln_age_death_rate]
     # get first point
-    start_rep = df.sort_values(COLUMNS.days).reset_index(drop=True)[COLUMNS.ln_age_death_rate][0]
-
-    if start_rep > rate_threshold:  # backcast
-        # count from threshold on
-        bc_rates = np.arange(rate_threshold, start_rep, bc_step)
-        bc_df = pd.DataFrame({
-            COLUMNS.location_id: location_id,
-            COLUMNS.ln_age_death_rate: np.flip(bc_rates)
-        })
-
-        # remove fractional step from last (we force the threshold day to
-        # be 0, so the partial day ends up getting added onto the first
-        # day) no longer add date, since we have partial days
-        if df[COLUMNS.days].min() != 0:
-            raise ValueError(f'First day is not 0, as expected... (location_id: {location_id})')
-        bc_df[COLUMNS.days] = -bc_df.index - (start_rep - bc_rates[-1]) / bc_step
-
-        # don't project more than 10 days back, or we will have PROBLEMS
-        bc_df = (bc_df
-                 .loc[bc_df[COLUMNS.days] >= -10, out_columns]
-                 .reset_index(drop=True))
-    elif start_rep == rate_threshold:
-        bc_df = pd.DataFrame(columns=out_columns)
-    else:
+    first_point = (data
+                   .loc[data.groupby(COLUMNS.location_id)[COLUMNS.days].idxmin(), out_columns]
+                   .set_index(COLUMNS.location_id)
+                   .reindex(daily_change.index))
+    start_rep = first_point[COLUMNS.ln_age_death_rate].values
+    if (start_rep < rate_threshold).any():
         raise ValueError('First value is below threshold, should not be possible.')
-
+    to_backcast = start_rep > rate_threshold
+    # remove fractional step from last (we force the threshold day to
+    # be 0, so the partial day ends up getting added onto the first
+    # day) no longer add date, since we have partial days
+    bad_first_day = to_backcast & (first_point[COLUMNS.days].values != 0)
+    if bad_first_day.any():
+        raise ValueError(f'First day is not 0, as expected... '
+                         f'(location_id: {daily_change.index[bad_first_day][0]})')
+
+    location_ids = daily_change.index.values[to_backcast]
+    start_rep = start_rep[to_backcast]
+    bc_step = daily_change.values[to_backcast]
+    # count from threshold on, laying out np.arange(rate_threshold, start_rep, bc_step)
+    # for every location end to end
+    n_steps = np.ceil((start_rep - rate_threshold) / bc_step).astype(int)
+    arange_step = (rate_threshold + bc_step) - rate_threshold
+    last_rate = rate_threshold + (n_steps - 1) * arange_step
+    location = np.repeat(np.arange(len(n_steps)), n_steps)
+    steps_back = np.arange(n_steps.sum()) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)
+    bc_df = pd.DataFrame({
+        COLUMNS.location_id: location_ids[location],
+        COLUMNS.days: -steps_back - ((start_rep - last_rate) / bc_step)[location],
+        COLUMNS.ln_age_death_rate: rate_threshold + (n_steps[location] - 1 - steps_back) * arange_step[location],
+    })
+
+    # don't project more than 10 days back, or we will have PROBLEMS
+    bc_df = (bc_df
+             .loc[bc_df[COLUMNS.days] >= -max_backcast_days, out_columns]
+             .reset_index(drop=True))
     return bc_df
@@ -47,6 +47,10 @@ def expanding_moving_average(data: pd.DataFrame, measure: str, window: int) -> p
 def expanding_moving_average_by_location(data: pd.DataFrame, measure: str, window: int = 3) -> pd.Series:
     """Expands a dataset over date and performs a moving average by location.
 
+    All locations are processed together by padding their daily series
+    into one flat array with segment offsets, and give the same result as
+    applying :func:`expanding_moving_average` to each location.
+
     Parameters
     ----------
     data
@@ -63,9 +67,58 @@ def expanding_moving_average_by_location(data: pd.DataFrame, measure: str, windo
 
     """
     required_columns = [COLUMNS.location_id, COLUMNS.date, measure]
-    moving_average = (
-        data.loc[:, required_columns]
-            .groupby(COLUMNS.location_id)
-            .apply(lambda x: expanding_moving_average(x, measure, window))
-    )
-    return moving_average
+    data = data.loc[:, required_columns].sort_values([COLUMNS.location_id, COLUMNS.date], kind='mergesort')
+    location_ids = data[COLUMNS.location_id].values
+    days = data[COLUMNS.date].values.astype('datetime64[D]').astype(np.int64)
+    values = data[measure].values.astype(float)
+
+    # segment the data by location
+    starts = np.flatnonzero(np.r_[True, location_ids[1:] != location_ids[:-1]])
+    n_obs = np.diff(np.r_[starts, len(data)])
+    row_segment = np.repeat(np.arange(len(starts)), n_obs)
+    first_day = days[starts]
+    expand = n_obs >= window
+    lengths = np.where(expand, days[np.r_[starts[1:], len(data)] - 1] - first_day + 1, n_obs)
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+
+    # lay every location's (expanded) daily series out in one flat array,
+    # padding the missing days with the last observed value
+    row_rank = np.arange(len(data)) - starts[row_segment]
+    row_position = offsets[row_segment] + np.where(expand[row_segment], days - first_day[row_segment], row_rank)
+    source_row = np.full(lengths.sum(), -1)
+    source_row[row_position] = np.arange(len(data))
+    source_row = np.maximum.accumulate(source_row)
+    segment = row_segment[source_row]
+    position = np.arange(len(source_row))
+    padded = values[source_row]
+    dates = days[source_row] + position - row_position[source_row]
+
+    # centered window, truncated at the segment bounds
+    total = np.zeros(len(padded))
+    count = np.zeros(len(padded))
+    for shift in range(-(window // 2), window - window // 2):
+        neighbor = position + shift
+        in_segment = (0 <= neighbor) & (neighbor < len(padded))
+        in_segment[in_segment] = segment[neighbor[in_segment]] == segment[in_segment]
+        neighbor_values = np.where(in_segment, padded[np.clip(neighbor, 0, len(padded) - 1)], np.nan)
+        total += np.nan_to_num(neighbor_values)
+        count += ~np.isnan(neighbor_values)
+    with np.errstate(invalid='ignore'):
+        moving_average = np.where(expand[segment], total / count, padded)
+
+    # replace last point w/ daily value over 3->2 and 2->1 and the first
+    # with 1->2, 2->3; use observed if 3 data points or less
+    corrected = expand & (lengths > window)
+    first, last = offsets[corrected], offsets[corrected] + lengths[corrected] - 1
+    last_step = np.zeros(len(last))
+    for i in range(window - 1):
+        last_step += moving_average[last - window + 1 + i] - moving_average[last - window + i]
+    moving_average[last] = moving_average[last - 1] + last_step / (window - 1)
+    first_step = np.zeros(len(first))
+    for i in range(window - 1):
+        first_step += moving_average[first + 2 + i] - moving_average[first + 1 + i]
+    moving_average[first] = moving_average[first + 1] - first_step / (window - 1)
+
+    index = pd.MultiIndex.from_arrays([location_ids[source_row], pd.to_datetime(dates, unit='D')],
+                                      names=[COLUMNS.location_id, COLUMNS.date])
+    return pd.Series(moving_average, index=index, name=measure)
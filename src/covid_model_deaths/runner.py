@@ -1,10 +1,9 @@
 from datetime import datetime, timedelta
 import functools
-import multiprocessing
 import os
 from pathlib import Path
 import shutil
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
@@ -13,20 +12,37 @@ import pandas as pd
 import tqdm
 
 from covid_model_deaths.compare_model_average import CompareAveragingModelDeaths
-from covid_model_deaths.data import compute_backcast_log_age_specific_death_rates
+from covid_model_deaths.data import (compute_backcast_log_age_specific_death_rates,
+                                     compute_backcast_log_age_specific_death_rates_by_location,
+                                     IncrementalBackcast)
 from covid_model_deaths.drawer import Drawer
-from covid_model_deaths.impute_death_threshold import impute_death_threshold as impute_death_threshold_
+from covid_model_deaths.executor import LocalExecutor, ModelJob
+from covid_model_deaths.impute_death_threshold import (impute_death_threshold as impute_death_threshold_,
+                                                      ThresholdImputationCache)
 import covid_model_deaths.globals as cmd_globals
 from covid_model_deaths.globals import COLUMNS, LOCATIONS
+from covid_model_deaths.job_queue import JobQueue
 from covid_model_deaths.model_average import moving_average_predictions
+from covid_model_deaths.plotting.model_fits import plot_all_model_fits
+from covid_model_deaths.scheduler import Scheduler
+from covid_model_deaths.shared_inputs import shared_input_pool, worker_input
 from covid_model_deaths.social_distancing_cov import SocialDistCov
-from covid_model_deaths.utilities import submit_curvefit, CompareModelDeaths
+from covid_model_deaths.utilities import curvefit_job, submit_curvefit, CompareModelDeaths
 
 
 def make_cases_and_backcast_deaths(full_df: pd.DataFrame, death_df: pd.DataFrame,
                                    age_pop_df: pd.DataFrame, age_death_df: pd.DataFrame,
-                                   location_ids: List[int], subnat: bool = True) -> pd.DataFrame:
-    backcast_deaths_df = backcast_deaths_parallel(location_ids, death_df, age_pop_df, age_death_df, subnat)
+                                   location_ids: List[int], subnat: bool = True,
+                                   backcast_cache: Optional[IncrementalBackcast] = None) -> pd.DataFrame:
+    if backcast_cache is None:
+        backcast_deaths_df = backcast_deaths_parallel(location_ids, death_df, age_pop_df, age_death_df, subnat)
+    else:
+        mod_dfs = backcast_cache.compute(death_df, age_pop_df, age_death_df,
+                                         standardize_location_ids=location_ids,
+                                         subnat=subnat,
+                                         rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD)
+        backcast_deaths_df = pd.concat([select_backcast_deaths(location_id, mod_dfs[location_id])
+                                        for location_id in location_ids])
 
     full_df_columns = [COLUMNS.location_id, COLUMNS.state, COLUMNS.country, COLUMNS.date,
                        COLUMNS.confirmed, COLUMNS.confirmed_case_rate]
@@ -40,27 +56,50 @@ def make_cases_and_backcast_deaths(full_df: pd.DataFrame, death_df: pd.DataFrame
 
 
 def backcast_deaths_parallel(location_ids: List[int], death_df: pd.DataFrame,
-                             age_pop_df: pd.DataFrame, age_death: pd.DataFrame, subnat: bool) -> pd.DataFrame:
-    _combiner = functools.partial(backcast_deaths,
-                                  death_df=death_df,
-                                  age_pop_df=age_pop_df,
-                                  age_death_df=age_death,
-                                  subnat=subnat)
-    with multiprocessing.Pool(20) as p:
-        backcast_deaths_dfs = list(tqdm.tqdm(p.imap(_combiner, location_ids), total=len(location_ids)))
+                             age_pop_df: pd.DataFrame, age_death: pd.DataFrame, subnat: bool,
+                             chunk_size: int = 10, processes: int = 20) -> pd.DataFrame:
+    _combiner = functools.partial(_backcast_deaths_chunk_worker, subnat=subnat)
+    location_chunks = [location_ids[i:i + chunk_size] for i in range(0, len(location_ids), chunk_size)]
+    with shared_input_pool(processes, death_df=death_df, age_pop_df=age_pop_df, age_death_df=age_death) as p:
+        backcast_deaths_dfs = list(tqdm.tqdm(p.imap(_combiner, location_chunks), total=len(location_chunks)))
     return pd.concat(backcast_deaths_dfs)
 
 
+def _backcast_deaths_chunk_worker(location_ids: List[int], subnat: bool) -> pd.DataFrame:
+    return backcast_deaths_chunk(location_ids,
+                                 death_df=worker_input('death_df'),
+                                 age_pop_df=worker_input('age_pop_df'),
+                                 age_death_df=worker_input('age_death_df'),
+                                 subnat=subnat)
+
+
+def backcast_deaths_chunk(location_ids: List[int], death_df: pd.DataFrame,
+                          age_pop_df: pd.DataFrame, age_death_df: pd.DataFrame, subnat: bool) -> pd.DataFrame:
+    mod_dfs = compute_backcast_log_age_specific_death_rates_by_location(
+        death_df,
+        age_pop_df,
+        age_death_df,
+        standardize_location_ids=location_ids,
+        subnat=subnat,
+        rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD
+    )
+    return pd.concat([select_backcast_deaths(location_id, mod_dfs[location_id]) for location_id in location_ids])
+
+
 def backcast_deaths(location_id: int, death_df: pd.DataFrame,
                     age_pop_df: pd.DataFrame, age_death_df: pd.DataFrame, subnat: bool) -> pd.DataFrame:
-    output_columns = [COLUMNS.location_id, COLUMNS.state, COLUMNS.country, COLUMNS.date,
-                      COLUMNS.deaths, COLUMNS.death_rate, COLUMNS.population]
     mod_df = compute_backcast_log_age_specific_death_rates(death_df,
                                                            age_pop_df,
                                                            age_death_df,
                                                            standardize_location_id=location_id,
                                                            subnat=subnat,
                                                            rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD)
+    return select_backcast_deaths(location_id, mod_df)
+
+
+def select_backcast_deaths(location_id: int, mod_df: pd.DataFrame) -> pd.DataFrame:
+    output_columns = [COLUMNS.location_id, COLUMNS.state, COLUMNS.country, COLUMNS.date,
+                      COLUMNS.deaths, COLUMNS.death_rate, COLUMNS.population]
     mod_df = mod_df.loc[mod_df[COLUMNS.location_id] == location_id].reset_index(drop=True)
     if len(mod_df) > 0:
         date0 = mod_df[COLUMNS.date].min()
@@ -77,10 +116,12 @@ def backcast_deaths(location_id: int, death_df: pd.DataFrame,
     return mod_df[output_columns].reset_index(drop=True)
 
 
-def impute_death_threshold(cases_and_backcast_deaths_df: pd.DataFrame, loc_df: pd.DataFrame) -> pd.DataFrame:
+def impute_death_threshold(cases_and_backcast_deaths_df: pd.DataFrame, loc_df: pd.DataFrame,
+                           threshold_cache: Optional[ThresholdImputationCache] = None) -> pd.DataFrame:
     threshold_dates = impute_death_threshold_(cases_and_backcast_deaths_df,
                                               location_list=loc_df[COLUMNS.location_id].unique().tolist(),
-                                              ln_death_rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD)
+                                              ln_death_rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD,
+                                              cache=threshold_cache)
     loc_df = (loc_df
               .loc[:, [COLUMNS.location, COLUMNS.location_id]]
               .rename(columns={COLUMNS.location: COLUMNS.location_bad}))
@@ -124,22 +165,42 @@ def make_last_day_df(full_df: pd.DataFrame, date_mean_df: pd.DataFrame) -> pd.Da
 def submit_models(full_df: pd.DataFrame, death_df: pd.DataFrame, age_pop_df: pd.DataFrame,
                   age_death_df: pd.DataFrame, date_mean_df: pd.DataFrame, case_deaths_df: pd.DataFrame,
                   loc_df: pd.DataFrame, r0_locs: List[int], peak_file: str, output_directory: str,
-                  data_version: str, r0_file: str, code_dir: str, verbose: bool = False) -> Dict:
+                  data_version: str, r0_file: str, code_dir: str, verbose: bool = False,
+                  backcast_cache: Optional[IncrementalBackcast] = None,
+                  executor: Optional[LocalExecutor] = None,
+                  scheduler: Optional[Scheduler] = None,
+                  job_queue: Optional[JobQueue] = None, multi_scenario: bool = False,
+                  warm_start_directory: Optional[str] = None,
+                  threshold_dates: Optional[pd.DataFrame] = None,
+                  final_date: str = cmd_globals.FINAL_DATE, draw_dtype: Optional[str] = None,
+                  backcast_chunk_size: int = 10) -> Dict:
+    if multi_scenario and (executor is not None or job_queue is not None):
+        raise ValueError('Multi-scenario jobs can only be submitted to a scheduler.')
     submodel_dict = {}
+    scheduler_jobs = []
     N = len(loc_df)
     i = 0
     nursing_home_locations = [LOCATIONS.life_care.name]
+    compute_backcast = (compute_backcast_log_age_specific_death_rates_by_location
+                        if backcast_cache is None else backcast_cache.compute)
+    mod_dfs = {}
     for _, (location_id, location_name) in tqdm.tqdm(loc_df[[COLUMNS.location_id, COLUMNS.location]].iterrows(), total=len(loc_df)):
         location_id = int(location_id)
+        if location_id not in mod_dfs:
+            # standardize to the next chunk of locations, batched by national/subnational data,
+            # so only a chunk's copies of the death data are in memory at once
+            chunk_loc_df = loc_df.iloc[i:i + backcast_chunk_size]
+            for subnat, subnat_loc_df in chunk_loc_df.groupby(chunk_loc_df[COLUMNS.level] != 0):
+                mod_dfs.update(compute_backcast(
+                    death_df,
+                    age_pop_df,
+                    age_death_df,
+                    standardize_location_ids=subnat_loc_df[COLUMNS.location_id].astype(int).tolist(),
+                    subnat=subnat,
+                    rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD
+                ))
         i += 1
-        level = loc_df.set_index(COLUMNS.location_id).at[location_id, COLUMNS.level]
-        subnat = not level == 0
-        mod_df = compute_backcast_log_age_specific_death_rates(death_df,
-                                                               age_pop_df,
-                                                               age_death_df,
-                                                               standardize_location_id=location_id,
-                                                               subnat=subnat,
-                                                               rate_threshold=cmd_globals.LN_MORTALITY_RATE_THRESHOLD)
+        mod_df = mod_dfs.pop(location_id)
         if location_name in nursing_home_locations:
             # save only nursing homes
             mod_df = mod_df.copy()
@@ -177,6 +238,14 @@ def submit_models(full_df: pd.DataFrame, death_df: pd.DataFrame, age_pop_df: pd.
                 mod_df = mod_df.append(loc_cd_df)
                 mod_df = mod_df.sort_values([COLUMNS.location_id, COLUMNS.days]).reset_index(drop=True)
 
+        # predict as far as the reported dates need, if we know when the location's clock starts
+        pred_days = None
+        if threshold_dates is not None:
+            date_draws = threshold_dates.loc[threshold_dates[COLUMNS.location_id] == location_id,
+                                             [c for c in threshold_dates.columns if c.startswith('death_date_draw_')]]
+            if not date_draws.empty:
+                pred_days = prediction_horizon(date_draws.values, final_date)
+
         # figure out which models we are running (will need to check about R0=1 model)
         submodels = cmd_globals.MOBILITY_SOURCES.copy()
         if location_id in r0_locs:
@@ -193,6 +262,7 @@ def submit_models(full_df: pd.DataFrame, death_df: pd.DataFrame, age_pop_df: pd.
             }
         })
 
+        location_jobs = []
         n_i = 0
         for cov_source in submodels:
             if cov_source in cmd_globals.MOBILITY_SOURCES:
@@ -202,7 +272,9 @@ def submit_models(full_df: pd.DataFrame, death_df: pd.DataFrame, age_pop_df: pd.
             for k in cmd_globals.KS:
                 # drop back-cast for modeling file, but NOT for the social distancing covariate step
                 model_out_dir = f'{output_directory}/model_data_{cov_source}_{k}'
-                mod_df.to_csv(f'{model_out_dir}/{location_id}.csv', index=False)
+                if not (multi_scenario and location_jobs):
+                    # a multi-scenario job reads the model data of its first scenario only
+                    mod_df.to_csv(f'{model_out_dir}/{location_id}.csv', index=False)
                 sd_cov = SocialDistCov(mod_df, date_mean_df, data_version=data_version)
                 if cov_source in cmd_globals.MOBILITY_SOURCES:
                     sd_cov_df = sd_cov.get_cov_df(weights=[None], k=k, empirical_weight_source=cov_source)
@@ -212,27 +284,97 @@ def submit_models(full_df: pd.DataFrame, death_df: pd.DataFrame, age_pop_df: pd.
                 sd_cov_df.to_csv(f'{model_out_dir}/{location_id}_covariate.csv', index=False)
                 if not os.path.exists(f'{model_out_dir}/{location_id}'):
                     os.mkdir(f'{model_out_dir}/{location_id}')
-
-                submit_curvefit(job_name=f'curve_model_{location_id}_{cov_source}_{k}',
-                                location_id=location_id,
-                                model_file=f'{code_dir}/model.py',
-                                model_location_id=location_id,
-                                data_file=f'{model_out_dir}/{location_id}.csv',
-                                cov_file=f'{model_out_dir}/{location_id}_covariate.csv',
-                                last_day_file=f'{output_directory}/last_day.csv',
-                                peaked_file=peak_file,
-                                output_dir=f'{model_out_dir}/{location_id}',
-                                covariate_effect=covariate_effect,
-                                n_draws=n_draws_list[n_i],
-                                python=shutil.which('python'),
-                                verbose=verbose)
+                # start fits from the same model's fits in a previous run, if given
+                warm_start_dir = (None if warm_start_directory is None
+                                  else f'{warm_start_directory}/model_data_{cov_source}_{k}/{location_id}')
+
+                if executor is not None:
+                    executor.submit(ModelJob(job_name=f'curve_model_{location_id}_{cov_source}_{k}',
+                                             model_location_id=location_id,
+                                             data=mod_df,
+                                             cov=sd_cov_df,
+                                             last_day_file=f'{output_directory}/last_day.csv',
+                                             peaked_file=peak_file,
+                                             output_dir=f'{model_out_dir}/{location_id}',
+                                             covariate_effect=covariate_effect,
+                                             n_draws=n_draws_list[n_i],
+                                             warm_start_dir=warm_start_dir,
+                                             pred_days=pred_days,
+                                             draw_dtype=draw_dtype))
+                    n_i += 1
+                    continue
+                curvefit_args = dict(job_name=f'curve_model_{location_id}_{cov_source}_{k}',
+                                     location_id=location_id,
+                                     model_file=f'{code_dir}/model.py',
+                                     model_location_id=location_id,
+                                     data_file=f'{model_out_dir}/{location_id}.csv',
+                                     cov_file=f'{model_out_dir}/{location_id}_covariate.csv',
+                                     last_day_file=f'{output_directory}/last_day.csv',
+                                     peaked_file=peak_file,
+                                     output_dir=f'{model_out_dir}/{location_id}',
+                                     covariate_effect=covariate_effect,
+                                     n_draws=n_draws_list[n_i],
+                                     python=shutil.which('python'),
+                                     warm_start_dir=warm_start_dir,
+                                     pred_days=pred_days,
+                                     draw_dtype=draw_dtype)
+                if job_queue is not None:
+                    # picked up by workers running model.py --queue_dir
+                    job_queue.put(curvefit_args['job_name'], {
+                        'model_location_id': location_id,
+                        'data_file': curvefit_args['data_file'],
+                        'cov_file': curvefit_args['cov_file'],
+                        'last_day_file': curvefit_args['last_day_file'],
+                        'peaked_file': peak_file,
+                        'output_dir': curvefit_args['output_dir'],
+                        'covariate_effect': covariate_effect,
+                        'n_draws': int(n_draws_list[n_i]),
+                        'warm_start_dir': warm_start_dir,
+                        'pred_days': pred_days,
+                        'draw_dtype': draw_dtype,
+                    })
+                elif multi_scenario:
+                    location_jobs.append(curvefit_args)
+                elif scheduler is not None:
+                    # submitted together once all the inputs are written
+                    scheduler_jobs.append(curvefit_job(**curvefit_args))
+                else:
+                    submit_curvefit(**curvefit_args, verbose=verbose)
                 n_i += 1
+        if location_jobs:
+            # one job fits every scenario, reading the (shared) model data once
+            curvefit_args = dict(location_jobs[0], job_name=f'curve_model_{location_id}')
+            for arg in ['cov_file', 'output_dir', 'covariate_effect', 'n_draws']:
+                curvefit_args[arg] = [job[arg] for job in location_jobs]
+            if warm_start_directory is not None:
+                curvefit_args['warm_start_dir'] = [job['warm_start_dir'] for job in location_jobs]
+            if scheduler is not None:
+                scheduler_jobs.append(curvefit_job(**curvefit_args))
+            else:
+                submit_curvefit(**curvefit_args, verbose=verbose)
+    if executor is not None:
+        executor.run()
+    if scheduler is not None:
+        scheduler.submit(scheduler_jobs)
     return submodel_dict
 
 
+def prediction_horizon(date_draws: np.ndarray, final_date: str = cmd_globals.FINAL_DATE,
+                       min_days: int = cmd_globals.MIN_PRED_DAYS) -> int:
+    """Days of predictions needed to reach final_date from the earliest threshold date draw.
+
+    Draws are dated from their threshold dates, and the Drawer drops any past
+    final_date, so later days needn't be predicted.
+    """
+    threshold_dates = pd.to_datetime(pd.Series(np.ravel(date_draws)))
+    days_to_final = (pd.Timestamp(final_date) - threshold_dates.min()).days
+    return max(days_to_final + 1, min_days)
+
+
 def compile_draws(loc_df: pd.DataFrame, submodel_dict: Dict,
-                  obs_df: pd.DataFrame, threshold_dates: pd.DataFrame, age_pop_df: pd.DataFrame
-                  ) -> Tuple[List[pd.DataFrame], List[pd.DataFrame], List, List, List[pd.DataFrame]]:
+                  obs_df: pd.DataFrame, threshold_dates: pd.DataFrame, age_pop_df: pd.DataFrame,
+                  dtype=np.float64) -> Tuple[List[pd.DataFrame], List[pd.DataFrame], List, List, List[pd.DataFrame]]:
+    """Dated draws by location, with draw columns of the given dtype (np.float32 halves their memory)."""
     draw_dfs = []
     past_draw_dfs = []
     models_used = []
@@ -259,7 +401,8 @@ def compile_draws(loc_df: pd.DataFrame, submodel_dict: Dict,
             obs_df=obs_df.loc[obs_df[COLUMNS.location_id] == location_id],
             date_draws=threshold_dates.loc[threshold_dates[COLUMNS.location_bad] == location_name,
                                            [i for i in threshold_dates.columns if i.startswith('death_date_draw_')]].values,
-            population=age_pop_df.loc[age_pop_df[COLUMNS.location_id] == int(location_id), COLUMNS.population].sum()
+            population=age_pop_df.loc[age_pop_df[COLUMNS.location_id] == int(location_id), COLUMNS.population].sum(),
+            dtype=dtype
         )
         try:
             draw_df, past_draw_df, model_used, days, ensemble_draws = data_draws.get_dated_draws()
@@ -275,12 +418,27 @@ def compile_draws(loc_df: pd.DataFrame, submodel_dict: Dict,
     return draw_dfs, past_draw_dfs, models_used, days_, ensemble_draws_dfs
 
 
+def make_model_fit_plots(submodel_dict: Dict, location_ids: Optional[List[int]] = None,
+                         processes: int = 20) -> List[str]:
+    """Renders the model fit plots of jobs submitted with plots deferred (model.py --no_plots).
+
+    Each job's plots show only the given locations, or every location it fit if None.
+    """
+    output_dirs = [f'{submodel_dir}/{location_id}'
+                   for location_id, submodel_info in submodel_dict.items()
+                   for submodel_dir in submodel_info['submodel_dirs']]
+    locations = None if location_ids is None else [f'_{location_id}' for location_id in location_ids]
+    plot_paths = plot_all_model_fits(output_dirs, locations=locations, processes=processes)
+    return [plot_path for plot_path in plot_paths if plot_path is not None]
+
+
 def average_draws(raw_draw_path: str,
-                  yesterday_path: str, before_yesterday_path: str) -> pd.DataFrame:
+                  yesterday_path: str, before_yesterday_path: str, dtype=None) -> pd.DataFrame:
     avg_df = moving_average_predictions(
         today_data_path=raw_draw_path,
         yesterday_data_path=yesterday_path,
-        day_before_yesterday_path=before_yesterday_path
+        day_before_yesterday_path=before_yesterday_path,
+        dtype=dtype
     )
     avg_df['date'] = pd.to_datetime(avg_df['date'])
     return avg_df
@@ -0,0 +1,227 @@
+"""Submission of model jobs to a cluster scheduler.
+
+Running this module as a script stands in for ``qsub`` on a machine without
+a cluster: it accepts the same options, runs the job itself and reports a
+job id, e.g. ``QsubScheduler(qsub=LOCAL_QSUB)``.
+"""
+import abc
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import time
+from typing import List, NamedTuple, Sequence, Union
+import uuid
+
+from loguru import logger
+
+QSUB_OPTIONS = ('-P proj_covid -q d.q -b y -l m_mem_free=15G -l fthread=3 '
+                '-o /share/temp/sgeoutput/covid/output/ '
+                '-e /share/temp/sgeoutput/covid/errors/')
+LOCAL_QSUB = f'{sys.executable} -m covid_model_deaths.scheduler'
+
+
+class SchedulerJob(NamedTuple):
+    """A named shell command to run on the cluster."""
+    job_name: str
+    command: str
+
+
+class SubmissionError(RuntimeError):
+    """Raised when a job can't be submitted after all retries."""
+
+
+class Scheduler(abc.ABC):
+    """Submits batches of jobs, logging submission throughput."""
+
+    def submit(self, jobs: Sequence[SchedulerJob]) -> List[str]:
+        """Submits jobs and returns the scheduler's response to each submission."""
+        start = time.time()
+        responses = self._submit(list(jobs))
+        elapsed = time.time() - start
+        log = logger.info if len(jobs) > 1 else logger.debug
+        log(f'{type(self).__name__} submitted {len(jobs)} jobs in {elapsed:.1f}s '
+            f'({len(jobs) / max(elapsed, 1e-6):.1f} jobs/s).')
+        return responses
+
+    @abc.abstractmethod
+    def _submit(self, jobs: List[SchedulerJob]) -> List[str]:
+        """Submits jobs and returns the scheduler's response to each submission."""
+
+
+class _CommandScheduler(Scheduler):
+    """Runs submission commands as subprocesses, with bounded concurrency and exponential backoff.
+
+    Subprocesses are run from a thread pool rather than with asyncio's own
+    subprocess support, which on Python 3.6 only works from the main thread's loop.
+    """
+
+    def __init__(self, concurrency: int, max_attempts: int, initial_backoff: float, max_backoff: float):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    def _run_commands(self, commands: List[str]) -> List[str]:
+        return _run_coroutine(self._run_all(commands))
+
+    async def _run_all(self, commands: List[str]) -> List[str]:
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            return await asyncio.gather(*[self._run_with_backoff(pool, command) for command in commands])
+
+    async def _run_with_backoff(self, pool: concurrent.futures.Executor, command: str) -> str:
+        backoff = self.initial_backoff
+        run = functools.partial(subprocess.run, command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for attempt in itertools.count(1):
+            process = await asyncio.get_event_loop().run_in_executor(pool, run)
+            stdout, stderr = process.stdout, process.stderr
+            # qsub sometimes fails without an exit code, but never reports a job without output
+            if process.returncode == 0 and stdout.strip():
+                return stdout.decode().strip()
+            message = f'Job submission failed: {stderr.decode().strip() or "no output"}.'
+            if attempt == self.max_attempts:
+                raise SubmissionError(f'{message} Gave up after {attempt} attempts: {command}')
+            logger.warning(f'{message} Retrying in {backoff:.0f} seconds...')
+            await asyncio.sleep(backoff)
+            backoff = min(2 * backoff, self.max_backoff)
+
+
+class QsubScheduler(_CommandScheduler):
+    """Submits each job with its own qsub call, several at a time.
+
+    Parameters
+    ----------
+    qsub
+        Submission command, e.g. :data:`LOCAL_QSUB` to run without a cluster.
+    options
+        Options passed to every submission.
+    concurrency
+        Maximum number of submissions in flight.
+    max_attempts
+        Attempts per job before raising :class:`SubmissionError`.
+    initial_backoff
+        Seconds to wait after the first failure, doubling with each retry.
+    max_backoff
+        Longest wait between retries, in seconds.
+
+    """
+
+    def __init__(self, qsub: str = 'qsub', options: str = QSUB_OPTIONS, concurrency: int = 16,
+                 max_attempts: int = 10, initial_backoff: float = 1., max_backoff: float = 300.):
+        super().__init__(concurrency, max_attempts, initial_backoff, max_backoff)
+        self.qsub = qsub
+        self.options = options
+
+    def _submit(self, jobs: List[SchedulerJob]) -> List[str]:
+        return self._run_commands([f'{self.qsub} -N {job.job_name} {self.options} {job.command}' for job in jobs])
+
+
+class ArrayJobScheduler(_CommandScheduler):
+    """Submits a batch of jobs as a single array job.
+
+    The jobs' commands are written to a manifest, one per line, and every
+    task of the array job runs the line matching its ``SGE_TASK_ID``.  Each
+    submission gets its own manifest, as tasks still queued from an earlier
+    submission read theirs when they start.
+
+    Parameters
+    ----------
+    manifest_dir
+        Where to write the manifest and the task script.
+    job_name
+        Name of the array job.
+    max_running
+        Maximum number of tasks running at once, if any.
+    qsub, options, max_attempts, initial_backoff, max_backoff
+        As for :class:`QsubScheduler`.
+
+    """
+
+    def __init__(self, manifest_dir: Union[str, Path], job_name: str = 'curve_model', max_running: int = None,
+                 qsub: str = 'qsub', options: str = QSUB_OPTIONS,
+                 max_attempts: int = 10, initial_backoff: float = 1., max_backoff: float = 300.):
+        super().__init__(1, max_attempts, initial_backoff, max_backoff)
+        self.manifest_dir = Path(manifest_dir)
+        self.job_name = job_name
+        self.max_running = max_running
+        self.qsub = qsub
+        self.options = options
+
+    def _submit(self, jobs: List[SchedulerJob]) -> List[str]:
+        if not jobs:
+            return []
+        submission = f'{self.job_name}_{uuid.uuid4().hex[:12]}'
+        manifest = self.manifest_dir / f'{submission}_manifest.txt'
+        with manifest.open('w') as manifest_file:
+            for job in jobs:
+                # keep the job name as a trailing comment so the manifest is readable
+                manifest_file.write(f'{job.command}  # {job.job_name}\n')
+        task_script = self.manifest_dir / f'{submission}_task.sh'
+        task_script.write_text(f'eval "$(sed -n "${{SGE_TASK_ID}}p" {shlex.quote(str(manifest))})"\n')
+
+        max_running = f'-tc {self.max_running} ' if self.max_running else ''
+        command = (f'{self.qsub} -N {self.job_name} -t 1-{len(jobs)} {max_running}{self.options} '
+                   f'/bin/bash {shlex.quote(str(task_script))}')
+        return self._run_commands([command]) * len(jobs)
+
+
+def _run_coroutine(coroutine):
+    # get_running_loop and asyncio.run are 3.7+
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        # no event loop for this thread
+        loop = None
+    if loop is not None and not loop.is_closed() and not loop.is_running():
+        return loop.run_until_complete(coroutine)
+    # already inside an event loop (e.g. a notebook), or without one, so run a loop of our own in a thread
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        return pool.submit(_run_in_new_loop, coroutine).result()
+
+
+def _run_in_new_loop(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+_QSUB_VALUE_OPTIONS = {'-N', '-P', '-q', '-b', '-l', '-o', '-e', '-t', '-tc'}
+
+
+def local_qsub(argv: List[str]) -> str:
+    """Runs a qsub command line on this machine, one task at a time, and returns a job id."""
+    options = {}
+    i = 0
+    while i < len(argv) and argv[i] in _QSUB_VALUE_OPTIONS:
+        options.setdefault(argv[i], []).append(argv[i + 1])
+        i += 2
+    command = argv[i:]
+    job_id = str(os.getpid())
+    job_name = options.get('-N', ['job'])[0]
+
+    if '-t' in options:
+        first, last = options['-t'][0].split(':')[0].split('-')
+        task_ids = range(int(first), int(last) + 1)
+    else:
+        task_ids = [None]
+    for task_id in task_ids:
+        env = dict(os.environ, JOB_ID=job_id, JOB_NAME=job_name)
+        if task_id is not None:
+            env['SGE_TASK_ID'] = str(task_id)
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+    if '-t' in options:
+        return f'Your job-array {job_id}.{options["-t"][0]} ("{job_name}") has been submitted'
+    return f'Your job {job_id} ("{job_name}") has been submitted'
+
+
+if __name__ == '__main__':
+    print(local_qsub(sys.argv[1:]))
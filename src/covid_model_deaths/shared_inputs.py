@@ -0,0 +1,110 @@
+"""Read-only inputs published once to the workers of a process pool."""
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing.pool import Pool
+from pathlib import Path
+import tempfile
+from typing import Any, Dict, Iterator
+
+import numpy as np
+import pandas as pd
+
+_WORKER_INPUTS = {}
+
+
+class _MappedFrame:
+    """Picklable handle to a DataFrame written out as one memory-mapped array per column.
+
+    String columns are mapped as codes into their unique values, which travel
+    with the handle, as do columns numpy can't map (other objects).  Workers
+    keep only the mapped arrays, which they share through the page cache, and
+    build a new DataFrame from them for each task with :meth:`frame`.
+    """
+
+    def __init__(self, df: pd.DataFrame, root: Path, name: str):
+        self.columns = df.columns
+        self.index = df.index
+        self.paths = {}
+        self.uniques = {}
+        self.values = {}
+        for i in range(df.shape[1]):
+            column = df.iloc[:, i]
+            if not isinstance(column.dtype, np.dtype):
+                self.values[i] = column.values
+                continue
+            values = column.values
+            if column.dtype == object:
+                values, uniques = pd.factorize(column.values)
+                if (values == -1).any():
+                    # missing values wouldn't come back as they were
+                    self.values[i] = column.values
+                    continue
+                self.uniques[i] = np.asarray(uniques, dtype=object)
+            path = root / f'{name}_{i}.npy'
+            np.save(path, values, allow_pickle=False)
+            self.paths[i] = str(path)
+        self.arrays = None
+
+    def __getstate__(self):
+        return {**self.__dict__, 'arrays': None}
+
+    def open(self) -> '_MappedFrame':
+        self.arrays = {i: np.load(path, mmap_mode='r') for i, path in self.paths.items()}
+        return self
+
+    def frame(self) -> pd.DataFrame:
+        """A new DataFrame of the mapped data."""
+        values = {i: self.uniques[i].take(array) if i in self.uniques else array
+                  for i, array in self.arrays.items()}
+        values.update(self.values)
+        df = pd.DataFrame({i: values[i] for i in range(len(self.columns))}, index=self.index)
+        df.columns = self.columns
+        return df
+
+
+@contextmanager
+def shared_input_pool(processes: int, **inputs: Any) -> Iterator[Pool]:
+    """Process pool whose workers read ``inputs`` with :func:`worker_input`.
+
+    Inputs are sent to each worker once, when it starts, rather than with
+    every task.  DataFrames are written once to memory-mapped column files,
+    so workers read them through the shared page cache instead of
+    unpickling them from a pipe, and don't each hold a copy; other inputs
+    are pickled to each worker.
+
+    Parameters
+    ----------
+    processes
+        Number of worker processes.
+    inputs
+        Read-only inputs, by name.
+
+    """
+    with tempfile.TemporaryDirectory() as root:
+        handles = {name: _MappedFrame(value, Path(root), name) if isinstance(value, pd.DataFrame) else value
+                   for name, value in inputs.items()}
+        with multiprocessing.Pool(processes, initializer=_load_inputs, initargs=(handles,)) as pool:
+            yield pool
+
+
+def _load_inputs(handles: Dict[str, Any]):
+    _WORKER_INPUTS.clear()
+    _WORKER_INPUTS.update({name: handle.open() if isinstance(handle, _MappedFrame) else handle
+                           for name, handle in handles.items()})
+
+
+def worker_input(name: str) -> Any:
+    """Returns an input published by :func:`shared_input_pool` to this worker.
+
+    DataFrames are built anew from the mapped columns on each call, so a
+    task's copy is freed when the task is done with it.
+    """
+    value = _WORKER_INPUTS[name]
+    if isinstance(value, _MappedFrame):
+        return value.frame()
+    return value
+
+
+def chunk_size(n_tasks: int, processes: int, chunks_per_process: int = 4) -> int:
+    """Tasks per dispatch so each worker gets a few chunks."""
+    return max(1, -(-n_tasks // (processes * chunks_per_process)))
@@ -1,61 +1,98 @@
-import os
 from pathlib import Path
-import time
-from typing import List, Optional, Tuple
+from typing import List, Optional, Sequence, Tuple, Union
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 import pandas as pd
 
+from covid_model_deaths.scheduler import QSUB_OPTIONS, QsubScheduler, Scheduler, SchedulerJob
+
 # TODO: Document better.  These are about the mix of social distancing
 #  covariates.
 MOBILITY_SOURCES = ['google', 'descartes', 'safegraph']
 # TODO: Don't know what this is at all.
 KS = [21]  # 14,
 # TODO: use drmaa and a job template.
-QSUB_STR = 'qsub -N {job_name} -P proj_covid -q d.q -b y -l m_mem_free=15G -l fthread=3 '\
-           '-o /share/temp/sgeoutput/covid/output/ '\
-           '-e /share/temp/sgeoutput/covid/errors/ '\
-           '{python} {model_file} '\
-           '--model_location_id {model_location_id} --data_file {data_file} '\
-           '--cov_file {cov_file} --peaked_file {peaked_file} --output_dir {output_dir} '\
-           '--last_day_file {last_day_file} --covariate_effect {covariate_effect} --n_draws={n_draws}'
+CURVEFIT_STR = '{python} {model_file} '\
+               '--model_location_id {model_location_id} --data_file {data_file} '\
+               '--cov_file {cov_file} --peaked_file {peaked_file} --output_dir {output_dir} '\
+               '--last_day_file {last_day_file} --covariate_effect {covariate_effect} --n_draws {n_draws}'
+QSUB_STR = 'qsub -N {job_name} ' + QSUB_OPTIONS + ' ' + CURVEFIT_STR
 # FIXME: Defined in multiple places.
 RATE_THRESHOLD = -15
 
 
-def submit_curvefit(job_name: str, location_id: int, model_file: str,
-                    model_location_id: int, data_file: str, cov_file: str, last_day_file: str,
-                    peaked_file: str, output_dir: str, covariate_effect: str, n_draws: int, python: str,
-                    verbose: bool = False):
-    qsub_str = QSUB_STR.format(
-        job_name=job_name,
+def curvefit_job(job_name: str, location_id: int, model_file: str,
+                 model_location_id: int, data_file: str, cov_file: Union[str, Sequence[str]], last_day_file: str,
+                 peaked_file: str, output_dir: Union[str, Sequence[str]],
+                 covariate_effect: Union[str, Sequence[str]], n_draws: Union[int, Sequence[int]],
+                 python: str, warm_start_dir: Union[str, Sequence[str], None] = None,
+                 pred_days: Optional[int] = None, draw_dtype: Optional[str] = None) -> SchedulerJob:
+    """Builds the model.py job for a location.
+
+    Pass a sequence of ``cov_file``, ``output_dir``, ``covariate_effect``,
+    ``n_draws`` and ``warm_start_dir`` values, one per scenario, to fit
+    several covariate scenarios in one job.
+    """
+    command = CURVEFIT_STR.format(
         location_id=location_id,
         model_file=model_file,
         python=python,
         model_location_id=model_location_id,
         last_day_file=sanitize(last_day_file),
-        covariate_effect=covariate_effect,
+        covariate_effect=_scenario_args(covariate_effect),
         data_file=sanitize(data_file),
-        cov_file=sanitize(cov_file),
+        cov_file=_scenario_args(cov_file, sanitize),
         peaked_file=sanitize(peaked_file),
-        output_dir=sanitize(output_dir),
-        n_draws=n_draws
+        output_dir=_scenario_args(output_dir, sanitize),
+        n_draws=_scenario_args(n_draws)
     )
+    if warm_start_dir is not None:
+        command += f' --warm_start_dir {_scenario_args(warm_start_dir, sanitize)}'
+    if pred_days is not None:
+        command += f' --pred_days {pred_days}'
+    if draw_dtype is not None:
+        command += f' --draw_dtype {draw_dtype}'
+    return SchedulerJob(job_name=job_name, command=command)
+
+
+def submit_curvefit(job_name: str, location_id: int, model_file: str,
+                    model_location_id: int, data_file: str, cov_file: str, last_day_file: str,
+                    peaked_file: str, output_dir: str, covariate_effect: str, n_draws: int, python: str,
+                    verbose: bool = False, scheduler: Optional[Scheduler] = None,
+                    warm_start_dir: Union[str, Sequence[str], None] = None, pred_days: Optional[int] = None,
+                    draw_dtype: Optional[str] = None):
+    job = curvefit_job(job_name=job_name,
+                       location_id=location_id,
+                       model_file=model_file,
+                       model_location_id=model_location_id,
+                       data_file=data_file,
+                       cov_file=cov_file,
+                       last_day_file=last_day_file,
+                       peaked_file=peaked_file,
+                       output_dir=output_dir,
+                       covariate_effect=covariate_effect,
+                       n_draws=n_draws,
+                       python=python,
+                       warm_start_dir=warm_start_dir,
+                       pred_days=pred_days,
+                       draw_dtype=draw_dtype)
+    if scheduler is None:
+        scheduler = QsubScheduler(concurrency=1)
     if verbose:
-        print(qsub_str)
-    job_str = ''
-    while not job_str:
-        job_str = os.popen(qsub_str).read()
-        if not job_str:
-            print("Job submission failed. Retrying in 30 seconds...")
-            print("Please try running qstat.")
-            time.sleep(30)
+        print(job.command)
+    job_str = scheduler.submit([job])[0]
     if verbose:
         print(job_str)
 
 
+def _scenario_args(values, format_value=str) -> str:
+    if isinstance(values, (str, int, np.integer)):
+        values = [values]
+    return ' '.join(format_value(value) for value in values)
+
+
 def sanitize(shell_string):
     shell_string = shell_string.replace(' ', '\ ').replace('(', '\(').replace(')', '\)')
     return f'"{shell_string}"'
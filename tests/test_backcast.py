@@ -1,3 +1,4 @@
+import pandas as pd
 import pandas.testing as pdt
 from covid_model_deaths import data
 
@@ -6,3 +7,35 @@ def test_compute_backast(death_df, age_pop_df, age_death_df, backcast):
     backcast_actual = data.compute_backcast_log_age_specific_death_rates(death_df, age_pop_df, age_death_df,
                                                                          555, subnat=True, rate_threshold=-15)
     pdt.assert_frame_equal(backcast, backcast_actual, check_like=True)
+
+
+def test_compute_backcast_by_location(death_df, age_pop_df, age_death_df, backcast):
+    backcast_actual = data.compute_backcast_log_age_specific_death_rates_by_location(death_df, age_pop_df,
+                                                                                     age_death_df, [523, 555],
+                                                                                     subnat=True, rate_threshold=-15)
+    assert list(backcast_actual) == [523, 555]
+    pdt.assert_frame_equal(backcast, backcast_actual[555], check_like=True)
+    single_actual = data.compute_backcast_log_age_specific_death_rates(death_df, age_pop_df, age_death_df,
+                                                                       523, subnat=True, rate_threshold=-15)
+    pdt.assert_frame_equal(single_actual, backcast_actual[523])
+
+
+def test_incremental_backcast(death_df, age_pop_df, age_death_df):
+    last_date = death_df['Date'].max()
+    cache = data.IncrementalBackcast()
+    # computed a location at a time, as the runner does in chunks
+    chunked_cache = data.IncrementalBackcast()
+    for days_behind in [2, 1, 0]:
+        update = death_df.loc[death_df['Date'] <= last_date - pd.Timedelta(days=days_behind)].copy()
+        if days_behind == 1:
+            # revise the history of one location
+            update.loc[(update['location_id'] == 523) & (update['Date'] == '2020-04-01'), 'Deaths'] += 1
+        expected = data.compute_backcast_log_age_specific_death_rates_by_location(update, age_pop_df, age_death_df,
+                                                                                  [555, 523], subnat=True,
+                                                                                  rate_threshold=-15)
+        actual = cache.compute(update, age_pop_df, age_death_df, [555, 523], subnat=True, rate_threshold=-15)
+        for location_id in [555, 523]:
+            pdt.assert_frame_equal(expected[location_id], actual[location_id])
+            chunked = chunked_cache.compute(update, age_pop_df, age_death_df, [location_id],
+                                            subnat=True, rate_threshold=-15)
+            pdt.assert_frame_equal(expected[location_id], chunked[location_id])
@@ -0,0 +1,40 @@
+import numpy as np
+
+from covid_model_deaths import draw_processing
+
+
+def test_batch_process_draws():
+    rs = np.random.RandomState(12345)
+    draws, other_draws, last_obs = {}, {}, {}
+    for group, n_days in [('_1', 130), ('_2', 120), ('_3', 130), ('_4', 150)]:
+        days = np.arange(150 - n_days, 150)
+        draws[group] = (days, rs.randn(100, n_days) - 12)
+        other_draws[group] = (days, rs.randn(100, n_days) - 11)
+        last_obs[group] = rs.randn() - 10
+    weights = np.linspace(0, 1, 150)
+
+    def combine(first, second):
+        return np.log(weights[:first.shape[1]] * np.exp(first) + (1 - weights[:first.shape[1]]) * np.exp(second))
+
+    assert draw_processing.group_batches(draws) == [['_1', '_3'], ['_2'], ['_4']]
+    processed = draw_processing.batch_process_draws(draws, last_obs, other_draws, combine)
+    assert list(processed) == list(draws)
+    for group, (days, group_draws) in draws.items():
+        other = other_draws[group][1]
+        combined = combine(group_draws[np.argsort(group_draws[:, -1]), :], other[np.argsort(other[:, -1]), :])
+        expected = np.log(np.exp(last_obs[group]) + np.exp(combined).cumsum(axis=1))
+        np.testing.assert_array_equal(processed[group][0], days)
+        np.testing.assert_allclose(processed[group][1], expected, rtol=1e-12)
+
+    # without a second set of draws, just sorted and cumulated
+    processed = draw_processing.batch_process_draws(draws, last_obs)
+    group_draws = draws['_2'][1]
+    expected = np.log(np.exp(last_obs['_2']) + np.exp(group_draws[np.argsort(group_draws[:, -1]), :]).cumsum(axis=1))
+    np.testing.assert_allclose(processed['_2'][1], expected, rtol=1e-12)
+
+
+def test_cumulative_draws_no_overflow():
+    daily_draws = np.full((2, 5), 800.)
+    cumulative = draw_processing.cumulative_draws(daily_draws, 800.)
+    assert np.isfinite(cumulative).all()
+    np.testing.assert_allclose(cumulative[0], 800. + np.log(np.arange(2, 7)))
@@ -0,0 +1,76 @@
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+import covid_model_deaths
+from covid_model_deaths.executor import LocalExecutor, ModelJob
+from covid_model_deaths.job_outputs import JobOutputs, write_job_outputs
+
+
+def _write_inputs(tmp_path):
+    pd.DataFrame({'location_id': [1], 'Location': ['A']}).to_csv(tmp_path / 'peaked.csv', index=False)
+    pd.DataFrame({'location_id': [1], 'ln(death rate)': [-10.0], 'Days': [5]}).to_csv(tmp_path / 'last_day.csv',
+                                                                                        index=False)
+
+
+def _run_location_model(model_location_id, df, cov_df, peaked_df, last_day_df, output_dir, covariate_effect,
+                        n_draws, warm_start_dir=None, pred_days=None, draw_dtype=None):
+    # writes the job layout without fitting anything
+    assert not peaked_df.empty and not last_day_df.empty
+    df.to_csv(f'{output_dir}/data.csv', index=False)
+    draws = {f'_{model_location_id}': (np.arange(pred_days), np.zeros((n_draws, pred_days)))}
+    write_job_outputs(output_dir, draws, dtype=draw_dtype)
+
+
+def test_local_executor_reports_failures(tmp_path):
+    _write_inputs(tmp_path)
+    executor = LocalExecutor(processes=2)
+    for i in range(3):
+        executor.submit(ModelJob(job_name=f'job_{i}',
+                                 model_location_id=1,
+                                 data=pd.DataFrame(),
+                                 cov=pd.DataFrame(),
+                                 last_day_file=str(tmp_path / 'last_day.csv'),
+                                 peaked_file=str(tmp_path / 'peaked.csv'),
+                                 output_dir=str(tmp_path),
+                                 covariate_effect='gamma',
+                                 n_draws=10))
+    statuses = executor.run()
+    assert [status.job_name for status in statuses] == ['job_0', 'job_1', 'job_2']
+    assert not any(status.succeeded for status in statuses)
+    assert all('Traceback' in status.error for status in statuses)
+    assert executor.jobs == []
+
+
+def test_local_executor_runs_jobs(tmp_path, monkeypatch):
+    # stands in for the model code, which forked workers inherit
+    model = types.ModuleType('covid_model_deaths.model')
+    model.run_location_model = _run_location_model
+    monkeypatch.setitem(sys.modules, 'covid_model_deaths.model', model)
+    monkeypatch.setattr(covid_model_deaths, 'model', model, raising=False)
+
+    _write_inputs(tmp_path)
+    executor = LocalExecutor(processes=2)
+    for i in range(3):
+        (tmp_path / f'job_{i}').mkdir()
+        executor.submit(ModelJob(job_name=f'job_{i}',
+                                 model_location_id=i,
+                                 data=pd.DataFrame({'location_id': [i]}),
+                                 cov=pd.DataFrame(),
+                                 last_day_file=str(tmp_path / 'last_day.csv'),
+                                 peaked_file=str(tmp_path / 'peaked.csv'),
+                                 output_dir=str(tmp_path / f'job_{i}'),
+                                 covariate_effect='gamma',
+                                 n_draws=10,
+                                 pred_days=20,
+                                 draw_dtype='float32'))
+    statuses = executor.run()
+    assert [status.job_name for status in statuses] == ['job_0', 'job_1', 'job_2']
+    assert all(status.succeeded and status.error is None for status in statuses)
+    assert executor.statuses == statuses
+    for i in range(3):
+        assert pd.read_csv(tmp_path / f'job_{i}' / 'data.csv')['location_id'].tolist() == [i]
+        days, draws = JobOutputs(tmp_path / f'job_{i}').draws(f'_{i}')
+        assert draws.shape == (10, 20) and draws.dtype == np.float32
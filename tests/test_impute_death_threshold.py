@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from covid_model_deaths import impute_death_threshold
+
+
+@pytest.fixture
+def threshold_df(death_df):
+    df = death_df.copy()
+    # case counts that run ahead of deaths, with some downward revisions
+    revision = np.where(df.index % 7 == 3, -15.0, 0.0)
+    df['case_count'] = (df['Deaths'] * 20 + revision).clip(lower=0)
+    df['case_rate'] = df['case_count'] / df['population']
+    df['death_count'] = df['Deaths']
+    df['death_rate'] = df['Death rate']
+    df['date'] = df['Date']
+    return df
+
+
+@pytest.mark.parametrize('case_count_threshold', [0, 1, 40, 41, 500, 1e12])
+def test_threshold_index_wait_times(threshold_df, case_count_threshold):
+    ln_death_rate_threshold = -15
+    expected = impute_death_threshold.days_from_X_cases_to_Y_deaths(
+        threshold_df,
+        case_count_threshold=case_count_threshold,
+        ln_death_rate_threshold=ln_death_rate_threshold
+    )
+    index = impute_death_threshold.DeathThresholdIndex(threshold_df, ln_death_rate_threshold)
+    actual = index.wait_times(case_count_threshold)
+    pdt.assert_series_equal(expected.sort_index(), actual.sort_index(), check_names=False)
+
+
+def test_threshold_date_draws(threshold_df):
+    ln_death_rate_threshold = -15
+    index = impute_death_threshold.DeathThresholdIndex(threshold_df, ln_death_rate_threshold)
+    crossed = index.death_date.notnull()
+    samplable = [(index.wait_times(index.case_count.at[location_id]) > 0).sum() > 1
+                 for location_id in index.location_ids]
+    location_ids = np.r_[index.location_ids[crossed][:5], index.location_ids[~crossed & samplable][:5]]
+    draws = impute_death_threshold.ThresholdDateDraws.concat([
+        impute_death_threshold.location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, index)
+        for location_id in location_ids
+    ])
+    assert draws.day_offsets.shape == (len(location_ids), 1000)
+    assert draws.day_offsets.dtype == np.int64
+
+    draw_df = draws.to_frame()
+    assert draw_df['location_id'].tolist() == list(location_ids)
+    assert draw_df.columns[-1] == 'death_date_draw_999'
+    for _, row in draw_df.iterrows():
+        dates = row[draws.draw_columns].values.astype('datetime64[ns]')
+        if row['threshold_reached']:
+            assert (dates == np.datetime64(index.death_date.at[row['location_id']])).all()
+        else:
+            assert (dates >= np.datetime64(row['case_date'])).all()
+
+    # each location's draws depend only on the seed and its location_id
+    reversed_draws = impute_death_threshold.ThresholdDateDraws.concat([
+        impute_death_threshold.location_specific_death_threshold_draws(location_id, ln_death_rate_threshold, index)
+        for location_id in location_ids[::-1]
+    ])
+    np.testing.assert_array_equal(draws.day_offsets, reversed_draws.day_offsets[::-1])
+    reseeded_draws = impute_death_threshold.location_specific_death_threshold_draws(
+        location_ids[-1], ln_death_rate_threshold, index, seed=54321
+    )
+    assert (draws.day_offsets[-1] != reseeded_draws.day_offsets[0]).any()
+
+
+def test_threshold_imputation_cache(death_df):
+    raw_df = death_df.copy()
+    raw_df['Date'] -= raw_df['Date'].min() - pd.Timestamp('2019-12-31')
+    raw_df['Confirmed'] = raw_df['Deaths'] * 20
+    raw_df['Confirmed case rate'] = raw_df['Confirmed'] / raw_df['population']
+    index = impute_death_threshold.DeathThresholdIndex(impute_death_threshold.clean_data(raw_df.copy()), -15)
+    crossed = index.death_date.notnull()
+    samplable = [(index.wait_times(index.case_count.at[location_id]) > 0).sum() > 1
+                 for location_id in index.location_ids]
+    location_list = np.r_[index.location_ids[crossed][:15], index.location_ids[~crossed & samplable][:3]].tolist()
+
+    cache = impute_death_threshold.ThresholdImputationCache()
+    expected = impute_death_threshold.impute_death_threshold_draws(raw_df.copy(), location_list, n_processes=2,
+                                                                   cache=cache)
+    crossed = expected.location_ids[expected.location_data['threshold_reached'].values]
+    assert crossed.size
+    # mark the cached results so reuse is visible
+    for location_id in crossed:
+        cache._draws[location_id][1].day_offsets[:] = 7
+    changed_id = crossed[0]
+    raw_df.loc[raw_df['location_id'] == changed_id, 'Death rate'] *= 1.1
+
+    actual = impute_death_threshold.impute_death_threshold_draws(raw_df.copy(), location_list, n_processes=2,
+                                                                 cache=cache)
+    assert list(actual.location_ids) == location_list
+    reused = actual.location_data['threshold_reached'].values & (actual.location_ids != changed_id)
+    assert (actual.day_offsets[reused] == 7).all()
+    assert (actual.day_offsets[actual.location_ids == changed_id] == 0).all()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from covid_model_deaths import job_outputs
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_job_outputs(tmp_path, compress):
+    rs = np.random.RandomState(42)
+    draws = {'_1': (np.arange(20, 150), rs.randn(333, 130)),
+             'overall': (np.arange(21, 150), rs.randn(333, 129))}
+    params = {'tight': {'_1': (rs.randn(3), rs.randn(3)), '_2': (rs.randn(3), rs.randn(3))}}
+    past_predictions = {'_1': rs.randn(20)}
+    assert not job_outputs.has_job_outputs(tmp_path)
+    job_outputs.write_job_outputs(tmp_path, draws, params, past_predictions, compress=compress)
+    assert job_outputs.has_job_outputs(tmp_path)
+
+    outputs = job_outputs.JobOutputs(tmp_path)
+    assert outputs.groups == ['_1', 'overall']
+    assert '_2' not in outputs
+    days, location_draws = outputs.draws('_1')
+    assert isinstance(location_draws, np.memmap)
+    np.testing.assert_array_equal(days, draws['_1'][0])
+    np.testing.assert_array_equal(location_draws, draws['_1'][1])
+    np.testing.assert_array_equal(outputs.past_prediction('_1'), past_predictions['_1'])
+    assert outputs.past_prediction('overall') is None
+
+    tight_params = outputs.params('tight')
+    assert sorted(tight_params) == ['_1', '_2']
+    for group, (fe, re) in params['tight'].items():
+        np.testing.assert_array_equal(tight_params[group][0], fe)
+        np.testing.assert_array_equal(tight_params[group][1], re)
+    assert outputs.params('loose') == {}
+
+
+def test_job_outputs_dtype(tmp_path):
+    rs = np.random.RandomState(42)
+    draws = {'_1': (np.arange(20, 150), rs.randn(333, 130) - 12)}
+    params = {'tight': {'_1': (rs.randn(3), rs.randn(3))}}
+    job_outputs.write_job_outputs(tmp_path, draws, params, {'_1': rs.randn(20) - 14}, dtype=np.float32)
+
+    outputs = job_outputs.JobOutputs(tmp_path)
+    _, location_draws = outputs.draws('_1')
+    assert location_draws.dtype == np.float32
+    np.testing.assert_allclose(location_draws, draws['_1'][1], rtol=1e-7)
+    assert outputs.past_prediction('_1').dtype == np.float32
+    # parameters stay at full precision for warm starts
+    np.testing.assert_array_equal(outputs.params('tight')['_1'][0], params['tight']['_1'][0])
+
+
+def test_overall_inputs(tmp_path):
+    rs = np.random.RandomState(42)
+    draws = {'_1': (np.arange(20, 150), rs.randn(333, 130))}
+    overall_inputs = {
+        'settings': {'model_location': '_1', 'fix_point': None, 'seeds': {'tight': 1, 'loose': 2}},
+        'data': {'location': np.array(['_2', '_2', '_3']), 'days': np.array([0., 1., 0.])},
+        'params': {'tight': {'_2': (rs.randn(3), rs.randn(3))}, 'loose': {'_2': (rs.randn(3), rs.randn(3))}},
+    }
+    job_outputs.write_job_outputs(tmp_path, draws, overall_inputs=overall_inputs)
+
+    outputs = job_outputs.JobOutputs(tmp_path)
+    assert 'overall' not in outputs
+    inputs = outputs.overall_inputs()
+    assert inputs['settings'] == overall_inputs['settings']
+    assert list(inputs['data']) == ['location', 'days']
+    for column, values in overall_inputs['data'].items():
+        np.testing.assert_array_equal(inputs['data'][column], values)
+    for label, model_params in overall_inputs['params'].items():
+        np.testing.assert_array_equal(inputs['params'][label]['_2'][0], model_params['_2'][0])
+
+    # overall draws made later are added without touching what earlier readers have open
+    overall_draws = (np.arange(21, 150), rs.randn(333, 129))
+    job_outputs.add_job_draws(tmp_path, {'overall': overall_draws}, dtype=np.float32)
+    _, location_draws = outputs.draws('_1')
+    np.testing.assert_array_equal(location_draws, draws['_1'][1])
+    assert 'overall' not in outputs
+
+    outputs = job_outputs.JobOutputs(tmp_path)
+    assert outputs.groups == ['_1', 'overall']
+    days, added_draws = outputs.draws('overall')
+    np.testing.assert_array_equal(days, overall_draws[0])
+    assert added_draws.dtype == np.float32
+    assert job_outputs.JobOutputs(tmp_path).overall_inputs() is not None
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from covid_model_deaths.job_queue import JobQueue
+
+
+def test_job_queue(tmp_path):
+    queue = JobQueue(tmp_path / 'queue')
+    for i in range(20):
+        queue.put(f'job_{i:02d}', {'model_location_id': i})
+    assert len(queue.pending) == 20
+
+    def drain(worker):
+        claimed = []
+        # each worker has its own handle on the directory, as on separate nodes
+        worker_queue = JobQueue(tmp_path / 'queue')
+        job = worker_queue.claim()
+        while job is not None:
+            job_name, spec = job
+            worker_queue.complete(job_name, {'worker': worker, 'location_id': spec['model_location_id']})
+            claimed.append(job_name)
+            job = worker_queue.claim()
+        return claimed
+
+    with ThreadPoolExecutor(4) as pool:
+        claimed = [job_name for worker_claimed in pool.map(drain, range(4)) for job_name in worker_claimed]
+
+    assert sorted(claimed) == [f'job_{i:02d}' for i in range(20)]
+    assert queue.pending == [] and queue.running == []
+    assert len(queue.done) == 20
+    assert queue.record('job_07')['location_id'] == 7
+
+
+def test_requeue_stale(tmp_path):
+    queue = JobQueue(tmp_path / 'queue')
+    queue.put('job_0', {'model_location_id': 0})
+    queue.put('job_1', {'model_location_id': 1})
+    assert queue.claim('dead_worker') == ('job_0', {'model_location_id': 0})
+    assert queue.claim_info('job_0')['worker'] == 'dead_worker'
+    assert queue.requeue_stale(timeout=60.) == []
+    assert queue.running == ['job_0']
+
+    assert queue.requeue_stale(timeout=-1.) == ['job_0']
+    assert queue.running == [] and queue.pending == ['job_0', 'job_1']
+    # the job is claimed again as it was first queued
+    assert queue.claim('worker') == ('job_0', {'model_location_id': 0})
+    queue.complete('job_0', {'worker': 'worker'})
+    assert queue.running == [] and queue.done == ['job_0']
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from covid_model_deaths import model_average
+
+
+def _draw_file(path, rs, first_date, n_observed):
+    dates = pd.date_range(first_date, periods=40)
+    draws = []
+    for location_id, location in [(523, 'Alabama'), (555, 'New York')]:
+        daily = np.exp(rs.randn(len(dates), len(model_average.DRAW_COLUMNS)) + np.linspace(1, 6, len(dates))[:, None])
+        daily[:n_observed] = daily[:n_observed, [0]]
+        location_draws = pd.DataFrame(daily.cumsum(axis=0), columns=model_average.DRAW_COLUMNS)
+        location_draws.insert(0, 'location_id', location_id)
+        location_draws.insert(1, 'location', location)
+        location_draws.insert(2, 'date', dates)
+        location_draws.insert(3, 'observed', np.arange(len(dates)) < n_observed)
+        draws.append(location_draws)
+    pd.concat(draws).to_csv(path, index=False)
+    return str(path)
+
+
+def test_float32_moving_average(tmp_path):
+    rs = np.random.RandomState(2020)
+    paths = [_draw_file(tmp_path / 'today.csv', rs, '2020-03-10', 12),
+             _draw_file(tmp_path / 'yesterday.csv', rs, '2020-03-10', 11),
+             _draw_file(tmp_path / 'day_before_yesterday.csv', rs, '2020-03-10', 10)]
+
+    expected = model_average.moving_average_predictions(*paths)
+    actual = model_average.moving_average_predictions(*paths, dtype=np.float32)
+    assert (actual[model_average.DRAW_COLUMNS].dtypes == np.float32).all()
+    assert (expected[model_average.DRAW_COLUMNS].dtypes == np.float64).all()
+    pd.testing.assert_frame_equal(expected[model_average.INDEX_COLUMNS], actual[model_average.INDEX_COLUMNS])
+
+    report = model_average.draw_tolerance_report(expected, actual)
+    assert list(report.index) == ['draws', 'mean', 'lower', 'upper']
+    assert (report['max_rel_error'] < 1e-6).all()
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas.testing as pdt
+import pytest
+
+from covid_model_deaths.preprocessing import moving_average
+
+
+@pytest.mark.parametrize('window', [2, 3, 5])
+def test_expanding_moving_average_by_location(death_df, window):
+    death_df['ln_death_rate'] = np.log(death_df['Death rate'])
+    # drop some days so the series have gaps to pad over
+    death_df = death_df.loc[death_df.index % 4 != 1]
+    expected = (death_df
+                .groupby('location_id')
+                .apply(lambda x: moving_average.expanding_moving_average(x, 'ln_death_rate', window)))
+    actual = moving_average.expanding_moving_average_by_location(death_df, 'ln_death_rate', window)
+    pdt.assert_series_equal(expected, actual)
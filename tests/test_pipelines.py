@@ -0,0 +1,37 @@
+import functools
+
+import numpy as np
+import pytest
+
+from covid_model_deaths import pipelines
+
+
+def _stub_pipeline(seed, n_draws):
+    # like ap_model's pipelines: seeded on its own, then consuming the global random state
+    np.random.seed(seed)
+    return np.random.randn(n_draws), np.random.randint(100, size=n_draws)
+
+
+def _run(threads):
+    np.random.seed(2020)
+    seeds = np.random.randint(2**32, size=3)
+    stubs = [functools.partial(_stub_pipeline, seed, 50) for seed in seeds]
+    return pipelines.run_pipelines(stubs, threads)
+
+
+def test_run_pipelines_sequential_matches_parallel():
+    sequential = _run(threads=1)
+    for threads in [2, 3]:
+        for (draws, ints), (expected_draws, expected_ints) in zip(_run(threads), sequential):
+            np.testing.assert_array_equal(draws, expected_draws)
+            np.testing.assert_array_equal(ints, expected_ints)
+
+
+def test_thread_budget():
+    assert pipelines.pipeline_group_processes(1, 2) == 1
+    assert pipelines.pipeline_group_processes(5, 2) == 2
+    assert pipelines.pipeline_group_processes(3, 1) == 3
+    with pytest.raises(ValueError):
+        pipelines.pipeline_group_processes(0, 2)
+    with pytest.raises(ValueError):
+        pipelines.run_pipelines([lambda: None], threads=0)
@@ -0,0 +1,36 @@
+import sys
+
+import pytest
+
+from covid_model_deaths import scheduler
+
+
+def _touch_jobs(tmp_path, n_jobs):
+    return [scheduler.SchedulerJob(job_name=f'job_{i}',
+                                   command=f'{sys.executable} -c "open(\'{tmp_path}/{i}.txt\', \'w\')"')
+            for i in range(n_jobs)]
+
+
+def test_qsub_scheduler(tmp_path):
+    qsub = scheduler.QsubScheduler(qsub=scheduler.LOCAL_QSUB, concurrency=3)
+    responses = qsub.submit(_touch_jobs(tmp_path, 5))
+    assert responses[2].endswith('("job_2") has been submitted')
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f'{i}.txt' for i in range(5)]
+
+
+def test_array_job_scheduler(tmp_path):
+    array = scheduler.ArrayJobScheduler(tmp_path, qsub=scheduler.LOCAL_QSUB)
+    responses = array.submit(_touch_jobs(tmp_path, 4))
+    assert len(responses) == 4
+    assert responses[0].startswith('Your job-array')
+    assert {f'{i}.txt' for i in range(4)} <= {p.name for p in tmp_path.iterdir()}
+
+    # each submission has its own manifest, so queued tasks of earlier ones run their own commands
+    array.submit(_touch_jobs(tmp_path, 2))
+    assert len(list(tmp_path.glob('curve_model_*_manifest.txt'))) == 2
+
+
+def test_scheduler_retries(tmp_path):
+    failing = scheduler.QsubScheduler(qsub='false', max_attempts=3, initial_backoff=0.01)
+    with pytest.raises(scheduler.SubmissionError, match='3 attempts'):
+        failing.submit(_touch_jobs(tmp_path, 1))
@@ -0,0 +1,31 @@
+import pandas.testing as pdt
+
+from covid_model_deaths import shared_inputs
+
+
+def _get_rows(location_id):
+    df = shared_inputs.worker_input('death_df')
+    return df.loc[df['location_id'] == location_id], shared_inputs.worker_input('scale')
+
+
+def test_shared_input_pool(death_df):
+    location_ids = death_df['location_id'].unique()[:10]
+    with shared_inputs.shared_input_pool(2, death_df=death_df, scale=2) as pool:
+        results = pool.map(_get_rows, location_ids, shared_inputs.chunk_size(len(location_ids), 2))
+    for location_id, (rows, scale) in zip(location_ids, results):
+        pdt.assert_frame_equal(rows, death_df.loc[death_df['location_id'] == location_id])
+        assert scale == 2
+
+
+def _get_frame(_):
+    return shared_inputs.worker_input('death_df')
+
+
+def test_shared_input_pool_missing_strings(death_df):
+    # strings are mapped as codes, unless some are missing
+    death_df = death_df.iloc[:50].copy()
+    death_df.loc[3, 'Country/Region'] = None
+    with shared_inputs.shared_input_pool(2, death_df=death_df) as pool:
+        frames = pool.map(_get_frame, range(2), 1)
+    for frame in frames:
+        pdt.assert_frame_equal(frame, death_df)